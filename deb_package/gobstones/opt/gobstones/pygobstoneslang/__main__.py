@@ -103,6 +103,12 @@ class GbsOptions(object):
         '--output-type X',
         '--language X',
         '--recursion',
+        '--jit',
+        '--max-steps X',
+        '--max-call-depth X',
+        '--max-board-cells X',
+        '--max-time X',
+        '--no-cache',
         '--names',
         '--keyset'
     ]
@@ -163,6 +169,11 @@ class GbsOptions(object):
         self.check(options)
         if options['size']:
             options['size'] = [int(x) for x in options['size']]
+        for k in ['max-steps', 'max-call-depth', 'max-board-cells']:
+            if options[k] is not None:
+                options[k] = int(options[k])
+        if options['max-time'] is not None:
+            options['max-time'] = float(options['max-time'])
 
         return options
 
@@ -175,6 +186,9 @@ class GbsOptions(object):
             raise OptionsException(i18n.i18n('%s is not a valid lint option.') % (options['lint'],))
         if not self.check_size(options['size']):
             raise OptionsException(i18n.i18n('Size %s is not a valid size. Positive integers expected.') % (str(options['size']),))
+        for k in ['max-steps', 'max-call-depth', 'max-board-cells', 'max-time']:
+            if not self.check_limit(options[k], k == 'max-time'):
+                raise OptionsException(i18n.i18n('%s is not a valid value for %s. A positive number expected.') % (options[k], '--' + k))
 
     def check_size(self, size):
         if size:
@@ -187,6 +201,17 @@ class GbsOptions(object):
                 return False
         return True
 
+    def check_limit(self, limit, fractional=False):
+        if limit is None:
+            return True
+        try:
+            if fractional:
+                return float(limit) > 0
+            else:
+                return utils.is_int(limit) and int(limit) > 0
+        except ValueError:
+            return False
+
     def check_file_exists(self, filename):
         if not os.path.exists(filename):
             raise OptionsException(i18n.i18n('File %s does not exist') % (filename,))
@@ -288,7 +313,13 @@ def run_filename(filename, options):
         options['lint'],
         options['liveness'],
         options['typecheck'],
-        allow_recursion=options["recursion"]
+        jit=options['jit'],
+        allow_recursion=options["recursion"],
+        max_steps=options['max-steps'],
+        max_call_depth=options['max-call-depth'],
+        max_board_cells=options['max-board-cells'],
+        max_time=options['max-time'],
+        use_cache=options['cache']
         )
 
     if options['interactive']:
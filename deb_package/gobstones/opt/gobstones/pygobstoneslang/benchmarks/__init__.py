@@ -0,0 +1,41 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Benchmarks of the language implementation.
+
+Each module can be run on its own, e.g.:
+
+    python -m pygobstoneslang.benchmarks.bench_lexer
+"""
+
+import time
+
+def best_time(f, repeat=3):
+    "Returns the best wall time in seconds of repeated calls to f."
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, old_time, new_time):
+    print '%-24s old %8.3fs   new %8.3fs   speedup %5.2fx' % (
+        name, old_time, new_time, old_time / max(new_time, 1e-9))
@@ -322,6 +322,16 @@ ES = {
         'Variable no inicializada: "%s"',
     'Self destruction:':
         'Autodestrucción:',
+    'Execution limit exceeded':
+        'Límite de ejecución excedido',
+    'The program executed more than %s steps':
+        'El programa ejecutó más de %s pasos',
+    'The program ran for more than %s seconds':
+        'El programa se ejecutó durante más de %s segundos',
+    'The program made more than %s nested calls':
+        'El programa hizo más de %s llamadas anidadas',
+    'The board has more than %s cells':
+        'El tablero tiene más de %s celdas',
     'Identifier refers to a primitive type and can not be projected.':
         'El identificador denota un tipo primitivo y no puede ser proyectado.',
     'Expression has no matching branch.':
@@ -334,6 +344,7 @@ ES = {
   # builtin runtime errors
     'Division by zero': 'División por cero',
     'Negative exponent': 'Potencia con exponente negativo',
+    'Integer overflow': 'Desbordamiento de enteros',
     'Empty list': 'Lista vacía',
     '%s was expected': 'Se esperaba un %s',
     '%s type was expected': 'Se esperaba un tipo %s',
@@ -390,6 +401,8 @@ ES = {
 
 # other errors
   'File %s does not exist': 'El archivo "%s" no existe.',
+  '%s is not a valid value for %s. A positive number expected.':
+    '%s no es un valor válido para %s. Se esperaba un número positivo.',
 
 # getter-setter fields
     #'last': 'ultimo',
@@ -535,6 +548,11 @@ Opciones:
           [no-]colors               .fig: [No] usar colores
           [no-]color-names          .fig: [No] mostrar nombres de colores
   --jit                           Habilitar compilación Just in Time
+  --max-steps <n>                 Límite de pasos de la máquina virtual
+  --max-call-depth <n>            Límite de llamadas anidadas
+  --max-board-cells <n>           Límite de celdas del tablero
+  --max-time <segundos>           Límite de tiempo de ejecución
+  --no-cache                      No usa el caché de programas compilados
   --print-jit                     Mostrar instrucciones del JIT
   --print-native                  Mostrar código nativo obtenido por el JIT
   --license                       Muestra la licencia del programa
@@ -682,6 +700,7 @@ Otros usos:
   'Returned variables': 'Variables devueltas',
   'No returned variables': 'Ninguna',
   'No result': 'No se obtuvo un resultado',
+  'Executed %s steps in %.3f seconds': 'Se ejecutaron %s pasos en %.3f segundos',
 
 # Test driver
   'Starting problem %s': 'Problema %s.',
@@ -718,6 +737,11 @@ Options:
   --no-print-retvals            Don't output the return values
   --compact                     Use compact format for dumping .gbb and .gbo files
   --jit                         Enable Just in Time compiler
+  --max-steps <n>               Limit the virtual machine steps
+  --max-call-depth <n>          Limit the nested calls
+  --max-board-cells <n>         Limit the cells of the board
+  --max-time <seconds>          Limit the running time
+  --no-cache                    Don't use the cache of compiled programs
   --print-jit                   Print JIT instructions
   --print-native                Print JIT native code
 
@@ -755,6 +779,13 @@ Other usages:
 
 Language = ES
 
+def language_code():
+  "Return a short code identifying the current language."
+  for code, dictionary in [('ES', ES), ('EN', EN)]:
+    if Language is dictionary:
+      return code
+  return 'custom-%x' % (id(Language),)
+
 def i18n(s):
   # return the original string if no translation is found
   # TODO: Proper use of unicode strings
@@ -35,6 +35,9 @@ import gbs_pprint
 import gbs_infer
 import gbs_compiler
 import gbs_board
+import gbs_cache
+import gbs_incremental
+from jit import gbs_jit
 from grammar import GbsGrammarFile, XGbsGrammarFile
 from gbs_api import GobstonesOptions, GobstonesRun, ExecutionAPI
 
@@ -51,7 +54,11 @@ class Gobstones(object):
         self.typecheck = gbs_infer.typecheck
         self.compile_program = gbs_compiler.compile_program
 
-        self.make_runnable = gbs_vm.VmCompiledRunnable
+        limits = self.options.execution_limits()
+        if self.options.jit:
+            self.make_runnable = lambda compiled_program: gbs_jit.make_runnable(compiled_program, limits)
+        else:
+            self.make_runnable = lambda compiled_program: gbs_vm.VmCompiledRunnable(compiled_program, limits)
 
 
     def _parse(self, program_text, filename):
@@ -73,12 +80,19 @@ class Gobstones(object):
     def check(self, tree):
         # Check semantics
         self.api.log(i18n.i18n('Performing semantic checks.'))
-        self.lint(tree, strictness=self.options.lint_mode, allow_recursion=self.options.allow_recursion)
+        types = self.lint(tree, strictness=self.options.lint_mode, allow_recursion=self.options.allow_recursion)
         # Check liveness
         if self.options.check_liveness:
             self.check_live_variables(tree)
         # Check types [TODO]
         # self.typecheck(tree, self.options.check_types)
+        return types
+
+    def check_incrementally(self, filename, program_text):
+        """Parses and checks the program like parse and check, reusing
+        what did not change since the last time the same file was checked
+        in this process."""
+        return gbs_incremental.checker_for(filename, self.options).check(self, program_text)
 
     def parse_names(self, filename, program_text):
         return gbs_parser.parse_names(program_text, filename, grammar_file=self.options.get_lang_grammar())
@@ -93,15 +107,26 @@ class Gobstones(object):
         self.explode_macros(tree)
         return GobstonesRun().initialize(tree)
 
-    def compile(self, filename, program_text):
+    def _compile(self, filename, program_text):
         gbs_run = self.parse(filename, program_text)
         tree = gbs_run.tree
         # Check semantics, liveness and types
-        self.check(tree)
+        types = self.check(tree)
         # Compile program
         self.api.log(i18n.i18n('Compiling.'))
-        gbs_run.compiled_program = self.compile_program(tree)
-        return gbs_run
+        compiled_program = self.compile_program(tree)
+        return gbs_cache.CompiledProgram(tree, compiled_program, types)
+
+    def compile(self, filename, program_text):
+        if self.options.use_cache:
+            compiled = gbs_cache.compile_cached(
+                            lambda: self._compile(filename, program_text),
+                            filename, program_text,
+                            self.options.get_lang_grammar(),
+                            self.options.check_options())
+        else:
+            compiled = self._compile(filename, program_text)
+        return GobstonesRun().initialize(compiled.tree, compiled.compiled_program)
 
     def run_object_code(self, compiled_program, initial_board):
         # Make runnable
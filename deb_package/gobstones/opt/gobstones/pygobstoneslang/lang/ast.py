@@ -143,6 +143,12 @@ def _infixr(subtrees, action):
 class ASTNode(position.ProgramElement):
     "Represents an internal node of an abstract syntax tree."
 
+    # Programs have many nodes, so the attributes every node has are
+    # kept in slots. Any other attribute goes to the instance dict,
+    # which is only created for the nodes that need one.
+    __slots__ = ('children', 'pos_begin', 'pos_end',
+                 'live_in', 'live_out', 'live_gen', 'annotations')
+
     def __init__(self, children, pos_begin, pos_end):
         position.ProgramElement.__init__(self)
 
@@ -347,25 +353,33 @@ class ASTBuilder(object):
         elif len(action) == 1:
             return self._expand_action_part(subtrees, action[0], uniq=True)
         else:
-            dispatch = {
-                '++': self._expand_action_concatenate,
-                'INFIXL': _infixl,
-                'INFIXR': _infixr,
-                'NEGATE': self._expand_action_negate,
-                'MKFIELD': self._expand_action_mkfield,
-                'SYMBOL': self._expand_action_symbol,
-                'RISSYMBOL': self._expand_action_right_is_symbol,
-                'LIST': self._expand_action_list,
-                'varName/funcCall': self._expand_action_varname_funccall,
-                'procedure': self._expand_action_procedure_def,
-                'entrypoint': self._expand_action_entrypoint_def,
-                'procCall/assignVarName': self._expand_action_proccall_assignvarname,
-                'literal/construct': self._expand_action_literal_or_construct,
-                'CONSTRUCTFIELDS': self._expand_action_constructfields,
-            }
-            expand = dispatch.get(action[0], self._expand_action_default)
+            expand = getattr(self, ASTBuilder.Action_methods.get(
+                                        action[0], '_expand_action_default'))
             return expand(subtrees, action)
 
+    # Methods that expand the actions of more than one part, by the
+    # first part of the action. Any other action is expanded by
+    # _expand_action_default.
+    Action_methods = {
+        '++': '_expand_action_concatenate',
+        'INFIXL': '_expand_action_infixl',
+        'INFIXR': '_expand_action_infixr',
+        'NEGATE': '_expand_action_negate',
+        'MKFIELD': '_expand_action_mkfield',
+        'SYMBOL': '_expand_action_symbol',
+        'RISSYMBOL': '_expand_action_right_is_symbol',
+        'LIST': '_expand_action_list',
+        'varName/funcCall': '_expand_action_varname_funccall',
+        'procedure': '_expand_action_procedure_def',
+        'entrypoint': '_expand_action_entrypoint_def',
+        'procCall/assignVarName': '_expand_action_proccall_assignvarname',
+        'literal/construct': '_expand_action_literal_or_construct',
+        'CONSTRUCTFIELDS': '_expand_action_constructfields',
+    }
+
+    _expand_action_infixl = staticmethod(_infixl)
+    _expand_action_infixr = staticmethod(_infixr)
+
     def _expand_action_constructfields(self, subtrees, action):
         """Expands the constructor arguments"""
         pos_b = self._pos_begin(subtrees)
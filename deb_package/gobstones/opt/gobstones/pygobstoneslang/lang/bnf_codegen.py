@@ -0,0 +1,353 @@
+#
+# Copyright (C) 2011, 2012 Pablo Barenbaum <foones@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Generates recursive-descent parsers for LL(1) grammars.
+
+The generated parser is a Python module with a function for each
+nonterminal of the grammar. It chooses the same productions as
+bnf_parser.Parser.parse and runs the semantic actions of the
+productions as ast.ASTBuilder.build_ast_from does, but builds the
+AST directly instead of going through a stream of parsing events.
+"""
+
+import os
+import imp
+import tempfile
+
+import pygobstoneslang.common.utils as utils
+
+import bnf_parser
+import ast
+
+# Bump when the generated code changes, so that the parsers generated
+# by previous versions are regenerated.
+CODEGEN_VERSION = 1
+
+def _header(bnf_hash):
+    "Returns the first line of a parser generated for the given grammar."
+    return '# bnf hash: %s, codegen version: %u\n' % (bnf_hash, CODEGEN_VERSION)
+
+_prelude = '''#
+# Generated by pygobstoneslang.lang.bnf_codegen. Do not edit.
+#
+
+# Set by bnf_codegen when the module is loaded.
+ASTNode = None
+
+class _State(object):
+    "Lookahead, last consumed token and AST builder of a parse."
+
+    __slots__ = ('parser', 'builder', 'tokens', 'token', 'previous')
+
+    def __init__(self, parser, builder, token_stream):
+        self.parser = parser
+        self.builder = builder
+        self.tokens = token_stream
+        self.previous = next(token_stream) # BOF
+        self.token = next(token_stream)
+
+    def advance(self):
+        # The token that follows a consumed one is only read when
+        # needed, after the actions that it completes have been run.
+        self.token = next(self.tokens)
+        return self.token
+
+    def expect(self, terminal):
+        tok = self.token
+        if tok is None:
+            tok = self.advance()
+        if tok.type != terminal:
+            self.error(terminal, tok)
+        self.previous = tok
+        self.token = None
+        self.builder.starting_position = tok.pos_end
+        return tok
+
+    def error(self, symbol, tok):
+        self.parser.parse_error(symbol, self.previous, tok)
+
+def parse(parser, builder, token_stream):
+    "Parses a token stream and returns the AST built by the actions."
+    return %(start)s(_State(parser, builder, token_stream))
+'''
+
+class ParserGenerator(object):
+    """Generates the source of a recursive-descent parser for the grammar
+    of the given bnf_parser.Parser."""
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.predictions = parser.predictions()
+        self._names = {}
+        self._constants = []
+        self._lines = []
+
+    def _function_name(self, nonterminal):
+        if nonterminal not in self._names:
+            self._names[nonterminal] = '_p%u' % (len(self._names),)
+        return self._names[nonterminal]
+
+    def _constant(self, value):
+        "Returns the name of a module level constant with the given value."
+        name = '_c%u' % (len(self._constants),)
+        self._constants.append('%s = %r\n' % (name, value))
+        return name
+
+    def _emit(self, indent, line):
+        self._lines.append('    ' * indent + line + '\n')
+
+    def generate(self, bnf_hash):
+        "Returns the source of the parser module."
+        nonterminals = utils.seq_sorted(self.predictions.keys())
+        for nonterminal in nonterminals:
+            self._function_name(nonterminal)
+        for nonterminal in nonterminals:
+            self._generate_nonterminal(nonterminal)
+        # nonterminals that are used but have no productions
+        for nonterminal in utils.seq_sorted(self._names.keys()):
+            if nonterminal not in self.predictions:
+                self._generate_nonterminal(nonterminal)
+        return ''.join([_header(bnf_hash),
+                        _prelude % {'start': self._function_name('<start>')},
+                        '\n'] + self._constants + ['\n'] + self._lines)
+
+    def _productions(self, nonterminal):
+        """Returns the productions of the nonterminal that parse may choose,
+        in the order of the grammar, and the table from terminals to their
+        index in that list."""
+        chosen = self.predictions.get(nonterminal, {})
+        productions = []
+        for production in self.parser.syntax.get(nonterminal, []):
+            if production in chosen.values():
+                productions.append(production)
+        table = {}
+        for terminal, production in chosen.items():
+            table[terminal] = productions.index(production)
+        return productions, table
+
+    def _generate_nonterminal(self, nonterminal):
+        productions, table = self._productions(nonterminal)
+        function = self._function_name(nonterminal)
+        recursive = [self._is_tail_recursive(nonterminal, production)
+                     for production in productions]
+        self._emit(0, 'def %s(st):' % (function,))
+        self._emit(1, '# %s' % (nonterminal,))
+        if True in recursive:
+            self._generate_loop(nonterminal, productions, table, recursive)
+        else:
+            self._generate_choice(nonterminal, productions, table)
+        self._emit(0, '')
+
+    def _is_tail_recursive(self, nonterminal, production):
+        return len(production.rule) > 1 and production.rule[-1] == nonterminal
+
+    def _generate_lookahead(self, indent, table):
+        self._emit(indent, 'tok = st.token')
+        self._emit(indent, 'if tok is None:')
+        self._emit(indent + 1, 'tok = st.advance()')
+        self._emit(indent, 'k = %s.get(tok.type)' % (self._constant(table),))
+
+    def _generate_choice(self, nonterminal, productions, table):
+        self._generate_lookahead(1, table)
+        for i, production in enumerate(productions):
+            self._emit(1, 'if k == %u:' % (i,))
+            if production.rule == ('',):
+                self._emit(2, 'return None')
+                continue
+            self._emit(2, 's = %s' % (self._subtrees(production.rule),))
+            self._generate_action(2, production)
+            self._emit(2, 'return value')
+        self._emit(1, 'st.error(%r, tok)' % (nonterminal,))
+
+    def _generate_loop(self, nonterminal, productions, table, recursive):
+        """Right recursive productions, as the ones of lists, are parsed
+        in a loop. The actions of the productions are run afterwards,
+        from the innermost to the outermost one."""
+        self._emit(1, 'frames = []')
+        self._emit(1, 'while True:')
+        self._generate_lookahead(2, table)
+        for i, production in enumerate(productions):
+            self._emit(2, 'if k == %u:' % (i,))
+            if recursive[i]:
+                self._emit(3, 'frames.append((%u, %s))' % (
+                                i, self._subtrees(production.rule[:-1])))
+                self._emit(3, 'continue')
+            elif production.rule == ('',):
+                self._emit(3, 'value = None')
+                self._emit(3, 'break')
+            else:
+                self._emit(3, 's = %s' % (self._subtrees(production.rule),))
+                self._generate_action(3, production)
+                self._emit(3, 'break')
+        self._emit(2, 'st.error(%r, tok)' % (nonterminal,))
+        self._emit(1, 'while frames:')
+        self._emit(2, 'k, s = frames.pop()')
+        self._emit(2, 's.append(value)')
+        for i, production in enumerate(productions):
+            if recursive[i]:
+                self._emit(2, 'if k == %u:' % (i,))
+                self._generate_action(3, production)
+        self._emit(1, 'return value')
+
+    def _subtrees(self, symbols):
+        """Returns an expression that parses the given symbols and builds
+        the list of subtrees that the action of a production receives,
+        labelled with its first symbol."""
+        parts = [repr(symbols[0])]
+        for symbol in symbols:
+            if bnf_parser.is_nonterminal(symbol):
+                parts.append('%s(st)' % (self._function_name(symbol),))
+            else:
+                parts.append('st.expect(%r)' % (symbol,))
+        return '[%s]' % (', '.join(parts),)
+
+    ## Actions. See ast.ASTBuilder._expand_action.
+
+    def _pos_begin(self, rule):
+        if bnf_parser.is_nonterminal(rule[0]):
+            return 'st.builder._pos_begin(s)'
+        else:
+            return 's[1].pos_begin'
+
+    def _pos_end(self, rule):
+        if bnf_parser.is_nonterminal(rule[-1]):
+            return 'st.builder._pos_end(s)'
+        else:
+            return 's[-1].pos_end'
+
+    def _generate_action(self, indent, production):
+        """Emits the code that runs the action of the production on the
+        subtrees s and leaves the result in value."""
+        action = production.action
+        try:
+            lines = self._action_code(production)
+        except ValueError:
+            lines = ['value = st.builder._expand_action(s, %s)' % (
+                        self._constant(action),)]
+        for line in lines:
+            self._emit(indent, line)
+
+    def _action_code(self, production):
+        rule = production.rule
+        action = production.action
+        positions = ['pb = %s' % (self._pos_begin(rule),),
+                     'pe = %s' % (self._pos_end(rule),)]
+        if action is None:
+            if len(rule) == 1:
+                return ['value = s[1]']
+            else:
+                return ['value = s']
+        elif len(action) == 1:
+            part = action[0]
+            if part[0] == '$':
+                return positions + [
+                    'value = s[%u]' % (int(part[1:]),),
+                    'if value is not None:',
+                    '    value.pos_begin = pb',
+                    '    value.pos_end = pe']
+            elif part[0] == '[' and part[-1] == ']':
+                return positions + ['value = %s' % (self._action_part(part),)]
+            return ['value = %s' % (self._action_part(part),)]
+        elif action[0] in ast.ASTBuilder.Action_methods:
+            return ['value = st.builder.%s(s, %s)' % (
+                        ast.ASTBuilder.Action_methods[action[0]],
+                        self._constant(action))]
+        else:
+            parts = [self._action_part(part) for part in action]
+            return positions + ['value = ASTNode([%s], pb, pe)' % (
+                                    ', '.join(parts),)]
+
+    def _action_part(self, part):
+        """Returns an expression for a part of an action, which may refer
+        to the subtrees s and their positions pb and pe."""
+        if part == '[]':
+            return 'ASTNode([], pb, pe)'
+        elif part == 'None':
+            return 'None'
+        elif part[0] == '[' and part[-1] == ']':
+            return 'ASTNode([%s], pb, pe)' % (self._action_part(part[1:-1]),)
+        elif part[0] == '$':
+            return 's[%u]' % (int(part[1:]),)
+        else:
+            return repr(part)
+
+def generate_parser(parser, bnf_hash):
+    """Returns the source of a recursive-descent parser module for the
+    grammar of the given bnf_parser.Parser."""
+    return ParserGenerator(parser).generate(bnf_hash)
+
+#### Generated parsers are saved as Python modules, so that their
+#### compiled code is cached as any other module's. A module is
+#### regenerated when the hash of the grammar it was generated for, or
+#### the version of the generator, does not match.
+
+def _is_current(filename, bnf_hash):
+    "Returns True iff the file holds a parser generated for the grammar."
+    try:
+        f = open(filename, 'r')
+        try:
+            return f.readline() == _header(bnf_hash)
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return False
+
+def _write_source(filename, source):
+    """Atomically store the source in the given file. Returns False if
+    the file could not be written."""
+    try:
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.py')
+        f = os.fdopen(fd, 'w')
+        try:
+            f.write(source)
+        finally:
+            f.close()
+        os.chmod(tmp_filename, 0644)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        return False
+    return True
+
+def _bind(module):
+    module.ASTNode = ast.ASTNode
+    return module
+
+def load_parser(parser, bnf_hash, filenames):
+    """Returns the generated parser module for the grammar of the given
+    bnf_parser.Parser, whose hash is bnf_hash. The module is looked for
+    in the given files, and generated and saved to the first writable
+    one if none of them is current."""
+    module_name = 'gbs_generated_parser_%s' % (bnf_hash,)
+    for filename in filenames:
+        if _is_current(filename, bnf_hash):
+            try:
+                return _bind(imp.load_source(module_name, filename))
+            except (IOError, OSError, SyntaxError, ImportError):
+                continue
+    source = generate_parser(parser, bnf_hash)
+    for filename in filenames:
+        if _write_source(filename, source):
+            try:
+                return _bind(imp.load_source(module_name, filename))
+            except (IOError, OSError, SyntaxError, ImportError):
+                continue
+    module = imp.new_module(module_name)
+    exec compile(source, '<%s>' % (module_name,), 'exec') in module.__dict__
+    return _bind(module)
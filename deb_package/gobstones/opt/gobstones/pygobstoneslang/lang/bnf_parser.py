@@ -20,7 +20,10 @@ from grammar import XGbsGrammarFile
 The grammar is read in BNF format from a text file.
 """
 
+import os
 import re
+import marshal
+import tempfile
 
 import pygobstoneslang.common.position as position
 import pygobstoneslang.common.i18n as i18n
@@ -56,16 +59,48 @@ def fake_bof():
     pos = position.Position('', '')
     return position.ProgramAreaNear(Token('BOF', 'BOF', pos, pos))
 
+def master_regexp(tokens):
+    """Returns a regexp that matches, at any position, the first of the
+    given token regexps that matches there, or None if they cannot be
+    combined into a single regexp. The i-th token regexp is wrapped in the
+    group named T<i>, so token regexps should not refer to their groups
+    by number."""
+    alternatives = ['(?P<T%u>%s)' % (i, tok_regexp.pattern)
+                    for i, (_, tok_regexp) in enumerate(tokens)]
+    if len(set([tok_regexp.flags for _, tok_regexp in tokens])) > 1:
+        return None
+    try:
+        return re.compile('|'.join(alternatives))
+    except (re.error, AssertionError, OverflowError):
+        # e.g. too many groups for the re module
+        return None
+
 class Lexer(object):
     "Lexical analyzer."
 
-    def __init__(self, tokens, reserved, warn=utils.std_warn):
+    def __init__(self, tokens, reserved, warn=utils.std_warn, compiled=True):
         self.tokens = tokens
         self.reserved = reserved
         self.warn = warn
+        self._master_regexp = None
+        if compiled:
+            self._master_regexp = master_regexp(tokens)
+        if self._master_regexp is not None:
+            groups = self._master_regexp.groupindex
+            self._group_types = {}
+            for i, (tok_type, _) in enumerate(tokens):
+                self._group_types[groups['T%u' % (i,)]] = tok_type
 
     def pure_tokenize(self, string, filename='...'):
         "Generates a stream of tokens for the given string."
+        if self._master_regexp is None:
+            return self._pure_tokenize_sequential(string, filename)
+        else:
+            return self._pure_tokenize_compiled(string, filename)
+
+    def _pure_tokenize_sequential(self, string, filename):
+        """Tries every token regexp in turn at each position of the
+        string."""
         pos = position.Position(string, filename)
         previous_token = Token('BOF', 'BOF', pos, pos)
         yield previous_token
@@ -87,6 +122,31 @@ class Lexer(object):
                 pos = next_pos
         yield Token('EOF', 'EOF', pos, pos)
 
+    def _pure_tokenize_compiled(self, string, filename):
+        """Matches the master regexp once per token. All the positions
+        share the same SourceFile."""
+        match_at = self._master_regexp.match
+        group_types = self._group_types
+        Position = position.Position
+        source = position.SourceFile(string, filename)
+        pos = Position(source)
+        yield Token('BOF', 'BOF', pos, pos)
+        start = 0
+        length = len(string)
+        while start < length:
+            match = match_at(string, start)
+            if match is None:
+                tok_type = 'ERROR'
+                end = start + 1
+            else:
+                tok_type = group_types[match.lastindex]
+                end = match.end()
+            next_pos = Position(source, start=end)
+            yield Token(tok_type, string[start:end], pos, next_pos)
+            pos = next_pos
+            start = end
+        yield Token('EOF', 'EOF', pos, pos)
+
     def tokenize(self, string, filename='...'):
         """Generates a stream of tokens for the given string,
         ignoring whitespace and comments, and recognizing reserved
@@ -99,6 +159,25 @@ class Lexer(object):
             else:
                 yield tok
 
+    def token_starts(self, string):
+        """Generates the type and the starting offset of each token that
+        tokenize would yield for the given string (except BOF and EOF),
+        without building the tokens. Unrecognized symbols are skipped."""
+        if self._master_regexp is None:
+            for tok in Lexer.tokenize(self, string):
+                if tok.type not in ['BOF', 'EOF', 'ERROR']:
+                    yield tok.type, tok.pos_begin.start
+            return
+        group_types = self._group_types
+        reserved = set(self.reserved)
+        for match in self._master_regexp.finditer(string):
+            tok_type = group_types[match.lastindex]
+            if tok_type != 'WHITESPACE' and tok_type != 'COMMENT':
+                value = match.group()
+                if value in reserved:
+                    tok_type = value
+                yield tok_type, match.start()
+
 class Production(object):
     "Represents a production with rule and possibly an associated action."
 
@@ -124,18 +203,53 @@ def bnf_rule_to_str(rule):
 class Parser(object):
     "Parser for LL(1) grammars."
 
-    def __init__(self, syntax, warn=utils.std_warn):
+    def __init__(self, syntax, warn=utils.std_warn, tables=None):
         self.syntax = syntax
         self.warn = warn
 
-        self._first = None
-        self._build_first()
+        if tables is not None:
+            self._load_tables(tables)
+        else:
+            self._first = None
+            self._build_first()
 
-        self._follow = None
-        self._build_follow()
+            self._follow = None
+            self._build_follow()
 
-        self._parse_table = None
-        self._build_table()
+            self._parse_table = None
+            self._build_table()
+
+        self._finalize_table()
+
+    def dump_tables(self):
+        """Returns the FIRST and FOLLOW sets and the parsing table as plain
+        data. Productions are referred to by their index in the syntax."""
+        table = {}
+        for (nonterminal, terminal), productions in self._parse_table.items():
+            indexes = []
+            for i, production in enumerate(self.syntax[nonterminal]):
+                if id(production) in productions:
+                    indexes.append(i)
+            table[(nonterminal, terminal)] = indexes
+        return {
+            'first': dict([(nt, s.keys()) for nt, s in self._first.items()]),
+            'follow': dict([(nt, s.keys()) for nt, s in self._follow.items()]),
+            'table': table,
+        }
+
+    def _load_tables(self, tables):
+        "Restores the tables previously returned by dump_tables."
+        self._first = {}
+        for nonterminal, symbols in tables['first'].items():
+            self._first[nonterminal] = set_new(symbols)
+        self._follow = {}
+        for nonterminal, symbols in tables['follow'].items():
+            self._follow[nonterminal] = set_new(symbols)
+        self._parse_table = {}
+        for (nonterminal, terminal), indexes in tables['table'].items():
+            for i in indexes:
+                self._fill_table(nonterminal, terminal,
+                                 self.syntax[nonterminal][i])
 
     def all_nonterminals(self):
         "Returns all the nonterminals that have productions in the grammar."
@@ -299,44 +413,84 @@ class Parser(object):
                         self._parse_table[(nonterminal, terminal)]))
         self.warn(ParserException(msg, area))
 
+    def _finalize_table(self):
+        """Builds the table used by parse. Symbols are numbered so that
+        nonterminals come first, conflicts are resolved by choosing the
+        lexically least production and, for each production, the sequence
+        of symbol numbers to push on the stack is computed once.
+
+        self._finalized[n] maps the number of a terminal to a tuple
+        (symbols_to_push, first_symbol, production) for the n-th
+        nonterminal."""
+        nonterminals = set_new(self.all_nonterminals())
+        terminals = set_new()
+        for (nonterminal, terminal) in self._parse_table.keys():
+            set_add(nonterminals, nonterminal)
+            set_add(terminals, terminal)
+        for productions in self.syntax.values():
+            for production in productions:
+                for symbol in production.rule:
+                    if is_nonterminal(symbol):
+                        set_add(nonterminals, symbol)
+                    elif symbol != '':
+                        set_add(terminals, symbol)
+
+        self._symbols = seq_sorted(nonterminals.keys()) + \
+                        seq_sorted(terminals.keys())
+        self._symbol_number = {}
+        for i, symbol in enumerate(self._symbols):
+            self._symbol_number[symbol] = i
+        self._num_nonterminals = len(nonterminals.keys())
+
+        self._finalized = [{} for _ in range(self._num_nonterminals)]
+        for (nonterminal, terminal), productions in self._parse_table.items():
+            # in case of conflict, choose the lexically least production
+            production = utils.dict_min_value(productions,
+                                              key=lambda p: p.rule)
+            push = tuple([self._symbol_number[symbol]
+                          for symbol in utils.seq_reversed(production.rule)
+                          if symbol != ''])
+            entry = (push, production.rule[0], production)
+            nt_number = self._symbol_number[nonterminal]
+            self._finalized[nt_number][self._symbol_number[terminal]] = entry
+
+    def predictions(self):
+        """Returns a dict that maps each nonterminal to a dict from the
+        terminals to the production that parse chooses for them."""
+        res = {}
+        for i, entries in enumerate(self._finalized):
+            res[self._symbols[i]] = dict([
+                (self._symbols[terminal], entry[2])
+                for terminal, entry in entries.items()
+            ])
+        return res
+
     def parse(self, token_stream):
         "Parse a token stream."
-        stack = ['<start>']
+        symbol_number = self._symbol_number
+        num_nonterminals = self._num_nonterminals
+        table = self._finalized
+        stack = [symbol_number['<start>']]
         previous_token = next(token_stream) # BOF
         token = next(token_stream)
-        while stack != []:
+        token_type = symbol_number.get(token.type, -1)
+        while stack:
             top = stack[-1]
-            if is_nonterminal(top):
-                productions = self._parse_table.get((top, token.type), None)
-                if productions is not None:
-                    #if len(productions) != 1:
-                    #  self._warn_conflict(
-                    #       top,
-                    #       token.type,
-                    #       position.ProgramAreaNear(token))
-                    # in case of conflict, choose the lexically least production
-                    production = utils.dict_min_value(
-                                    productions,
-                                    key=lambda p: p.rule)
-                    stack.pop()
-
-                    res_nonterm = None
-                    for nonterm in utils.seq_reversed(production.rule):
-                        if nonterm != '':
-                            stack.append(nonterm)
-                        res_nonterm = nonterm
-
-                    yield 'PRODUCE', res_nonterm, production
-                else:
-                    self.parse_error(top, previous_token, token)
+            if top < num_nonterminals:
+                entry = table[top].get(token_type, None)
+                if entry is None:
+                    self.parse_error(self._symbols[top], previous_token, token)
+                stack.pop()
+                stack.extend(entry[0])
+                yield 'PRODUCE', entry[1], entry[2]
+            elif top == token_type:
+                yield 'CONSUME', self._symbols[top], token
+                previous_token = token
+                token = next(token_stream)
+                token_type = symbol_number.get(token.type, -1)
+                stack.pop()
             else:
-                if top == token.type:
-                    yield 'CONSUME', top, token
-                    previous_token = token
-                    token = next(token_stream)
-                    stack.pop()
-                else:
-                    self.parse_error(top, previous_token, token)
+                self.parse_error(self._symbols[top], previous_token, token)
 
 def remove_comment_in_line(line):
     "Remove comment part from line."
@@ -362,6 +516,52 @@ def _bnf_unescape(contents):
         contents = contents.replace(escaped, original)
     return contents
 
+#### Persisted parsing tables.
+####
+#### Building the FIRST/FOLLOW sets and the parsing table of a grammar is
+#### the most expensive part of creating an Analyzer. The resulting tables
+#### (and the token list) can be saved to a file, tagged with a format
+#### version and the hash of the grammar contents, and reused by later
+#### processes as long as the grammar does not change.
+
+TABLES_VERSION = 1
+
+def read_tables(filename, bnf_hash):
+    """Return the tables stored in the given file, or None if the file
+    does not exist, is unreadable or was built for another grammar."""
+    try:
+        f = open(filename, 'rb')
+        try:
+            tables = marshal.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(tables, dict) or \
+       tables.get('version') != TABLES_VERSION or \
+       tables.get('hash') != bnf_hash:
+        return None
+    return tables
+
+def write_tables(filename, tables):
+    """Atomically store the tables in the given file. Returns False if
+    the file could not be written."""
+    try:
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_filename = tempfile.mkstemp(dir=directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            marshal.dump(tables, f)
+        finally:
+            f.close()
+        os.chmod(tmp_filename, 0644)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        return False
+    return True
+
 class Analyzer(object):
     """Represents a syntax analyzer for a given BNF LL(1) grammar.
     anAnalyzer.parse(string) is a generator that yields two kinds of
@@ -389,13 +589,21 @@ class Analyzer(object):
         #   bnf_contents: raw string
         #   bnf_filename: filename
         #   warn: warning function
+        #   tables_filenames: list of files where the precomputed
+        #                     tables may be found. The tables are
+        #                     saved to the first writable one when
+        #                     they have to be rebuilt.
 
         self.lexer_class = lexer_class
         self.parser_class = parser_class
         self.warn = kwargs.get('warn', utils.std_warn)
+        self.tables_filenames = kwargs.get('tables_filenames', [])
 
         self.lexer = None
-        self.parser = None
+        self._parser = None
+        self._syntax = None
+        self._tables = None
+        self._bnf_hash = None
 
         assert ('bnf_contents' in kwargs) != ('bnf_filename' in kwargs)
         if 'bnf_contents' in kwargs:
@@ -408,7 +616,29 @@ class Analyzer(object):
         self._read_bnf(utils.read_file(filename))
 
     def _read_bnf(self, bnf_contents):
-        "Builds the parser reading the BNF grammar from the given string."
+        """Builds the lexer reading the BNF grammar from the given string.
+        The parser is built when first needed (see the parser property)."""
+        self._bnf_hash = utils.md5sum(bnf_contents)
+        for filename in self.tables_filenames:
+            self._tables = read_tables(filename, self._bnf_hash)
+            if self._tables is not None:
+                break
+
+        if self._tables is not None:
+            tokens = [(tok_type, re.compile(tok_regexp))
+                      for tok_type, tok_regexp in self._tables['tokens']]
+            reserved = self._tables['reserved']
+            self._syntax = {}
+            for nonterminal, rules in self._tables['syntax'].items():
+                self._syntax[nonterminal] = [Production(rule) for rule in rules]
+        else:
+            tokens, reserved, self._syntax = self._read_bnf_rules(bnf_contents)
+
+        self.lexer = self.lexer_class(tokens, reserved, self.warn)
+
+    def _read_bnf_rules(self, bnf_contents):
+        """Returns the tokens, the reserved words and the syntax (a dict
+        from nonterminals to productions) defined by the BNF grammar."""
         tokens = []
         reserved = []
         syntax = {}
@@ -433,9 +663,42 @@ class Analyzer(object):
                 syntax[head] = [Production(prod) for prod in rules]
             else:
                 tokens.append((head, re.compile(BNF_ALT_SEQ.join(rules))))
+        return tokens, reserved, syntax
 
-        self.lexer = self.lexer_class(tokens, reserved, self.warn)
-        self.parser = self.parser_class(syntax, self.warn)
+    def _get_parser(self):
+        if self._parser is None:
+            if self._tables is not None:
+                self._parser = self.parser_class(self._syntax, self.warn,
+                                                 tables=self._tables)
+            else:
+                self._parser = self.parser_class(self._syntax, self.warn)
+                self._save_tables()
+            self._tables = None
+        return self._parser
+
+    parser = property(_get_parser)
+
+    def bnf_hash(self):
+        "Returns the hash of the contents of the grammar."
+        return self._bnf_hash
+
+    def _save_tables(self):
+        "Saves the tables of the parser to the first writable tables file."
+        if self.tables_filenames == []:
+            return
+        tables = self._parser.dump_tables()
+        tables['version'] = TABLES_VERSION
+        tables['hash'] = self._bnf_hash
+        tables['tokens'] = [(tok_type, tok_regexp.pattern)
+                            for tok_type, tok_regexp in self.lexer.tokens]
+        tables['reserved'] = list(self.lexer.reserved)
+        tables['syntax'] = dict([
+            (nonterminal, [repr(production) for production in productions])
+            for nonterminal, productions in self._syntax.items()
+        ])
+        for filename in self.tables_filenames:
+            if write_tables(filename, tables):
+                break
 
     Escape_sequences = [
         # ( original, escaped, translate_to_escaped)
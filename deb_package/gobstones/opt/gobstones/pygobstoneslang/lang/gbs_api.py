@@ -18,6 +18,7 @@
 
 from grammar import GbsGrammarFile, XGbsGrammarFile
 import gbs_io
+import gbs_vm
 
 """ Gobstones API classes """
 
@@ -30,13 +31,28 @@ class GobstonesOptions(object):
         Gobstones = "Gobstones3.0"
         XGobstones = "XGobstones"
     LINT_MODES = ['lax', 'strict']
-    def __init__(self, lang_version=LangVersion.Gobstones, lint_mode="lax", check_liveness=False, check_types=False, jit=False, allow_recursion=False):
+    def __init__(self, lang_version=LangVersion.Gobstones, lint_mode="lax", check_liveness=False, check_types=False, jit=False, allow_recursion=False,
+                 max_steps=None, max_call_depth=None, max_board_cells=None, max_time=None,
+                 use_cache=True):
         self.lint_mode = lint_mode
         self.check_liveness = check_liveness
         self.check_types = check_types
         self.jit = jit        
         self.lang_version = lang_version
         self.allow_recursion = allow_recursion
+        self.max_steps = max_steps
+        self.max_call_depth = max_call_depth
+        self.max_board_cells = max_board_cells
+        self.max_time = max_time
+        self.use_cache = use_cache
+
+    def execution_limits(self):
+        return gbs_vm.ExecutionLimits(self.max_steps, self.max_call_depth,
+                                      self.max_board_cells, self.max_time)
+
+    def check_options(self):
+        "Returns the options that change the result of checking a program."
+        return (self.lint_mode, self.allow_recursion, self.check_liveness)
 
     def get_lang_grammar(self):
         if self.lang_version == self.LangVersion.Gobstones:
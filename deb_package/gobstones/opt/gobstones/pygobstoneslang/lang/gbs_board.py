@@ -17,6 +17,7 @@
 
 """Representation of Gobstones boards."""
 
+import array
 import random
 
 import pygobstoneslang.common.utils as utils
@@ -51,61 +52,68 @@ def rand_side():
     return int(side)
 
 class Cell(object):
-    "Represents a Gobstones board cell."
-
-    def __init__(self, parent=None):
-        self.stones = {}
-        self.parent = parent
+    """Represents a Gobstones board cell.
+
+    A cell is a view over NUM_COLORS consecutive stone counts of an
+    array of integers, which is usually the array holding the contents
+    of a whole board. In that case changes go through the board, so
+    that they can be undone. A cell created on its own owns its array."""
+
+    __slots__ = ('_stones', '_offset', '_board')
+
+    def __init__(self, stones=None, offset=0, board=None):
+        if stones is None:
+            stones = _empty_counts(1)
+        self._stones = stones
+        self._offset = offset
+        self._board = board
+
+    def _set_count(self, i, count):
+        "Set the count at index i of the underlying array."
+        if self._board is None:
+            self._stones = _set_count_in(self._stones, i, count)
+        else:
+            self._board._set_count(i, count)
+            self._stones = self._board._stones
 
     def randomize(self):
         """Randomizes the cell, filling it with a random number of
         stones for each color."""
         for i in range(gbs_builtins.NUM_COLORS):
-            self.stones[i] = self.stones.get(i, 0) + stone_dist()
+            self.put(i, stone_dist())
 
     def put(self, coli, count=1):
         """Add `count` stones of the given color index `coli`.
         Note that `coli` is a color index (ord), not an instance of
         gbs_builtins.Color."""
-        self.stones[coli] = self.stones.get(coli, 0) + count
+        i = self._offset + coli
+        self._set_count(i, self._stones[i] + count)
 
     def take(self, coli, count=1):
         """Takes a stone of the given color index `coli`. Note
         that `coli` is a color index (ord), not an instance of
         gbs_builtins.Color. Raise a SelfDestructionException if
         there are no stones of the given color."""
-        cnt = self.stones.get(coli, 0)
-        if cnt >= count:
-            self.stones[coli] = cnt - count
-        else:
-            if self.parent is None:
-                raise SelfDestructionException(i18n.i18n('Cannot take stones'))
-            else:
-                self.merge_with(self.parent)
-                self.parent = None
-                cnt = self.stones.get(coli, 0)
-                self.stones[coli] = cnt - count
+        i = self._offset + coli
+        if self._stones[i] < count:
+            raise SelfDestructionException(i18n.i18n('Cannot take stones'))
+        self._set_count(i, self._stones[i] - count)
 
     def set_num_stones(self, coli, count):
         """Set the number of stones of the given color index `coli`
         to `count`. Note that `coli` is a color index (ord), not an instance of
         gbs_builtins.Color."""
-        self.stones[coli] = count
+        self._set_count(self._offset + coli, count)
 
     def num_stones(self, coli):
         """Return the number of stones of the given color index `coli`.
         Note that `coli` is a color index (ord), not an instance of
         gbs_builtins.Color."""
-        if self.parent is None:
-            return self.stones.get(coli, 0)
-        else:
-            return self.stones.get(coli, 0) + self.parent.num_stones(coli)
+        return self._stones[self._offset + coli]
 
     def num_total_stones(self):
-        total = 0
-        for ci, cn in self.all_stones_count():
-            total += cn
-        return total
+        offset = self._offset
+        return sum(self._stones[offset:offset + gbs_builtins.NUM_COLORS])
 
     def clone(self):
         "Return a new cell with the same contents as this one."
@@ -116,23 +124,14 @@ class Cell(object):
     def all_stones_count(self):
         """Return a list of tuples (colori, count) describing the amount
         of stones for each color."""
-        if self.parent is None:
-            return self.stones.items()
-        else:
-            sum = {}
-            for col, count in self.parent.all_stones_count():
-                sum[col] = count
-            for col, count in self.stones.items():
-                sum[col] = sum.get(col,0) + count
-            return sum.items()
-
+        offset = self._offset
+        return list(enumerate(self._stones[offset:offset + gbs_builtins.NUM_COLORS]))
 
     def merge_with(self, other):
         """Set the contents of this cell to be equal to the contents of
         the other cell."""
         for col, count in other.all_stones_count():
             self.put(col, count)
-        
 
     def clone_from(self, other):
         """!!DEPRECATED!! Set the contents of this cell to be equal to the contents of
@@ -143,13 +142,7 @@ class Cell(object):
     def equal_contents(self, other):
         """Return a boolean indicating if this cell has the same contents
         as the other cell."""
-        for col, count in self.stones.items():
-            if other.num_stones(col) != count:
-                return False
-        for col, count in other.stones.items():
-            if self.num_stones(col) != count:
-                return False
-        return True
+        return self.all_stones_count() == other.all_stones_count()
 
     #### Human-friendly API
 
@@ -211,23 +204,162 @@ class Cell(object):
 Cell.init_color_properties()
 ##
 
+def _empty_counts(num_cells):
+    "Return an array of stone counts for the given number of empty cells."
+    return array.array('i', [0]) * (num_cells * gbs_builtins.NUM_COLORS)
+
+def _counts_array(counts):
+    """Return an array with the given stone counts, or a list if some
+    count does not fit in a machine integer."""
+    try:
+        return array.array('i', counts)
+    except OverflowError:
+        return list(counts)
+
+def _set_count_in(stones, i, count):
+    """Set the count at index i of the given counts, and return them.
+    If the count does not fit in the array, the counts are moved to a
+    list of Python integers, which is returned instead."""
+    try:
+        stones[i] = count
+    except OverflowError:
+        stones = list(stones)
+        stones[i] = count
+    return stones
+
+def _equal_counts(stones1, stones2):
+    "Return True iff both sequences of stone counts are equal."
+    if type(stones1) is not type(stones2):
+        stones1, stones2 = list(stones1), list(stones2)
+    return stones1 == stones2
+
+class _CellRow(object):
+    "A row of cells of a board, indexed by the x coordinate."
+
+    __slots__ = ('_board', '_offset', '_width')
+
+    def __init__(self, board, offset, width):
+        self._board = board
+        self._offset = offset
+        self._width = width
+
+    def __len__(self):
+        return self._width
+
+    def __getitem__(self, x):
+        if not 0 <= x < self._width:
+            raise IndexError(x)
+        return Cell(self._board._stones, self._offset + x * gbs_builtins.NUM_COLORS, self._board)
+
+    def __iter__(self):
+        for x in range(self._width):
+            yield self[x]
+
+class _CellGrid(object):
+    """The cells of a board, indexed by the y coordinate and then by
+    the x coordinate, as in board.cells[y][x]."""
+
+    __slots__ = ('_board',)
+
+    def __init__(self, board):
+        self._board = board
+
+    def __len__(self):
+        return self._board.size[1]
+
+    def __getitem__(self, y):
+        width, height = self._board.size
+        if not 0 <= y < height:
+            raise IndexError(y)
+        row_size = width * gbs_builtins.NUM_COLORS
+        return _CellRow(self._board, y * row_size, width)
+
+    def __iter__(self):
+        for y in range(len(self)):
+            yield self[y]
+
 class Board(object):
-    """Represents a Gobstones board."""
-    MAX_RECURSION_DEPTH = 10
+    """Represents a Gobstones board.
+
+    The contents of the board are kept in a flat array with
+    NUM_COLORS stone counts per cell, the cells in row major order.
+    Cells are views over that array. If a count does not fit in a
+    machine integer, the array is replaced by a list of Python
+    integers.
 
-    def __init__(self, size=(1,1), parent=None):
+    Snapshots of the board are taken with push_state and restored
+    with pop_state. Each snapshot keeps the head and the original
+    count of each entry changed since it was taken, so both
+    operations are proportional to the number of changed entries
+    rather than to the size of the board."""
+
+    def __init__(self, size=(1,1)):
         self.size = size
-        self.parent = parent
-        self.changed = False
-        if self.parent is None:
-            self.recursion_depth = 0
-        else:
-            self.recursion_depth = self.parent.recursion_depth + 1
         self.head = (0, 0)
-        self.cells = None
+        self._stones = None
+        self._snapshots = []
         self._clear_board()
         self.invalid = False
 
+    def _cell_offset(self):
+        "Return the offset of the current cell in the array of counts."
+        y, x = self.head
+        return (y * self.size[0] + x) * gbs_builtins.NUM_COLORS
+
+    @property
+    def cells(self):
+        """Cells of the board, such that board.cells[y][x] is the cell
+        at column x and row y."""
+        return _CellGrid(self)
+
+    def push_state(self):
+        "Take a snapshot of the contents and head of the board."
+        self._snapshots.append((self.head, {}))
+
+    def pop_state(self):
+        """Restore the contents and head of the board to the last
+        snapshot taken, and discard it."""
+        head, saved = self._snapshots.pop()
+        stones = self._stones
+        for i, count in saved.iteritems():
+            stones = _set_count_in(stones, i, count)
+        self._stones = stones
+        self.head = head
+
+    def _set_count(self, i, count):
+        """Set the count at index i of the array of counts, recording
+        the original count in the innermost snapshot."""
+        if self._snapshots:
+            saved = self._snapshots[-1][1]
+            if i not in saved:
+                saved[i] = self._stones[i]
+        try:
+            self._stones[i] = count
+        except OverflowError:
+            self._stones = _set_count_in(self._stones, i, count)
+
+    def _save_all(self):
+        """Record the original count of every entry in the innermost
+        snapshot, before replacing the whole array of counts."""
+        if self._snapshots:
+            saved = self._snapshots[-1][1]
+            for i, count in enumerate(self._stones):
+                if i not in saved:
+                    saved[i] = count
+
+    def stone_counts(self):
+        """Return the array of stone counts of the board, with
+        NUM_COLORS counts per cell and cells in row major order."""
+        return self._stones
+
+    def set_stone_counts(self, counts):
+        """Set the contents of the board from an array of stone counts
+        laid out as in stone_counts."""
+        width, height = self.size
+        assert len(counts) == width * height * gbs_builtins.NUM_COLORS
+        self._save_all()
+        self._stones = _counts_array(counts)
+
     def resize(self, width, height):
         "Change the size of the board to width x height."
         self.clone_from(Board((width, height)))
@@ -257,12 +389,10 @@ class Board(object):
         self.head = y, x
 
     def _clear_board(self):
-        "Clear the contents of this board, parent remains unmodified."
+        "Clear the contents of this board."
         width, height = self.size
-        if self.parent is None:
-            self.cells = [[Cell() for _ in range(width)] for _ in range(height)]
-        else:
-            self.cells = [[Cell(self.parent.cells[y][x]) for x in range(width)] for y in range(height)]
+        self._save_all()
+        self._stones = _empty_counts(width * height)
 
     def clear_board(self):
         """Clear the contents of the board"""
@@ -270,21 +400,19 @@ class Board(object):
 
     def hard_clear_board(self):
         "Fully clear the contents of the board."
-        width, height = self.size
-        self.parent = None
-        self.cells = [[Cell() for _ in range(width)] for _ in range(height)]
+        self._clear_board()
 
     def put_stone(self, color, count=1):
         """Put a stone of the given color in the current cell."""
-        y, x = self.head
-        self.cells[y][x].put(color.ord(), count)
-        self.changed = True
+        i = self._cell_offset() + color.ord()
+        self._set_count(i, self._stones[i] + count)
 
     def take_stone(self, color, count=1):
         """Take a stone of the given color from the current cell."""
-        y, x = self.head
-        self.cells[y][x].take(color.ord(), count)
-        self.changed = True
+        i = self._cell_offset() + color.ord()
+        if self._stones[i] < count:
+            raise SelfDestructionException(i18n.i18n('Cannot take stones'))
+        self._set_count(i, self._stones[i] - count)
 
     def move(self, direction, count=1):
         """Move the head to the given direction.
@@ -305,14 +433,12 @@ class Board(object):
     def num_stones(self, color):
         """Return the number of stones of the given color in the current
         cell."""
-        y, x = self.head
-        return self.cells[y][x].num_stones(color.ord())
+        return self._stones[self._cell_offset() + color.ord()]
 
     def exist_stones(self, color):
         """Return True iff there are stones of the given color in the
         current cell."""
-        y, x = self.head
-        return self.cells[y][x].num_stones(color.ord()) > 0
+        return self._stones[self._cell_offset() + color.ord()] > 0
 
     def can_move(self, direction, count=1):
         """Return True iff the head can move in the given direction
@@ -338,6 +464,7 @@ class Board(object):
         self.size = rand_side(), rand_side()
         self.randomize_contents()
 
+
     def randomize_contents(self):
         """Randomize the board contents and head position.
         Keep the original size."""
@@ -382,22 +509,9 @@ class Board(object):
 
     def clone(self):
         "Return a copy of this board."
-        if self.recursion_depth == Board.MAX_RECURSION_DEPTH:
-            copy = Board(self.size)
-            copy.clone_from(self)
-            return copy
-        else:
-            if self.changed or self.parent is None:
-                parent = Board(self.size)
-                parent.clone_from(self)
-                self.parent = parent
-                self.clear_board()
-            else:
-                parent = self.parent
-
-            other_child = Board(self.size, parent)
-            other_child.head = self.head
-            return other_child
+        copy = Board(self.size)
+        copy.clone_from(self)
+        return copy
 
     def clone_from(self, other):
         """Set the contents of this board to the contents of the other board."""
@@ -406,13 +520,9 @@ class Board(object):
     def _restore_from(self, other):
         "Set the contents of this board to the contents of the other board."
         self.size = other.size
-        self._clear_board()
-        assert self.size == other.size
-        width, height = other.size
         self.head = other.head
-        for x in range(width):
-            for y in range(height):
-                self.cells[y][x] = other.cells[y][x].clone()
+        self._save_all()
+        self._stones = other._stones[:]
 
     def __repr__(self):
         import board.formats as formats
@@ -423,20 +533,16 @@ class Board(object):
     def equal_contents(self, other):
         """Return True iff the contents of the board are equal to the
         contents of the other board."""
-        if self.size != other.size:
-            return False
-        width, height = self.size
-        for x in range(width):
-            for y in range(height):
-                if not self.cells[y][x].equal_contents(other.cells[y][x]):
-                    return False
-        return True
+        return self.size == other.size and _equal_counts(self._stones, other._stones)
 
     #### Human-friendly API
 
     def __getitem__(self, xy):
         x, y = xy
-        return self.cells[y][x]
+        width, height = self.size
+        assert 0 <= x and x < width
+        assert 0 <= y and y < height
+        return Cell(self._stones, (y * width + x) * gbs_builtins.NUM_COLORS, self)
 
     def goto(self, x, y):
         "Move the head to the position (x, y)."
@@ -165,15 +165,17 @@ namespace of routines.
         elif prfn == 'procedure' and len(params) > 1:
             immutable_params = params[1:]
 
+        # the parameters take the first slots of the routine
         code = gbs_vm.GbsCompiledCode(tree, prfn, name, params, self.explicit_board)
         code.add_enter()
         for p in immutable_params:
-                code.push(('setImmutable', p), near=tree)
+                code.push(('setImmutable', code.slot(p)), near=tree)
         self.compile_commands(def_helper.get_def_body(tree), code)
         if prfn == 'procedure' and self.explicit_board:
-            code.push(('pushFrom', params[0]), near=tree)
+            code.push(('pushFrom', code.slot(params[0])), near=tree)
         code.add_leave_return()
         code.build_label_table()
+        code.link(self.code.builtins)
         self.code.routines[name] = code
 
     #### The following methods take a program fragment in form of an AST
@@ -242,7 +244,7 @@ namespace of routines.
         code.push(('call', procname, len(args)), near=tree)
 
         if self.explicit_board:
-            code.push(('popTo', inout_var.children[1].value), near=tree)
+            code.push(('popTo', code.slot(inout_var.children[1].value)), near=tree)
 
 
     def compile_projectable_var_check(self, tree, code, var):
@@ -258,7 +260,7 @@ namespace of routines.
             #calculate assignment reference
             var = tree.children[1].children[1].value
             self.compile_projectable_var_check(tree, code, var)
-            code.push(('pushFrom', var), near=tree)
+            code.push(('pushFrom', code.slot(var)), near=tree)
             for offset in offsets:
                 if offset.children[0] == 'index':
                     self.compile_expression(offset.children[1], code)
@@ -275,14 +277,14 @@ namespace of routines.
             self.compile_expression(tree.children[3], code)
             #assign varname
             full_varname = '.'.join([tok.value for tok in tree.children[1].children[1:]])
-            code.push(('popTo', full_varname), near=tree)
+            code.push(('popTo', code.slot(full_varname)), near=tree)
 
     def compile_assign_var_tuple1(self, tree, code):
         "Compile a tuple assignment: (v1, ..., vN) := f(...)"
         self.compile_expression(tree.children[2], code)
         varnames = [var.value for var in tree.children[1].children]
         for var in utils.seq_reversed(varnames):
-            code.push(('popTo', var), near=tree)
+            code.push(('popTo', code.slot(var)), near=tree)
 
     def compile_if(self, tree, code):
         "Compile a conditional statement."
@@ -319,7 +321,7 @@ namespace of routines.
 
         self.compile_expression(value, code)
         # value0 := value
-        code.push(('popTo', value0), near=tree)
+        code.push(('popTo', code.slot(value0)), near=tree)
 
         lend = GbsLabel()
         next_label = None
@@ -330,7 +332,7 @@ namespace of routines.
                 lits = [parse_literal(lit) for lit in branch.children[1].children]
                 next_label = GbsLabel()
                 # if value0 in LitsI
-                code.push(('pushFrom', value0), near=tree)
+                code.push(('pushFrom', code.slot(value0)), near=tree)
                 code.push(('jumpIfNotIn', lits, next_label), near=tree)
                 # BodyI
                 self.compile_block(branch.children[2], code)
@@ -364,7 +366,7 @@ namespace of routines.
         # This is a runtime function to extract type name
         code.push(('call', '_extract_case', 1), near=tree)
         # value0 := value
-        code.push(('popTo', value0), near=tree)
+        code.push(('popTo', code.slot(value0)), near=tree)
 
         lend = GbsLabel()
         next_label = None
@@ -376,7 +378,7 @@ namespace of routines.
                 case_i = parse_literal(branch.children[1])
                 next_label = GbsLabel()
                 # if value0 in LitsI
-                code.push(('pushFrom', value0), near=tree)
+                code.push(('pushFrom', code.slot(value0)), near=tree)
                 code.push(('pushConst', case_i), near=tree)
                 code.push(('call', '==', 2), near=tree)
                 code.push(('jumpIfFalse', next_label), near=tree)
@@ -411,12 +413,11 @@ namespace of routines.
         # Compiles to code corresponding to
         # the following fragment:
         #
-        #   counter := <Expr>
-        #   while (true) {
-        #     if (not (counter > 0)) { break }
+        #   iterInit counter repeat   (<Expr>)
+        #   while (iterNext counter) {
         #     <Block>
-        #     counter := counter - 1
         #   }
+        #   iterEnd counter
         #
 
         times = tree.children[1]
@@ -424,27 +425,14 @@ namespace of routines.
         counter = self.temp_varname()
         lbegin = GbsLabel()
         lend = GbsLabel()
-        # counter := <Expr>
         self.compile_expression(times, code)
-        code.push(('popTo', counter), near=tree)
-        # while (true) {
+        code.push(('iterInit', code.slot(counter), 'repeat'), near=tree)
         code.push(('label', lbegin), near=tree)
-        #   if (not (counter > 0) { break }
-        code.push(('pushFrom', counter), near=tree)
-        code.push(('pushConst', 0), near=tree)
-        code.push(('call', '>', 2), near=tree)
-        code.push(('jumpIfFalse', lend), near=tree)
-        #   <Block>
+        code.push(('iterNext', code.slot(counter), lend), near=tree)
         self.compile_block(body, code)
-        #   counter := counter - 1
-        code.push(('pushFrom', counter), near=tree)
-        code.push(('pushConst', 1), near=tree)
-        code.push(('call', '-', 2), near=tree)
-        code.push(('popTo', counter), near=tree)
-        # end while
         code.push(('jump', lbegin), near=tree)
         code.push(('label', lend), near=tree)
-        code.push(('delVar', counter), near=tree)
+        code.push(('iterEnd', code.slot(counter)), near=tree)
 
     def compile_foreach(self, tree, code):
         "Compile a foreach statement."
@@ -454,63 +442,48 @@ namespace of routines.
         # Compiles to code corresponding to
         # the following fragment:
         #
-        #   xs0 := <List>
-        #   if (not isEmpty(xs0)) {
-        #       while (true) {
-        #         if (isEmpty(xs0)) break;
-        #         <Index> := head(xs0)
-        #         setImmutable(<Index>)
-        #         <Block>
-        #         unsetImmutable(<Index>)
-        #         xs0 := tail(xs)
-        #       }
+        #   iterInit xs0 list   (<List>)
+        #   while (iterNext xs0 <Index>) {
+        #     setImmutable(<Index>)
+        #     <Block>
+        #     unsetImmutable(<Index>)
         #   }
+        #   iterEnd xs0 <Index>
+        #
+        # Ranges are not built as lists: their bounds are given to
+        # iterInit instead.
         #
-        def jumpIfIsEmpty(var, label):
-            code.push(('pushFrom', var), near=tree)
-            code.push(('call', i18n.i18n('isEmpty'), 1), near=tree)
-            code.push(('call', 'not', 1), near=tree)
-            code.push(('jumpIfFalse', label), near=tree)
-        def head(listVar, var):
-            code.push(('pushFrom', listVar), near=tree)
-            code.push(('call', i18n.i18n('head'), 1), near=tree)
-            code.push(('popTo', var), near=tree)
-        def tail(listVar, var):
-            code.push(('pushFrom', listVar), near=tree)
-            code.push(('call', i18n.i18n('tail'), 1), near=tree)
-            code.push(('popTo', var), near=tree)
-
         index = tree.children[1].value
         list_ = tree.children[2]
         body = tree.children[3]
         xs0 = self.temp_varname()
         lbegin = GbsLabel()
         lend = GbsLabel()
-        lend2 = GbsLabel()
-        # xs0 := <List>
-        self.compile_expression(list_, code)
-        code.push(('popTo', xs0), near=tree)
-        # if (not isEmpty(xs0)) {
-        jumpIfIsEmpty(xs0, lend)
-        # while (true) {
+        kind = self.compile_iterable(list_, code)
+        code.push(('iterInit', code.slot(xs0), kind), near=tree)
         code.push(('label', lbegin), near=tree)
-        #   <Index> := head(xs0)
-        head(xs0, index)
-        #   setImmutable(<Index>)
-        code.push(('setImmutable', index), near=tree)
-        #   <Block>
+        code.push(('iterNext', code.slot(xs0), lend, code.slot(index)), near=tree)
+        code.push(('setImmutable', code.slot(index)), near=tree)
         self.compile_block(body, code)
-        #   setImmutable(<Index>)
-        code.push(('unsetImmutable', index), near=tree)
-        #   xs0 := tail(xs0)
-        tail(xs0, xs0)
-        #   if (isEmpty(xs0)) break;
-        jumpIfIsEmpty(xs0, lend2)
-        # }}
+        code.push(('unsetImmutable', code.slot(index)), near=tree)
         code.push(('jump', lbegin), near=tree)
-        code.push(('label', lend2), near=tree)
-        code.push(('delVar', index), near=tree)
         code.push(('label', lend), near=tree)
+        code.push(('iterEnd', code.slot(xs0), code.slot(index)), near=tree)
+
+    def compile_iterable(self, tree, code):
+        """Compile the values iterated by a foreach, returning the kind
+        of iteration (see iterInit in gbs_vm)."""
+        if tree.children[0] == 'funcCall' and tree.children[1].value == '_range':
+            first, last, second = tree.children[2].children
+            self.compile_expression(first, code)
+            self.compile_expression(last, code)
+            if second.children[0] == 'literal' and \
+               second.children[1].value == 'NoSecondElementForRange':
+                return 'range'
+            self.compile_expression(second, code)
+            return 'steppedRange'
+        self.compile_expression(tree, code)
+        return 'list'
 
     def compile_block(self, tree, code):
         "Compile a block statement."
@@ -634,7 +607,7 @@ namespace of routines.
         "Compile a variable name expression."
         offsets = tree.children[2].children
         var = tree.children[1].value
-        code.push(('pushFrom', var), near=tree)
+        code.push(('pushFrom', code.slot(var)), near=tree)
         if len(offsets) > 0:
             self.compile_projectable_var_check(tree, code, var)
             #calculate assignment reference
@@ -112,6 +112,20 @@ def recursive_replace_token(tree, search, replace, soft_mode=False):
         recursive_replace_token(node, search, replace)
   return tree
 
+def clone_tree(tree):
+    """Returns a copy of the tree whose nodes and tokens can be changed
+    without changing the original tree. Positions are shared."""
+    if isinstance(tree, ast.ASTNode):
+        clone = ast.ASTNode([clone_tree(child) for child in tree.children],
+                            tree.pos_begin, tree.pos_end)
+        clone.annotations = dict(tree.annotations)
+    elif isinstance(tree, Token):
+        clone = Token(tree.type, tree.value, tree.pos_begin, tree.pos_end)
+    else:
+        return tree
+    clone.__dict__.update(tree.__dict__)
+    return clone
+
 def is_node(label, node):
   if hasattr(node, 'children') and len(node.children) > 0:
     return node.children[0] == label
@@ -40,6 +40,10 @@ class InteractiveApi(object):
     def read(self):
         "Returns an integer representing a keycode"
         return GobstonesKeys.CTRL_D
+
+    def adapt_key(self, key):
+        "Returns the keycode seen by programs for a keycode read elsewhere"
+        return key
     
     def show(self, board):
         pass
@@ -109,7 +113,8 @@ class CrossPlatformApiAdapter(InteractiveApi):
                                  SpecialKey([27,91,68], GobstonesKeys.ARROW_LEFT),
                                  ])
     def read(self):
-        key = self.adapted_api.read();
+        return self.adapt_key(self.adapted_api.read())
+    def adapt_key(self, key):
         self.buffer.add_key(key)
         if self.buffer.matches_special_key():
             key = self.buffer.get_special_key()
@@ -30,6 +30,157 @@ class GbsLivenessException(StaticException):
 class GbsUninitializedVarException(GbsLivenessException): pass
 class GbsUnusedVarException(GbsLivenessException): pass
 
+class VariableIndex(object):
+  """Numbers the variables of a routine, so that sets of them are
+represented by integers whose i-th bit is set iff the i-th variable
+is in the set."""
+  def __init__(self):
+    self.names = []
+    self.bits = {}
+
+  def bit(self, name):
+    "Returns the bit of the variable, numbering it if it is new."
+    if name not in self.bits:
+      self.bits[name] = 1 << len(self.names)
+      self.names.append(name)
+    return self.bits[name]
+
+  def mask(self, names):
+    "Returns the set of the given variables."
+    bits = 0
+    for name in names:
+      bits |= self.bit(name)
+    return bits
+
+  def names_in(self, bits):
+    "Returns the names of the variables in the set."
+    names = []
+    i = 0
+    while bits:
+      if bits & 1:
+        names.append(self.names[i])
+      bits >>= 1
+      i += 1
+    return names
+
+class LiveSet(object):
+  """The set of variables live at a point of a routine, as left in the
+live_in and live_out attributes of its nodes. The token of the first use
+of each variable is only looked for when it is asked for."""
+  __slots__ = ('graph', 'point', 'bits')
+
+  def __init__(self, graph, point, bits):
+    self.graph = graph
+    self.point = point
+    self.bits = bits
+
+  def __contains__(self, name):
+    return self.graph.index.bits.get(name, 0) & self.bits != 0
+
+  def __len__(self):
+    return len(self.keys())
+
+  def keys(self):
+    return self.graph.index.names_in(self.bits)
+
+  def items(self):
+    "Returns (variable, token of its first use) pairs."
+    res = {}
+    for name in self.keys():
+      res[name] = self.graph.first_use(self.point, name)
+    return res.items()
+
+  def difference(self, names):
+    "Returns the set without the given variables."
+    mask = 0
+    for name in names:
+      mask |= self.graph.index.bits.get(name, 0)
+    return LiveSet(self.graph, self.point, self.bits & ~mask)
+
+  def __repr__(self):
+    return 'LiveSet(%r)' % (self.keys(),)
+
+class LivenessGraph(object):
+  """Points of a routine, each with the set of variables live at it, and
+the inclusions between them. An edge from a point to another one with a
+kill set means that the variables live at the source, except the killed
+ones, are live at the target. The variables used at a point are live
+there too."""
+  def __init__(self):
+    self.index = VariableIndex()
+    self.gen = []
+    self.gen_tokens = []
+    self.edges = []
+    self.live = None
+
+  def new_point(self):
+    self.gen.append(0)
+    self.gen_tokens.append(None)
+    self.edges.append([])
+    return len(self.gen) - 1
+
+  def add_gen(self, point, gen):
+    "Adds the variables used, given as a tokset, to the point."
+    if tokset_empty(gen):
+      return
+    if self.gen_tokens[point] is None:
+      self.gen_tokens[point] = tokset_new()
+    tokset_extend_change(self.gen_tokens[point], gen)
+    self.gen[point] |= self.index.mask(gen.keys())
+
+  def add_edge(self, source, target, kill=()):
+    self.edges[source].append((target, ~self.index.mask(kill)))
+
+  def solve(self):
+    "Computes the least sets of live variables that satisfy the inclusions."
+    live = list(self.gen)
+    edges = self.edges
+    pending = [point for point in range(len(live)) if live[point]]
+    in_pending = [False] * len(live)
+    for point in pending:
+      in_pending[point] = True
+    while pending:
+      source = pending.pop()
+      in_pending[source] = False
+      bits = live[source]
+      for target, keep in edges[source]:
+        new = live[target] | (bits & keep)
+        if new != live[target]:
+          live[target] = new
+          if not in_pending[target]:
+            in_pending[target] = True
+            pending.append(target)
+    self.live = live
+
+  def live_set(self, point):
+    return LiveSet(self, point, self.live[point])
+
+  def first_use(self, point, name):
+    """Returns the first token in the input that uses the variable and
+is reached from the point without going through a definition of it."""
+    bit = self.index.bits[name]
+    uses = []
+    for source in range(len(self.gen)):
+      if self.gen[source] & bit:
+        tok = self.gen_tokens[source][name]
+        uses.append((tokset_key(tok), source, tok))
+    uses.sort()
+    # each point is reached first from the first use that reaches it
+    reached = {}
+    for _, source, tok in uses:
+      if source in reached:
+        continue
+      reached[source] = True
+      pending = [source]
+      while pending:
+        for target, keep in self.edges[pending.pop()]:
+          if keep & bit and target not in reached:
+            reached[target] = True
+            pending.append(target)
+      if point in reached:
+        return tok
+    return None
+
 class GbsLivenessAnalyzer(object):
   """Analyzes live variables in Gobstones programs for reporting
 uses of variables that have no associated definition and, conversely,
@@ -54,45 +205,35 @@ definitions with no associated use."""
       pass
 
   def annotate_routine_def(self, tree):
+    """Builds the graph of the points of the routine, where each command
+has a point before it (in) and after it (out), and solves it with a
+worklist."""
+    self.graph = LivenessGraph()
+    self.annotated = []
+    self.returns = []
     block = def_helper.get_def_body(tree)
-    block.live_out = tokset_new()
-    # iterate until a fixed point is met
-    self.change = True
-    while self.change:
-      self.change = False
-      self.annotate_body(block)
-
-  def _live_in(self, tree, s):
-    """Extend the live_in set of the tree with s, recording if this
-modifies the current state of the analysis."""
-    if tree.live_in is None:
-      tree.live_in = {}
-    if tokset_extend_change(tree.live_in, s):
-      self.change = True
-
-  def _live_out(self, tree, s):
-    """Extend the live_out set of the tree with s, recording if this
-modifies the current state of the analysis."""
-    if tree.live_out is None:
-      tree.live_out = {}
-    if tokset_extend_change(tree.live_out, s):
-      self.change = True
-
-  def _live_out_loop(self, tree, minus=None):
-    if tree.live_in is not None:
-      s = tree.live_in
-      if minus is not None:
-        s = tokset_difference(s, minus)
-      self._live_out(tree, s)
-
-  def annotate_body(self, tree):
-    s = tree.live_out
+    self.annotate_body(block, self.graph.new_point())
+    self.graph.solve()
+    for node, in_, out in self.annotated:
+      node.live_in = self.graph.live_set(in_)
+      node.live_out = self.graph.live_set(out)
+    for out in self.returns:
+      assert self.graph.live[out] == 0
+
+  def annotate_body(self, tree, out):
+    """Adds the points of a block whose out point is given, and returns
+its in point."""
+    s = out
     for cmd in seq_reversed(tree.children):
-      self.annotate_cmd(cmd, s)
-      s = cmd.live_in
-    self._live_in(tree, s)
+      s = self.annotate_cmd(cmd, s)
+    in_ = self.graph.new_point()
+    self.graph.add_edge(s, in_)
+    self.annotated.append((tree, in_, out))
+    return in_
 
   def annotate_cmd(self, tree, next_block_in):
+    """Adds the points of a command followed by the given point, and
+returns its in point."""
     command = tree.children[0]
     dispatch = {
       'Skip': self.annotate_Skip,
@@ -110,135 +251,116 @@ modifies the current state of the analysis."""
       'return': self.annotate_return,
     }
     assert command in dispatch
-    self._live_out(tree, next_block_in)
-    dispatch[command](tree)
+    in_ = self.graph.new_point()
+    out = self.graph.new_point()
+    self.graph.add_edge(next_block_in, out)
+    dispatch[command](tree, in_, out)
+    self.annotated.append((tree, in_, out))
+    return in_
 
   # idea for annotate_<command> methods:
-  # PRE: tree.live_out is already the live_out set
-  # POST: tree.live_in is the live_in set
+  # they add the inclusions that relate the in point
+  # of the command to its out point
 
-  def annotate_Skip(self, tree):
-    self._live_in(tree, tree.live_out)
+  def annotate_Skip(self, tree, in_, out):
+    self.graph.add_edge(out, in_)
 
-  def annotate_THROW_ERROR(self, tree):
-    self._live_in(tree, tree.live_out)
+  def annotate_THROW_ERROR(self, tree, in_, out):
+    self.graph.add_edge(out, in_)
 
-  def annotate_procCall(self, tree):
+  def annotate_procCall(self, tree, in_, out):
     # in = gen U out
-    gen = self.gen_tuple(tree.children[2])
-    self._live_in(tree, tokset_union(gen, tree.live_out))
+    self.graph.add_gen(in_, self.gen_tuple(tree.children[2]))
+    self.graph.add_edge(out, in_)
 
-  def annotate_assignVarName(self, tree):
+  def annotate_assignVarName(self, tree, in_, out):
     # in = gen U (out \ kill)
     if len(tree.children[2].children) > 0:
-        kill = tokset_new([])
+        kill = []
     else:
-        kill = tokset_new([tree.children[1].children[1].value])
-    gen = self.gen_expression(tree.children[3])
-    self._live_in(tree, tokset_union(gen, tokset_difference(tree.live_out, kill)))
+        kill = [tree.children[1].children[1].value]
+    self.graph.add_gen(in_, self.gen_expression(tree.children[3]))
+    self.graph.add_edge(out, in_, kill)
 
-  def annotate_assignVarTuple1(self, tree):
+  def annotate_assignVarTuple1(self, tree, in_, out):
     # in = gen U (out \ kill)
-    kill = tokset_new([v.value for v in tree.children[1].children])
-    gen = self.gen_expression(tree.children[2])
-    self._live_in(tree, tokset_union(gen, tokset_difference(tree.live_out, kill)))
+    kill = [v.value for v in tree.children[1].children]
+    self.graph.add_gen(in_, self.gen_expression(tree.children[2]))
+    self.graph.add_edge(out, in_, kill)
 
-  def annotate_if(self, tree):
+  def annotate_if(self, tree, in_, out):
     cond_ = tree.children[1]
     then_ = tree.children[2]
     else_ = tree.children[3]
     # in(if cond_ then_ else_) = gen(cond_) U in(then_) U in(else_)
-    res = tokset_new()
-    tokset_extend(res, self.gen_expression(cond_))
-    self.annotate_cmd(then_, tree.live_out)
-    tokset_extend(res, then_.live_in)
+    self.graph.add_gen(in_, self.gen_expression(cond_))
+    self.graph.add_edge(self.annotate_cmd(then_, out), in_)
     if else_ is not None:
-      self.annotate_cmd(else_, tree.live_out)
-      tokset_extend(res, else_.live_in)
+      self.graph.add_edge(self.annotate_cmd(else_, out), in_)
     else:
-      tokset_extend(res, tree.live_out)
-    self._live_in(tree, res)
+      self.graph.add_edge(out, in_)
 
-  def annotate_case(self, tree):
+  def annotate_case(self, tree, in_, out):
     # in(case val of branches) = gen(val) U in(branch1) U ... U in(branchN)
     val = tree.children[1]
-    res = tokset_new()
-    tokset_extend(res, self.gen_expression(val))
+    self.graph.add_gen(in_, self.gen_expression(val))
     for branch in tree.children[2].children:
       if branch.children[0] == 'branch':
         branch_body = branch.children[2]
       else: # defaultBranch
         branch_body = branch.children[1]
-      self.annotate_cmd(branch_body, tree.live_out)
-      tokset_extend(res, branch_body.live_in)
-    self._live_in(tree, res)
+      self.graph.add_edge(self.annotate_cmd(branch_body, out), in_)
 
-  def annotate_while(self, tree):
-    self._live_out_loop(tree) # add in to out
+  def annotate_while(self, tree, in_, out):
+    self.graph.add_edge(in_, out) # add in to out
     # in(while cond body) = gen(cond) U in(body) U out(while ...)
     cond = tree.children[1]
     body = tree.children[2]
-    res = tokset_new()
-    tokset_extend(res, self.gen_expression(cond))
-    self.annotate_cmd(body, tree.live_out)
-    tokset_extend(res, body.live_in)
-    tokset_extend(res, tree.live_out)
-    self._live_in(tree, res)
-
-  def annotate_repeat(self, tree):
-    self._live_out_loop(tree)
+    self.graph.add_gen(in_, self.gen_expression(cond))
+    self.graph.add_edge(self.annotate_cmd(body, out), in_)
+    self.graph.add_edge(out, in_)
+
+  def annotate_repeat(self, tree, in_, out):
+    self.graph.add_edge(in_, out)
     # in (repeat times body)
     #   = gen(times) U in(body) U out(repeat ...)
-    res = tokset_new()
     times = tree.children[1]
     body = tree.children[2]
-    tokset_extend(res, self.gen_expression(times))
-    self.annotate_cmd(body, tree.live_out)
-    tokset_extend(res, body.live_in)
-    tokset_extend(res, tree.live_out)
-    self._live_in(tree, res)
-
-  def annotate_foreach(self, tree):
-    var = tree.children[1].value
-    kill = tokset_new([var])
-    self._live_out_loop(tree, minus=kill) # add in to out
+    self.graph.add_gen(in_, self.gen_expression(times))
+    self.graph.add_edge(self.annotate_cmd(body, out), in_)
+    self.graph.add_edge(out, in_)
+
+  def annotate_foreach(self, tree, in_, out):
+    kill = [tree.children[1].value]
+    self.graph.add_edge(in_, out, kill) # add in to out
     # in(foreach x in list body)
     #   = gen(list) U (in(body) \ {i}) U out(foreach ...)
     list = tree.children[2]
     body = tree.children[3]
-    res = tokset_new()
-    self.annotate_cmd(body, tree.live_out)
-    tokset_extend(res, self.gen_expression(list))
-    tokset_extend(res, tokset_difference(body.live_in, kill))
-    tokset_extend(res, tree.live_out)
-    self._live_in(tree, res)
-
-  def annotate_repeatWith(self, tree):
-    var = tree.children[1].value
-    kill = tokset_new([var])
-    self._live_out_loop(tree, minus=kill) # add in to out
+    self.graph.add_gen(in_, self.gen_expression(list))
+    self.graph.add_edge(self.annotate_cmd(body, out), in_, kill)
+    self.graph.add_edge(out, in_)
+
+  def annotate_repeatWith(self, tree, in_, out):
+    kill = [tree.children[1].value]
+    self.graph.add_edge(in_, out, kill) # add in to out
     # in(repeatWith i in from..to body)
     #   = gen(from) U gen(to) U (in(body) \ {i}) U out(repeatWith ...)
     from_ = tree.children[2].children[1]
     to_ = tree.children[2].children[2]
     body = tree.children[3]
-    res = tokset_new()
-    tokset_extend(res, self.gen_expression(from_))
-    tokset_extend(res, self.gen_expression(to_))
-    self.annotate_cmd(body, tree.live_out)
-    tokset_extend(res, tokset_difference(body.live_in, kill))
-    tokset_extend(res, tree.live_out)
-    self._live_in(tree, res)
-
-  def annotate_block(self, tree):
+    self.graph.add_gen(in_, self.gen_expression(from_))
+    self.graph.add_gen(in_, self.gen_expression(to_))
+    self.graph.add_edge(self.annotate_cmd(body, out), in_, kill)
+    self.graph.add_edge(out, in_)
+
+  def annotate_block(self, tree, in_, out):
     block = tree.children[1]
-    block.live_out = tree.live_out
-    self.annotate_body(block)
-    self._live_in(tree, block.live_in)
+    self.graph.add_edge(self.annotate_body(block, out), in_)
 
-  def annotate_return(self, tree):
-    assert tokset_empty(tree.live_out)
-    self._live_in(tree, self.gen_tuple(tree.children[1]))
+  def annotate_return(self, tree, in_, out):
+    self.graph.add_gen(in_, self.gen_tuple(tree.children[1]))
+    self.returns.append(out)
 
   def gen_expression(self, tree):
     "Returns the GEN set of an expression."
@@ -347,8 +469,8 @@ modifies the current state of the analysis."""
     params = [p.value for p in def_helper.get_def_params(tree)]
     block = def_helper.get_def_body(tree)
 
-    possibly_undef = tokset_difference(block.live_in, tokset_new(params))
-    if not tokset_empty(possibly_undef):
+    possibly_undef = block.live_in.difference(params)
+    if possibly_undef.bits != 0:
       for var, tok in possibly_undef.items():
         msg = i18n.i18n('Variable "%s" possibly uninitialized') % (var,)
         area = position.ProgramAreaNear(tok)
@@ -25,15 +25,23 @@ GbsMacrosDir = os.path.join(LangDir, 'macros')
 
 #### Macro exploding of Gobstones programs.
 
+# Parsed implementations, with their reserved token names already
+# replaced, indexed by file name and reserved token names. Exploding a
+# macro changes the tree, so it is given a copy of the template.
+_implementation_templates = {}
+
 class GbsMacroExploder(object):
 
     def _load_implementation(self, implementation_filename, reserved_token_names=None):
-        """ Parses a file with the required implementation and replaces the
-        reserved token names with user-innaccesible names """
-        implementation_program = gbs_parser.parse_file(os.path.join(GbsMacrosDir, implementation_filename))
-        for token_name in reserved_token_names:
-            defhelper.recursive_replace_token(implementation_program, token_name, "_" + token_name)
-        return implementation_program
+        """ Returns a copy of the parsed file with the required implementation,
+        where the reserved token names are replaced with user-innaccesible names """
+        key = (implementation_filename, tuple(reserved_token_names))
+        if key not in _implementation_templates:
+            implementation_program = gbs_parser.parse_file(os.path.join(GbsMacrosDir, implementation_filename))
+            for token_name in reserved_token_names:
+                defhelper.recursive_replace_token(implementation_program, token_name, "_" + token_name)
+            _implementation_templates[key] = implementation_program
+        return defhelper.clone_tree(_implementation_templates[key])
 
     def explode(self, program_tree):
         entrypoint_tree = defhelper.find_def(program_tree.children[2], defhelper.is_entrypoint_def)
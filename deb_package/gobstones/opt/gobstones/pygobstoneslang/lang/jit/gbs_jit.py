@@ -16,19 +16,31 @@
 #
 
 import sys
+import platform
+import ctypes
 
-import common.utils
-import lang.bnf_parser
-import lang.gbs_runnable
-import lang.gbs_vm_serializer
-import lang.gbs_builtins
-import lang.jit.x86_64
+import pygobstoneslang.common.utils as utils
+import pygobstoneslang.common.i18n as i18n
+from pygobstoneslang.lang import bnf_parser
+from pygobstoneslang.lang import gbs_runnable
+from pygobstoneslang.lang import gbs_vm
+from pygobstoneslang.lang import gbs_vm_serializer
+from pygobstoneslang.lang import gbs_builtins
+import native_board
+from x86_64 import GbsJitPrimitiveException
 
 def instruction_set():
+  """Return the module implementing native code generation for the
+  current machine, or None if the JIT does not support it. The
+  generated code follows the System V calling convention."""
+  if platform.machine().lower() not in ['x86_64', 'amd64']:
+    return None
+  if sys.platform.startswith('win'):
+    return None
   try:
-    import lang.jit.x86_64
-    return lang.jit.x86_64
-  except:
+    import x86_64
+    return x86_64
+  except ImportError:
     return None
 
 def counter():
@@ -41,26 +53,43 @@ class JitCompiler(object):
 
   def __init__(self):
     self._arch = instruction_set()
-    self._mangler = lang.gbs_vm_serializer.Mangler()
+    if self._arch is None:
+      raise GbsJitPrimitiveException('unsupported platform: %s' % (platform.machine(),))
+    self._mangler = gbs_vm_serializer.Mangler()
     self._program = self._arch.Program()
   
   def compile(self, compiled_program): 
     "Takes a compiled program (gbs_vm.py) and translates it into native code."
+    if 'program' not in compiled_program.routines:
+      raise GbsJitPrimitiveException('program has no entry point')
     rtns = self._mangler.mangle_routines(compiled_program)
-    rtns = common.utils.seq_sorted(rtns.items())
+    rtns = utils.seq_sorted(rtns.items())
 
     self._bytecode_program = compiled_program
+    self._main_name = self._mangler.mangle(compiled_program, 'program')
     self._vardict = {}
     self._nargs = {}
     self._nlocals = {}
     self._nretvals = {}
+    self._callees = {}
     for mangled_name, (prog, rtn) in rtns:
       self.preprocess_routine(prog, rtn)
+    self.check_no_recursion()
 
     self.add_main()
     for mangled_name, (prog, rtn) in rtns:
       self.compile_routine(prog, rtn)
 
+  def mangle_callee(self, prog, name):
+    if name in prog.builtins:
+      if name not in self._arch.x86_64_builtins.Inline:
+        raise GbsJitPrimitiveException('builtin call of %s not supported' % (name,))
+      return name
+    elif name in prog.routines or name in prog.external_routines:
+      return self._mangler.mangle(prog, name)
+    else:
+      raise GbsJitPrimitiveException('call of %s not supported' % (name,))
+
   def preprocess_routine(self, prog, rtn):
     mname = self._mangler.mangle(prog, rtn.name)
     self._vardict[mname] = vardict = self._var_dictionary_for(rtn)
@@ -76,30 +105,60 @@ class JitCompiler(object):
         assert False 
 
     nretvals = 0
+    callees = set()
     for op in rtn.ops:
       if op[0] in ['return', 'returnVars']:
         nretvals = op[1]
+      elif op[0] in gbs_vm.CALL_OPCODES:
+        if op[1] in prog.builtins and gbs_vm.arity_error(prog.builtins[op[1]], op[2]):
+          # left to the VM, which reports the error if the call is run
+          raise GbsJitPrimitiveException('call of %s with %u arguments not supported' % (op[1], op[2]))
+        callees.add(self.mangle_callee(prog, op[1]))
 
     self._nargs[mname] = nargs
     self._nlocals[mname] = nlocals
     self._nretvals[mname] = nretvals
+    self._callees[mname] = callees
+
+  def check_no_recursion(self):
+    """Native code saves a copy of the board in the machine stack on
+    each function call, so recursive programs could overflow it.
+    Leave them to the VM."""
+    visiting = set()
+    done = set()
+    def visit(mname):
+      if mname in done:
+        return
+      if mname in visiting:
+        raise GbsJitPrimitiveException('recursive call of %s not supported' % (mname,))
+      visiting.add(mname)
+      for callee in self._callees.get(mname, []):
+        visit(callee)
+      visiting.remove(mname)
+      done.add(mname)
+    for mname in self._callees:
+      visit(mname)
 
   def add_main(self):
     self._main_varnames = []
-    main_nretvals = self._nretvals['$Main']
+    self._main_vartypes = []
+    main_nretvals = self._nretvals[self._main_name]
     self._program.add(self._arch.BeginMainRoutine())
     self._program.add(self._arch.InitializeBoard())
-    self._program.add(self._arch.CallUserDefined('$Main', 0, main_nretvals))
+    self._program.add(self._arch.CallUserDefined(self._main_name, 0, main_nretvals))
     self._program.add(self._arch.FinalizeBoard())
     self._program.add(self._arch.ReturnFromMain(main_nretvals))
     self._program.add(self._arch.EndMainRoutine())
 
   def main_nretvals(self):
-    return self._nretvals['$Main']
+    return self._nretvals[self._main_name]
 
   def main_varnames(self):
     return self._main_varnames
 
+  def main_vartypes(self):
+    return self._main_vartypes
+
   def compile_routine(self, prog, rtn):
     mname = self._mangler.mangle(prog, rtn.name)
     self._program.add(self._arch.Label(mname))
@@ -109,43 +168,52 @@ class JitCompiler(object):
     nlocals = self._nlocals[mname]
     nretvals = self._nretvals[mname]
 
-    #print('***', rtn.prfn, rtn.name, rtn.params)
-    #print('    vardict', vardict)
-    #print('    nargs', nargs)
-    #print('    nlocals', nlocals)
-    #print('    nretvals', nretvals)
+    def label(i):
+      return ':%s:%u:' % (mname, i)
+
+    # routines are linked, so jumps refer to instruction indices
+    targets = set()
+    iter_kinds = {}
+    for op in rtn.ops:
+      if op[0] in ['jump', 'jumpIfFalse']:
+        targets.add(op[1])
+      elif op[0] in ['jumpIfNotIn', 'iterNext']:
+        targets.add(op[2])
+      elif op[0] == 'iterInit':
+        iter_kinds[op[1]] = op[2]
 
     self._program.add(self._arch.BeginRoutine(nlocals))
 
     _op_i = 0
     while _op_i < len(rtn.ops):
+      if _op_i in targets:
+        self._program.add(self._arch.Label(label(_op_i)))
       op = rtn.ops[_op_i]
       opcode = op[0]
       if opcode == 'pushConst':
         self._program.add(self._arch.PushConst(op[1]))
       elif opcode == 'pushFrom':
-        self._program.add(self._arch.PushVar(*vardict[op[1]]))
+        self._program.add(self._arch.PushVar(*vardict[rtn.varnames[op[1]]]))
       elif opcode == 'popTo':
-        self._program.add(self._arch.Assign(*vardict[op[1]]))
+        self._program.add(self._arch.Assign(*vardict[rtn.varnames[op[1]]]))
       elif opcode == 'returnVars':
-        self._main_varnames = op[2]
+        self._main_varnames = [gbs_builtins.polyname_name(v) for v in op[2]]
+        self._main_vartypes = self._return_types(rtn, _op_i)
         self._program.add(self._arch.ReturnVars(op[1], op[2]))
       elif opcode == 'return':
         self._program.add(self._arch.Return(op[1]))
-      elif opcode == 'label':
-        self._program.add(self._arch.Label(':%s:' % (op[1],)))
       elif opcode == 'jump':
-        self._program.add(self._arch.Jump(':%s:' % (op[1],)))
+        self._program.add(self._arch.Jump(label(op[1])))
       elif opcode == 'jumpIfFalse':
-        self._program.add(self._arch.JumpIfFalse(':%s:' % (op[1],)))
-      elif opcode == 'call':
-        if op[1] in self._bytecode_program.builtins:
-          margs = self._bytecode_program.builtins[op[1]].num_params()
-          routine = self._bytecode_program.builtins[op[1]]
+        self._program.add(self._arch.JumpIfFalse(label(op[1])))
+      elif opcode in gbs_vm.CALL_OPCODES:
+        if op[1] in prog.builtins:
+          routine = prog.builtins[op[1]]
+          margs = routine.num_params()
           if routine.type() == 'procedure':
             mretvals = 0
           else:
-            mretvals = self._bytecode_program.builtins[op[1]].num_retvals()
+            mretvals = routine.num_retvals()
           self._program.add(self._arch.CallBuiltin(op[1], margs, mretvals))
         else:
           m = self._mangler.mangle(prog, op[1])
@@ -153,7 +221,7 @@ class JitCompiler(object):
           mretvals = self._nretvals[m]
           self._program.add(self._arch.CallUserDefined(m, margs, mretvals))
       elif opcode == 'THROW_ERROR':
-        self._program.add(self._arch.THROW_ERROR(common.utils.show_string(op[1])))
+        self._program.add(self._arch.THROW_ERROR(utils.show_string(op[1])))
       elif opcode in ['enter']:
         self._program.add(self._arch.EnterFunction())
       elif opcode in ['leave']:
@@ -162,17 +230,60 @@ class JitCompiler(object):
         op_ret = rtn.ops[_op_i]
         assert op_ret[0] == 'return'
         self._program.add(self._arch.LeaveFunctionAndReturn(op_ret[1]))
-      elif opcode in ['delVar']:
-        pass # ignore
+      elif opcode in ['delVar', 'setImmutable', 'unsetImmutable']:
+        pass # ignore (immutability is checked by the linter)
       elif opcode in ['jumpIfNotIn']:
-        self._program.add(self._arch.JumpIfNotIn(op[1], ':%s:' % (op[2],)))
+        self._program.add(self._arch.JumpIfNotIn(op[1], label(op[2])))
+      elif opcode in ['iterInit', 'iterNext']:
+        kind = iter_kinds[op[1]]
+        if kind not in ['repeat', 'range']:
+          raise GbsJitPrimitiveException('iteration over %s not supported' % (kind,))
+        if opcode == 'iterInit':
+          self._compile_iter_init(vardict, rtn, op, kind)
+        else:
+          self._compile_iter_next(vardict, rtn, op, kind, label(op[2]))
+      elif opcode in ['iterEnd']:
+        pass
       else:
-        print(opcode)
-        assert False
+        raise GbsJitPrimitiveException('opcode %s not supported' % (opcode,))
       _op_i += 1
 
     self._program.add(self._arch.EndRoutine(nlocals))
 
+  def _compile_iter_init(self, vardict, rtn, op, kind):
+    # the cursor is the count of the repetitions left, or the next
+    # value of the range, whose last value is kept in another local
+    cursor = rtn.varnames[op[1]]
+    if kind == 'range':
+      self._program.add(self._arch.Assign(*vardict[_range_last(cursor)]))
+    self._program.add(self._arch.Assign(*vardict[cursor]))
+
+  def _compile_iter_next(self, vardict, rtn, op, kind, end_label):
+    cursor = vardict[rtn.varnames[op[1]]]
+    if kind == 'repeat':
+      self._program.add(self._arch.PushVar(*cursor))
+      self._program.add(self._arch.PushConst(0))
+      self._program.add(self._arch.CallBuiltin(i18n.i18n('>'), 2, 1))
+      self._program.add(self._arch.JumpIfFalse(end_label))
+      self._program.add(self._arch.PushVar(*cursor))
+      self._program.add(self._arch.PushConst(1))
+      self._program.add(self._arch.CallBuiltin(i18n.i18n('-'), 2, 1))
+      self._program.add(self._arch.Assign(*cursor))
+    else:
+      # enumerated values are represented by their ord
+      last = vardict[_range_last(rtn.varnames[op[1]])]
+      self._program.add(self._arch.PushVar(*cursor))
+      self._program.add(self._arch.PushVar(*last))
+      self._program.add(self._arch.CallBuiltin(i18n.i18n('<='), 2, 1))
+      self._program.add(self._arch.JumpIfFalse(end_label))
+      if len(op) > 3:
+        self._program.add(self._arch.PushVar(*cursor))
+        self._program.add(self._arch.Assign(*vardict[rtn.varnames[op[3]]]))
+      self._program.add(self._arch.PushVar(*cursor))
+      self._program.add(self._arch.PushConst(1))
+      self._program.add(self._arch.CallBuiltin(i18n.i18n('+'), 2, 1))
+      self._program.add(self._arch.Assign(*cursor))
+
   def _var_dictionary_for(self, rtn):
     d = {}
 
@@ -180,7 +291,7 @@ class JitCompiler(object):
     # (the last parameter is 1)
     # for ease of stack handling
     param_id = counter()
-    for p in common.utils.seq_reversed(rtn.params):
+    for p in utils.seq_reversed(rtn.params):
       d[p] = ('param', param_id.next())
 
     local_id = counter()
@@ -190,13 +301,102 @@ class JitCompiler(object):
 
     for op in rtn.ops:
       if op[0] in ['pushFrom', 'popTo', 'delVar']:
-        addlocal(op[1])
+        addlocal(rtn.varnames[op[1]])
+      elif op[0] == 'iterInit':
+        addlocal(rtn.varnames[op[1]])
+        if op[2] == 'range':
+          addlocal(_range_last(rtn.varnames[op[1]]))
+      elif op[0] == 'iterNext' and len(op) > 3:
+        addlocal(rtn.varnames[op[3]])
       elif op[0] in ['returnVars']:
         for v in op[2]:
           addlocal(v)
 
     return d
 
+  def _return_types(self, rtn, ip):
+    """Native values carry no type information, so the types of the
+    values returned by the program are recovered from the bytecode.
+    The type of a variable is the type of the values assigned to it,
+    which are literals, variables, or results of builtin functions."""
+    op = rtn.ops[ip]
+    nvals = op[1]
+    types = [gbs_builtins.polyname_types(v) for v in op[2]]
+    if all([len(t) == 1 for t in types]):
+      return [t[0] for t in types]
+
+    builtins = self._bytecode_program.builtins
+    def type_of_value(value_op, vartypes):
+      if value_op[0] == 'pushConst':
+        return literal_type(value_op[1])
+      elif value_op[0] == 'pushFrom':
+        return vartypes.get(value_op[1])
+      elif value_op[0] in gbs_vm.CALL_OPCODES and value_op[1] in builtins:
+        routine = builtins[value_op[1]]
+        if routine.type() == 'function':
+          restype = routine.gbstype().result()
+          if len(restype) == 1 and repr(restype[0]) in Native_types:
+            return repr(restype[0])
+      return 'Any'
+
+    vartypes = {}
+    changed = True
+    while changed:
+      changed = False
+      for i in range(1, len(rtn.ops)):
+        if rtn.ops[i][0] != 'popTo':
+          continue
+        var = rtn.ops[i][1]
+        typ = type_of_value(rtn.ops[i - 1], vartypes)
+        if typ is None:
+          continue
+        if vartypes.get(var, typ) != typ:
+          typ = 'Any'
+        if vartypes.get(var) != typ:
+          vartypes[var] = typ
+          changed = True
+
+    res = []
+    for value_op in self._value_ops(rtn, ip, nvals):
+      typ = type_of_value(value_op, vartypes)
+      if typ not in Native_types:
+        raise GbsJitPrimitiveException('cannot determine the type of the return values')
+      res.append(typ)
+    return res
+
+  def _value_ops(self, rtn, ip, nvals):
+    """Return the last instruction of each of the nvals expressions
+    evaluated right before the instruction at ip."""
+    builtins = self._bytecode_program.builtins
+    def stack_effect(op):
+      if op[0] in ['pushConst', 'pushFrom']:
+        return 1
+      elif op[0] in gbs_vm.CALL_OPCODES and op[1] in builtins:
+        routine = builtins[op[1]]
+        if routine.type() == 'function':
+          return 1 - op[2]
+        else:
+          return -op[2]
+      elif op[0] in gbs_vm.CALL_OPCODES:
+        m = self._mangler.mangle(self._bytecode_program, op[1])
+        return self._nretvals[m] - op[2]
+      else:
+        raise GbsJitPrimitiveException('cannot determine the type of the return values')
+
+    res = []
+    end = ip
+    for _ in range(nvals):
+      res.append(rtn.ops[end - 1])
+      # the first position where the stack grows by exactly one
+      # value is where the expression starts
+      effect = 0
+      while effect != 1:
+        end -= 1
+        if end < 0:
+          raise GbsJitPrimitiveException('cannot determine the type of the return values')
+        effect += stack_effect(rtn.ops[end])
+    return utils.seq_reversed(res)
+
   def program(self):
     return self._program
 
@@ -207,16 +407,29 @@ class JitCompiler(object):
     self._program.expand_labels()
     return self._program.native_function()
 
-import lang.board.formats
-import ctypes
-import common.i18n as i18n
+Native_types = ['Int', 'Bool', 'Color', 'Dir']
+
+def _range_last(cursor):
+  "Name of the local holding the last value of the range of a cursor."
+  return cursor + '/last'
 
-class GbsJitRuntimeException(common.utils.SourceException):
+def literal_type(value):
+  if isinstance(value, bool):
+    return 'Bool'
+  elif gbs_builtins.isinteger(value):
+    return 'Int'
+  elif isinstance(value, gbs_builtins.GbsEnum):
+    return value.enum_type()
+  else:
+    return 'Any'
+
+class GbsJitRuntimeException(utils.SourceException):
   def error_type(self):
     return i18n.i18n('Runtime error')
 
-class JitCompiledRunnable(lang.gbs_runnable.GbsRunnable):
+class JitCompiledRunnable(gbs_runnable.GbsRunnable):
   def __init__(self, compiled_code):
+    self._prog = compiled_code
     self._jit = JitCompiler()
     self._jit.compile(compiled_code)
     self._f = self._jit.native_function()
@@ -225,12 +438,16 @@ class JitCompiledRunnable(lang.gbs_runnable.GbsRunnable):
     return repr(self._jit.program())
   def native_code(self):
     return repr(self._jit.native_code())
-  def run(self, board):
-    gbbo_fmt = lang.board.formats.AvailableFormats['gbbo']()
-
+  def run_native(self, board):
+    """Run the native code over the board. Return the list of pairs
+    (name, value) returned by the program, or raise a
+    GbsJitRuntimeException. The board is only updated if the
+    program ends successfully."""
     # generate buffer for the board, with the board data
-    board_str = gbbo_fmt.to_string(board)
-    buf = ctypes.create_string_buffer(board_str)
+    try:
+      buf = native_board.board_to_buffer(board)
+    except OverflowError:
+      raise GbsJitRuntimeException(i18n.i18n('Integer overflow'), bnf_parser.fake_bof())
     arch = instruction_set()
 
     # generate result buffer for the return values
@@ -242,25 +459,45 @@ class JitCompiledRunnable(lang.gbs_runnable.GbsRunnable):
     if res == 0:
       # if result is ok, retrieve the resulting board and
       # build the list of return values
-      gbbo_fmt.from_string(board, buf.raw)
+      native_board.buffer_to_board(buf, board)
       ws = arch.Word_size
       varnames = self._jit.main_varnames()
+      vartypes = self._jit.main_vartypes()
       retvals = []
       assert len(varnames) == self._nretvals
       for i in range(self._nretvals):
-        vn = lang.gbs_builtins.polyname_name(varnames[i])
-        vt = lang.gbs_builtins.polyname_types(varnames[i])[0]
-        retvals.append((vn, arch.decode_literal(vt, resbuf[ws * i:ws * i + ws])))
+        retvals.append((varnames[i], arch.decode_literal(vartypes[i], resbuf[ws * i:ws * i + ws])))
       return retvals
     elif res == arch.THROW_ERROR_Errcode:
-      msg = resbuf.raw.split('\0')[0]
-      raise GbsJitRuntimeException(msg, lang.bnf_parser.fake_bof())
+      msg = resbuf.raw.split('\0')[0].decode('utf8')
+      raise GbsJitRuntimeException(msg, bnf_parser.fake_bof())
     else:
       assert False
+  def run(self, board, interactive_api=None):
+    try:
+      retvals = self.run_native(board)
+    except GbsJitRuntimeException:
+      # native code does not keep track of source positions,
+      # so the error is reproduced by the VM from the same board
+      return gbs_vm.interp(self._prog, board, interactive_api)
+    retvals = [(name, repr(value)) for name, value in retvals]
+    return retvals, gbs_builtins.GbsObject(board, 'Board')
 
 def jit_compile(compiled_code):
   return JitCompiledRunnable(compiled_code)
 
+def make_runnable(compiled_code, limits=gbs_vm.NO_LIMITS):
+  """Return a runnable that executes the program natively, falling back
+  to the VM if the program uses constructs the JIT does not support
+  (records, lists, strings, interaction, recursion, ...), or if it has
+  execution limits, which native code does not check."""
+  if not limits.unlimited():
+    return gbs_vm.VmCompiledRunnable(compiled_code, limits)
+  try:
+    return JitCompiledRunnable(compiled_code)
+  except GbsJitPrimitiveException:
+    return gbs_vm.VmCompiledRunnable(compiled_code)
+
 class JitInterpreter(object):
   def __init__(self):
     self._compiled_program = None
@@ -272,8 +509,7 @@ class JitInterpreter(object):
       self._runnable = JitCompiledRunnable(compiled_program)
     self._board = board
   def step(self):
-    res = self._runnable.run(self._board)
+    res = self._runnable.run_native(self._board)
     return 'END', res
   def current_area(self):
-    return lang.bnf_parser.fake_bof()
-
+    return bnf_parser.fake_bof()
@@ -0,0 +1,61 @@
+#
+# Copyright (C) 2011, 2012 Pablo Barenbaum <foones@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Marshalling between gbs_board.Board and the board buffer used by
+the native code generated by the JIT.
+
+The native board is laid out as a header of four 4-byte integers
+(width, height, head x, head y) followed by width * height cells in
+row major order. Each cell holds four 4-byte integers, the number of
+stones of each color in color index order.
+"""
+
+import array
+import ctypes
+
+from pygobstoneslang.lang import gbs_builtins
+
+Int_size = 4
+Header_size = 4 * Int_size
+Cell_size = gbs_builtins.NUM_COLORS * Int_size
+
+def buffer_size(board):
+  "Return the size in bytes of the native buffer for the given board."
+  width, height = board.size
+  return Header_size + width * height * Cell_size
+
+def board_to_buffer(board):
+  """Return a mutable ctypes buffer holding the contents of the
+  given board in the native layout. Raise OverflowError if a stone
+  count does not fit in the native layout."""
+  width, height = board.size
+  y, x = board.head
+  data = array.array('i', [width, height, x, y])
+  data.extend(board.stone_counts())
+  assert data.itemsize == Int_size
+  return ctypes.create_string_buffer(data.tostring(), buffer_size(board))
+
+def buffer_to_board(buf, board):
+  """Update the given board with the contents of a native buffer
+  previously obtained from board_to_buffer."""
+  data = array.array('i')
+  data.fromstring(buf.raw[:buffer_size(board)])
+  width, height, x, y = data[:4]
+  assert (width, height) == board.size
+  board.goto(x, y)
+  board.set_stone_counts(data[4:])
+  return board
@@ -19,11 +19,11 @@ import sys
 import ctypes
 import mmap
 
-import lang.gbs_builtins
-import lang.jit.x86_64_builtins
-from lang.jit.x86_64_builtins import numtol
-import common.utils
-import common.i18n as i18n
+from pygobstoneslang.lang import gbs_builtins
+import pygobstoneslang.common.utils as utils
+import pygobstoneslang.common.i18n as i18n
+import x86_64_builtins
+from x86_64_builtins import numtol
 
 class GbsJitPrimitiveException(Exception):
   pass
@@ -72,7 +72,8 @@ class NativeFunc(object):
 #   Assume that the program has been typechecked to preserve
 #   semantics.
 #
-#   Integer overflows are not handled.
+#   Integer overflows raise a runtime error, and so do stone counts
+#   that do not fit in 32 bits.
 #
 #   rsp            --> stack
 #   [rbp - offset] --> local variables
@@ -228,7 +229,7 @@ class PushVar(Instruction):
       return self.code_param()
   def code_local(self):
     offset = -self._var_num * Word_size
-    boom_code = lang.jit.x86_64_builtins.boom_code_for(i18n.i18n('Uninitialized variable'))
+    boom_code = x86_64_builtins.boom_code_for(i18n.i18n('Uninitialized variable'))
     res = ''.join([
       '\x48\x8b\x85' + numtol(offset, nbytes=4),  # mov rax, [rbp + <offset>]
       '\x48\xba\xff\xff\xff\xff\xff\xff\xff\x7f', # mov rdx, <Undefined_value>
@@ -251,10 +252,10 @@ def x86_64_literal(lit):
     else:
       raise GbsJitPrimitiveException('integer literal too big')
 
-  if lang.gbs_builtins.isinteger(lit):
+  if gbs_builtins.isinteger(lit):
     return _repr(lit)
-  elif lang.gbs_builtins.isenum(lit):
-    return _repr(lang.gbs_builtins.poly_ord(lit)[0])
+  elif gbs_builtins.isenum(lit):
+    return _repr(gbs_builtins.poly_ord(lit)[0])
   else:
     raise GbsJitPrimitiveException('not implemented')
   return res
@@ -262,7 +263,7 @@ def x86_64_literal(lit):
 def decode_literal(typ, lit):
   def unpack(s):
     r = 0
-    for x in common.utils.seq_reversed(s):
+    for x in utils.seq_reversed(s):
       r = (r << 8) | ord(x)
     return r
   def signed(x):
@@ -270,15 +271,15 @@ def decode_literal(typ, lit):
       return -(0xffffffffffffffff + 1 - x)
     else:
       return x
-  value = signed(unpack(lit))
+  value = int(signed(unpack(lit)))
   if typ == 'Int':
     return value
   elif typ == 'Bool':
     return value == 1
   elif typ == 'Color':
-    return lang.gbs_builtins.Color(value)
+    return gbs_builtins.Color(value)
   elif typ == 'Dir':
-    return lang.gbs_builtins.Direction(value)
+    return gbs_builtins.Direction(value)
   else:
     assert False
 
@@ -286,9 +287,9 @@ class PushConst(Instruction):
   def __init__(self, lit):
     self._lit = lit
   def code(self):
-    if lang.gbs_builtins.isinteger(self._lit):
+    if gbs_builtins.isinteger(self._lit):
       res = self.code_int()
-    elif lang.gbs_builtins.isenum(self._lit):
+    elif gbs_builtins.isenum(self._lit):
       res = self.code_enum()
     else:
       raise GbsJitPrimitiveException('not implemented')
@@ -300,7 +301,7 @@ class PushConst(Instruction):
     ])
   def code_enum(self):
     # push <ord>
-    res = '\x6a' + chr(lang.gbs_builtins.poly_ord(self._lit)[0])
+    res = '\x6a' + chr(gbs_builtins.poly_ord(self._lit)[0])
     return res
   def __repr__(self):
     return 'PushConst %s' % (self._lit,)
@@ -332,9 +333,9 @@ class CallBuiltin(Instruction):
     self._nargs = nargs
     self._nretvals = nretvals
   def code(self):
-    if self._funcname in lang.jit.x86_64_builtins.Inline:
-      return lang.jit.x86_64_builtins.Inline[self._funcname]
-    elif self._funcname in lang.gbs_builtins.BUILTINS_POLYMORPHIC:
+    if self._funcname in x86_64_builtins.Inline:
+      return x86_64_builtins.Inline[self._funcname]
+    elif self._funcname in gbs_builtins.BUILTINS_POLYMORPHIC:
       raise GbsJitPrimitiveException('builtin call of polymorphic "%s" not supported -- should typecheck the program' % (self._funcname,))
     else:
       raise GbsJitPrimitiveException('builtin call of %s not supported' % (self._funcname,))
@@ -404,7 +405,7 @@ class EndRoutine(Instruction):
 
 class EnterFunction(Instruction):
   def code(self):
-    return lang.jit.x86_64_builtins.Undo_builtins['enter']
+    return x86_64_builtins.Undo_builtins['enter']
   def __repr__(self):
     return 'EnterFunction'
 
@@ -434,7 +435,7 @@ class LeaveFunctionAndReturn(Instruction):
     res = ''.join([
       '\x48\x81\xc4' + numtol(Word_size * self._nretvals), # add rsp, Word_size * num_retvals
       '\x48\x89\xe7', # mov rdi, rsp
-      lang.jit.x86_64_builtins.Undo_builtins['leave'],
+      x86_64_builtins.Undo_builtins['leave'],
     ])
     return res
   def __repr__(self):
@@ -498,12 +499,12 @@ class EndMainRoutine(Instruction):
     return 'EndMainRoutine'
 
 THROW_ERROR_Errcode = 0x7fffffffffffffff
-THROW_ERROR_Max_err_len = lang.jit.x86_64_builtins.Max_err_len
+THROW_ERROR_Max_err_len = x86_64_builtins.Max_err_len
 class THROW_ERROR(Instruction):
   def __init__(self, msg):
     self._msg = msg
   def code(self):
-    return lang.jit.x86_64_builtins.boom_code_for(self._msg)
+    return x86_64_builtins.boom_code_for(self._msg)
   def __repr__(self):
     return 'THROW_ERROR'
 
@@ -0,0 +1,238 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import multiprocessing
+import time
+
+import pygobstoneslang.common as common
+import pygobstoneslang.common.utils
+import pygobstoneslang.common.i18n as i18n
+
+import pygobstoneslang.lang as lang
+import pygobstoneslang.lang.gbs_parser
+import pygobstoneslang.lang.gbs_vm
+import pygobstoneslang.lang.judge.gbs_judge as gbs_judge
+import pygobstoneslang.lang.judge.report as report
+
+#### Runs the test cases of a problem bundle on a pool of processes.
+####
+#### Each worker opens the bundle once and keeps it open. The code of
+#### a submission is compiled by a worker the first time the worker
+#### is given one of its test cases, and reused for the following
+#### ones. Results come back in the order of the test cases, no matter
+#### which worker ran them.
+
+class Submission(object):
+
+    def __init__(self, name, source, filename='...'):
+        self._name = name
+        self._source = source
+        self._filename = filename
+
+    def name(self):
+        return self._name
+
+    def source(self):
+        return self._source
+
+    def filename(self):
+        return self._filename
+
+    def key(self):
+        return (self._name, self._filename, common.utils.md5sum(self._source))
+
+class CaseResult(object):
+    "Outcome of running a submission (or the reference solution) on a test case."
+
+    def __init__(self, index, status, solution=None, error=None, wall_time=0.0, steps=0, limit=None):
+        self.index = index
+        self.status = status
+        self.solution = solution
+        self.error = error
+        # name of the execution limit exceeded, if any
+        self.limit = limit
+        self.wall_time = wall_time
+        self.steps = steps
+
+    def stats(self):
+        return self.wall_time, self.steps
+
+## Worker side
+
+_Max_cached_code = 16
+
+_worker_state = {}
+
+def _init_worker(bundle_filename, limits):
+    lang.gbs_parser.warm_up()
+    _worker_state['bundle'] = gbs_judge.open_bundle(bundle_filename)
+    _worker_state['limits'] = limits
+    _worker_state['test_cases'] = {}
+    _worker_state['code'] = {}
+
+def _test_cases_for(problem):
+    test_cases = _worker_state['test_cases']
+    if problem not in test_cases:
+        test_cases[problem] = _worker_state['bundle'].test_cases_for(problem)
+    return test_cases[problem]
+
+def _code_dict_for(problem, submission):
+    bundle = _worker_state['bundle']
+    code = _worker_state['code']
+    if submission is None:
+        key = (problem, None)
+    else:
+        key = (problem, submission.key())
+    if key in code:
+        return code[key]
+    if len(code) >= _Max_cached_code:
+        code.clear()
+    if submission is not None:
+        code_dict = gbs_judge.CodeDictionaryFromSolution(bundle, problem,
+                                                         submission.source(),
+                                                         fn=submission.filename())
+    elif isinstance(bundle, gbs_judge.GbzProblemBundle):
+        code_dict = gbs_judge.CodeDictionaryFromObject(bundle, problem)
+    else:
+        code_dict = gbs_judge.CodeDictionaryFromSolution(bundle, problem,
+                                                         bundle.solution_for(problem),
+                                                         fn=bundle.solution_path_for(problem))
+    code[key] = code_dict
+    return code_dict
+
+def _error_text(exception):
+    # Source exceptions hold their position, which is not picklable,
+    # and their messages are unicode, so repr() cannot be used
+    return exception.__repr__()
+
+def _run_case(task):
+    # Any error of a submission fails its test cases: an exception that
+    # escaped the worker would stop judging the rest of the submissions
+    problem, submission, index = task
+    try:
+        code_dict = _code_dict_for(problem, submission)
+    except Exception as exception:
+        return CaseResult(index, 'FAILED', error=_error_text(exception))
+    if code_dict.status != 'OK':
+        return CaseResult(index, 'FAILED', error=_error_text(code_dict.exception))
+
+    vm = lang.gbs_vm.GbsVmInterpreter(toplevel_filename=code_dict._solution_filename,
+                                      limits=_worker_state['limits'])
+    start = time.time()
+    try:
+        test_case = _test_cases_for(problem)[index]
+        compiled_code = code_dict.compiled_code_for(test_case.program_name())
+        board = _worker_state['bundle'].load_board(problem, test_case.board_name())
+        vm.init_program(compiled_code, board, gbs_judge.null_interactive_api())
+        _, keyvals, final_board = vm.run()
+    except lang.gbs_vm.GbsVmLimitException as exception:
+        return CaseResult(index, 'FAILED', error=_error_text(exception),
+                          wall_time=time.time() - start, steps=vm.steps,
+                          limit=exception.limit)
+    except Exception as exception:
+        return CaseResult(index, 'FAILED', error=_error_text(exception),
+                          wall_time=time.time() - start, steps=vm.steps)
+    return CaseResult(index, 'OK', solution=(final_board.value, keyvals),
+                      wall_time=time.time() - start, steps=vm.steps)
+
+## Driver side
+
+class ParallelJudge(object):
+    """Judges submissions against the reference solutions of a bundle,
+       fanning their test cases out to a pool of processes. Every run,
+       including the ones of the reference solution, is bounded by the
+       given lang.gbs_vm.ExecutionLimits."""
+
+    def __init__(self, bundle_filename, processes=None, chunksize=4, log=None,
+                 limits=lang.gbs_vm.NO_LIMITS):
+        self._bundle = gbs_judge.open_bundle(bundle_filename)
+        self._pool = multiprocessing.Pool(processes, _init_worker, (bundle_filename, limits))
+        self._chunksize = chunksize
+        self._log = log
+
+    def log(self, msg):
+        if self._log is not None:
+            self._log(msg)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._bundle.close()
+
+    def bundle(self):
+        return self._bundle
+
+    def run_cases(self, problem, submissions):
+        """Runs every test case of the problem for each of the given
+           submissions, where None stands for the reference solution.
+           Yields a CaseResult per test case and submission, in the
+           order of the submissions and then of the test cases."""
+        ncases = len(self._bundle.test_cases_for(problem))
+        tasks = []
+        for submission in submissions:
+            for i in range(ncases):
+                tasks.append((problem, submission, i))
+        return self._pool.imap(_run_case, tasks, self._chunksize)
+
+    def judge(self, problem, submissions):
+        """Yields a (submission, verdict, results, reports) tuple for each
+           submission, in order, as soon as all its test cases are run.
+           The verdict is 'OK' when every result matches the reference
+           one, 'ERROR' if the submission fails to compile or run on some
+           test case and 'FAILED' otherwise. The reports are the
+           report.FailedTestReport of the failed test cases."""
+        options = self._bundle.options(problem)
+        test_cases = self._bundle.test_cases_for(problem)
+        ncases = len(test_cases)
+        stream = self.run_cases(problem, [None] + list(submissions))
+
+        reference = [next(stream) for _ in range(ncases)]
+        for result in reference:
+            if result.status != 'OK':
+                raise common.utils.GobstonesException(result.error)
+
+        for submission in submissions:
+            self.log(i18n.i18n('Starting problem %s') % (problem,) + ' (%s)' % (submission.name(),))
+            verdict = 'OK'
+            results = []
+            reports = []
+            for i in range(ncases):
+                result = next(stream)
+                results.append(result)
+                test_case = test_cases[i]
+                self.log('%s: %s' % (test_case.run_name(),
+                                     i18n.i18n('Executed %s steps in %.3f seconds') % (result.steps, result.wall_time)))
+                if result.status == 'OK' and gbs_judge.solutions_equal(options, reference[i].solution, result.solution):
+                    continue
+                if result.status != 'OK':
+                    verdict = 'ERROR'
+                elif verdict == 'OK':
+                    verdict = 'FAILED'
+                reports.append(self._report(problem, options, submission, test_case,
+                                            reference[i], result))
+            yield submission, verdict, results, reports
+
+    def _report(self, problem, options, submission, test_case, ref_result, usr_result):
+        if test_case.program_name() == 'Solution.gbs':
+            source_code = submission.source()
+        else:
+            source_code = self._bundle.load_source(problem, test_case.program_name())
+        initial_board = self._bundle.load_board(problem, test_case.board_name())
+        return report.FailedTestReport(options, problem, test_case, initial_board,
+                                       source_code, ref_result.solution,
+                                       usr_result.solution, stats=usr_result.stats())
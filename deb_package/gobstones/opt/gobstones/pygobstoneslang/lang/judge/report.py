@@ -15,12 +15,13 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import common.utils
-import common.i18n as i18n
-import lang.judge.gbs_judge
-import lang.board.formats
-import lang.gbs_parser
-import lang.gbs_pprint
+import pygobstoneslang.common as common
+import pygobstoneslang.common.utils
+import pygobstoneslang.common.i18n as i18n
+import pygobstoneslang.lang as lang
+import pygobstoneslang.lang.board.formats
+import pygobstoneslang.lang.gbs_parser
+import pygobstoneslang.lang.gbs_pprint
 
 def html_board(board, draw_head=True):
   return lang.board.formats.AvailableFormats['html']().render(board, draw_head=draw_head)
@@ -41,7 +42,7 @@ def pprint(source_code, test_case_name):
 No_result = '  <tt>&lt;%s&gt;</tt>\n' % (i18n.i18n('No result'),)
 
 class FailedTestReport(object):
-  def __init__(self, options, problem, test_case, initial_board, test_source_code, ref_sol, usr_sol):
+  def __init__(self, options, problem, test_case, initial_board, test_source_code, ref_sol, usr_sol, stats=None):
     self._options = options
     self._problem = problem
     self._test_case = test_case
@@ -49,6 +50,8 @@ class FailedTestReport(object):
     self._source_code = test_source_code
     self._ref_sol = ref_sol
     self._usr_sol = usr_sol
+    # (wall time in seconds, executed VM steps) of the obtained result
+    self._stats = stats
 
   def render(self):
     tit = i18n.i18n('Test case "%s" failed') % (self._test_case.run_name(),)
@@ -171,6 +174,9 @@ class FailedTestReport(object):
       if not self._options['check_result']:
         keyvals = None
       self._result(i18n.i18n('Obtained final board'), out, board, head_pos, keyvals)
+    if self._stats is not None:
+      wall_time, steps = self._stats
+      out.write('  <p>%s</p>\n' % (i18n.i18n('Executed %s steps in %.3f seconds') % (steps, wall_time),))
     out.write('  </div>\n')
 
   def _result(self, tit, out, board, head_pos, keyvals):
@@ -24,6 +24,9 @@ import pygobstoneslang.common.utils as utils
 class Token(position.ProgramElement):
     "Represents a token (terminal symbol in the grammar)."
 
+    # Keeps tokens small; other attributes go to the instance dict
+    __slots__ = ('type', 'value', 'pos_begin', 'pos_end')
+
     def __init__(self, type_, value, pos_begin, pos_end):
         position.ProgramElement.__init__(self)
         self.type = type_
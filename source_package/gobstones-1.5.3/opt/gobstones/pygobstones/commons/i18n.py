@@ -120,6 +120,9 @@ ES = {
     'Execution interrupted by the user':
     'Ejecución interrumpida por el usuario'.decode('utf8'),
 
+    'The interpreter stopped unexpectedly':
+    'El intérprete se detuvo inesperadamente'.decode('utf8'),
+
     'Execution completed':
     'Ejecución finalizada'.decode('utf8'),
 
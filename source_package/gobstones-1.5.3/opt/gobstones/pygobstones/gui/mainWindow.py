@@ -246,6 +246,7 @@ class MainWindow(QtGui.QMainWindow):
     def stop(self):
         self.guiInterpreterHandler.initialStatus()
         self.runButton.stopInterpreter()
+        self.programRun.interrupt()
         self.resetButtonsRunAndStop()
         self.ui.statusbar.showMessage(QtCore.QString
             (i18n('Execution interrupted by the user')))
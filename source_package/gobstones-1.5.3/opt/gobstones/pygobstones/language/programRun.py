@@ -2,11 +2,16 @@ from PyQt4 import QtCore
 import pygobstones.commons.messaging as messaging
 import Queue as queue
 import pygobstones.commons.concurrent as concurrent
+from pygobstones.commons.i18n import i18n
 import pygobstoneslang
 from pygobstoneslang import ProgramWorker
+from pygobstoneslang.common.utils import GobstonesException
 
 debug = False
 
+# Milliseconds between two polls of the messages sent by a running worker
+PollInterval = 20
+
 
 def reverse_list(lst):
     return [lst.pop() for _ in range(len(lst))]
@@ -100,48 +105,144 @@ class EjecutionFailureHandler(object):
         return self.PARSER_FAILURE in self.exception_handlers.keys()
 
 
+class WorkerProcess(object):
+    """ A worker running in a process of its own, together with the
+    communicator used to talk to it.
+    """
+
+    def __init__(self, worker_class):
+        self.comm = messaging.MessageCommunicator(concurrent.Queue(),
+                                                  concurrent.Queue())
+        self.worker = worker_class(self.comm.opposite())
+        if debug:
+            self.process = concurrent.Thread(target=self.worker.run)
+        else:
+            self.process = concurrent.Process(target=self.worker.run)
+        # idle workers must not keep the application from exiting
+        self.process.daemon = True
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        if hasattr(self.process, 'terminate'):
+            self.process.terminate()
+
+    def exit(self):
+        self.comm.send('EXIT')
+
+
+class WorkerPool(object):
+    """ Keeps worker processes started in advance, so that a run does not
+    wait for a new process to import the language and build its parsers.
+    Workers are reused by the following runs, and a worker is only
+    replaced after it has been aborted or it has died.
+    """
+
+    def __init__(self, worker_class, size=1):
+        self.worker_class = worker_class
+        self.size = size
+        self.workers = []
+        self.idle = []
+        self.fill()
+
+    def start_worker(self):
+        worker = WorkerProcess(self.worker_class)
+        self.workers.append(worker)
+        return worker
+
+    def fill(self):
+        """ Forgets the idle workers that died, and starts new ones until
+        there are as many workers as the size of the pool.
+        """
+        for worker in [w for w in self.idle if not w.is_alive()]:
+            self.idle.remove(worker)
+            self.workers.remove(worker)
+        while len(self.workers) < self.size:
+            self.idle.append(self.start_worker())
+
+    def acquire(self):
+        """ Returns an idle worker, or a new one if every worker is busy. """
+        self.fill()
+        if self.idle == []:
+            return self.start_worker()
+        return self.idle.pop(0)
+
+    def release(self, worker):
+        """ Takes back a worker that finished its run. """
+        if not worker.is_alive():
+            self.discard(worker)
+        elif len(self.workers) > self.size:
+            # started because every worker was busy
+            self.workers.remove(worker)
+            worker.exit()
+        else:
+            self.idle.append(worker)
+
+    def discard(self, worker):
+        """ Terminates a worker that was aborted or died, and replaces it. """
+        worker.terminate()
+        if worker in self.workers:
+            self.workers.remove(worker)
+        self.fill()
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.terminate()
+        self.workers = []
+        self.idle = []
+
+
+# Pools shared by every ProgramRun, by worker class
+_worker_pools = {}
+
+def worker_pool(worker_class):
+    if worker_class not in _worker_pools:
+        _worker_pools[worker_class] = WorkerPool(worker_class)
+    return _worker_pools[worker_class]
+
+
 class ProgramRun(object):
     RunMode = ProgramWorker.RunMode
 
     def __init__(self, gobstones_version, handler=EjecutionHandler()):
         self.running = False
-        self.process = None
         self.worker = None
         self.handler = handler
         self.comm = None
         self.gobstones_version = gobstones_version
         self.gbs_language = pygobstoneslang
+        self.pool = worker_pool(self.get_worker_class())
 
     def get_worker_class(self):
         return self.gbs_language.GobstonesWorker
 
-    def create_worker_process(self):
-        if self.process is None:
-            self.comm = messaging.MessageCommunicator()
-            self.worker = self.get_worker_class()(self.comm.opposite())
+    def acquire_worker(self):
+        self.worker = self.pool.acquire()
+        self.comm = self.worker.comm
 
-            if debug:
-                self.process = concurrent.Thread(target=self.worker.run)
-            else:
-                self.process = concurrent.Process(target=self.worker.run)
-            self.process.start()
+    def release_worker(self):
+        if not self.worker is None:
+            self.pool.release(self.worker)
+            self.worker = None
 
-    def destroy_worker_process(self):
-        if not self.process is None:
-            if hasattr(self.process, 'terminate'):
-                self.process.terminate()
-            self.process = None
+    def discard_worker(self):
+        if not self.worker is None:
+            self.pool.discard(self.worker)
+            self.worker = None
 
     def timer_init(self):
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.continue_run)
-        self.timer.start(1000)
+        self.timer.start(PollInterval)
 
     def run(self, filename, current_text, board_string, run_mode=RunMode.FULL):
-        if not self.process is None:
-            self.destroy_worker_process()
-        self.create_worker_process()
-        
+        if self.running:
+            # the worker is still busy with the previous run
+            self.interrupt()
+        self.acquire_worker()
+
         self.comm.send('START', (
             filename,
             current_text.encode('ascii', 'ignore'),
@@ -161,7 +262,7 @@ class ProgramRun(object):
             return
         self.timer.stop()
         try:
-            while True:
+            while self.running:
                 message = self.comm.receive_nowait()
 
                 if message.header == 'OK':
@@ -181,14 +282,28 @@ class ProgramRun(object):
                 else:
                     print("GUI got an unexpected message '%s:%s'" %  (message.header, message.body))
         except queue.Empty as e:
-            self.timer.start()
+            if not self.worker.is_alive():
+                self.crashed()
+            else:
+                self.timer.start()
 
     def stop(self):
         self.timer.stop()
-        self.destroy_worker_process()
+        self.release_worker()
         self.running = False
 
-    def abort(self):
-        self.destroy_worker_process()
+    def interrupt(self):
+        """ Stops the current run without reporting it to the handler. """
+        if self.running:
+            self.timer.stop()
+        self.discard_worker()
         self.running = False
+
+    def crashed(self):
+        self.discard_worker()
+        self.running = False
+        self.handler.failure(GobstonesException(i18n('The interpreter stopped unexpectedly')))
+
+    def abort(self):
+        self.interrupt()
         self.handler.failure(Exception('Execution interrupted by the user'))
@@ -69,27 +69,33 @@ class ProgramWorker(object):
         pass
 
     def run(self):
+        # Prepared once, the worker serves every START it receives
+        # until it is told to EXIT
         self.prepare()
-        message = self.communicator.receive()
-        while not message.header in ['START', 'EXIT']:
-            print("Lang got an unexpected message '%s:%s'" %  (message.header, message.body))
-        if message.header == 'EXIT':
-            self.exit()
-            return
-        filename, program_text, initial_board_string, run_mode, gobstones_version = message.body
-        self.start(
-            filename,
-            program_text,
-            initial_board_string,
-            run_mode,
-            gobstones_version
-            )
+        while True:
+            message = self.communicator.receive()
+            if message.header == 'EXIT':
+                self.exit()
+                return
+            elif message.header != 'START':
+                # e.g. an input sent after the program ended
+                print("Lang got an unexpected message '%s:%s'" %  (message.header, message.body))
+                continue
+            filename, program_text, initial_board_string, run_mode, gobstones_version = message.body
+            self.start(
+                filename,
+                program_text,
+                initial_board_string,
+                run_mode,
+                gobstones_version
+                )
 
 
 class GobstonesWorker(ProgramWorker):
 
     def prepare(self):
         self.api = GUIExecutionAPI(self.communicator)
+        lang.gbs_parser.warm_up()
 
     def start(self, filename, program_text, initial_board_string,
               run_mode, gobstones_version="xgobstones"):
@@ -109,12 +115,9 @@ class GobstonesWorker(ProgramWorker):
                 board = tools.board_format.from_string(initial_board_string)
                 self.success(self.gobstones.run(filename, program_text, board))
             elif run_mode == GobstonesWorker.RunMode.ONLY_CHECK:
-                # Parse gobstones script
-                self.gobstones.api.log(i18n.i18n('Parsing.'))
-                gbs_run = self.gobstones.parse(filename, program_text)
-                assert gbs_run.tree
-                # Check semantics, liveness and types
-                self.gobstones.check(gbs_run.tree)
+                # Parse gobstones script and check semantics, liveness
+                # and types, reusing the definitions checked before
+                self.gobstones.check_incrementally(filename, program_text)
                 self.success()
             elif run_mode == GobstonesWorker.RunMode.NAMES:
                 self.success(self.gobstones.parse_names(filename, program_text))
@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Checks that the parsers generated from the Gobstones and XGobstones
+grammars build the same ASTs, and fail with the same errors, as the
+table-driven parser on the example programs shipped with Gobstones, and
+compares the time both take to parse them."""
+
+import os
+import sys
+
+import pygobstoneslang.common.utils as utils
+import pygobstoneslang.lang.ast as ast
+import pygobstoneslang.lang.bnf_parser as bnf_parser
+import pygobstoneslang.lang.gbs_parser as gbs_parser
+from pygobstoneslang.lang.grammar import GbsGrammarFile, XGbsGrammarFile
+from pygobstoneslang.benchmarks import best_time, report
+from pygobstoneslang.benchmarks.bench_parser import example_programs
+
+def summary(value):
+    "Returns a plain representation of a parse result, positions included."
+    if isinstance(value, ast.ASTNode):
+        annotations = [(key, summary(val))
+                       for key, val in utils.seq_sorted(value.annotations.items())]
+        return ('AST', summary(value.pos_begin), summary(value.pos_end),
+                [summary(child) for child in value.children], annotations)
+    elif isinstance(value, bnf_parser.Token):
+        return ('Token', value.type, value.value,
+                summary(value.pos_begin), summary(value.pos_end))
+    elif isinstance(value, list):
+        return [summary(x) for x in value]
+    elif hasattr(value, 'row'):
+        return (value.filename(), value.start, value.row, value.col)
+    else:
+        return value
+
+def parse_summary(use_generated, string, filename, grammar_file):
+    gbs_parser.UseGeneratedParser = use_generated
+    try:
+        return summary(gbs_parser.build_ast(string, filename, grammar_file))
+    except utils.SourceException, exception:
+        return ('Error', exception.__class__.__name__, exception.msg,
+                [summary(pos) for pos in exception.area.interval()])
+    except Exception, exception:
+        # e.g. the actions of some productions of the Gobstones grammar
+        # expect the subtrees of the XGobstones one
+        return ('Error', exception.__class__.__name__, str(exception))
+
+def parse_all(use_generated, programs, grammar_file):
+    gbs_parser.UseGeneratedParser = use_generated
+    for filename, contents in programs:
+        try:
+            gbs_parser.build_ast(contents, filename, grammar_file)
+        except Exception:
+            pass
+
+def main(argv):
+    if len(argv) > 1:
+        root = argv[1]
+    else:
+        root = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+    programs = example_programs(root)
+    if programs == []:
+        print 'No programs found under %s' % (root,)
+        return 1
+    ntokens = 0
+    for grammar_file in [GbsGrammarFile, XGbsGrammarFile]:
+        gbs_parser.generated_parser(grammar_file)
+        grammar_name = os.path.basename(grammar_file)
+        for filename, contents in programs:
+            old = parse_summary(False, contents, filename, grammar_file)
+            new = parse_summary(True, contents, filename, grammar_file)
+            if old != new:
+                print 'Generated parser for %s differs on %s' % (grammar_name, filename)
+                return 1
+
+        old_time = best_time(lambda: parse_all(False, programs, grammar_file))
+        new_time = best_time(lambda: parse_all(True, programs, grammar_file))
+        report('%s, %u files' % (grammar_name, len(programs)), old_time, new_time)
+    gbs_parser.UseGeneratedParser = True
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,100 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Compares the sequential lexer, which tries every token regexp at each
+position, with the lexer that matches a single master regexp, on large
+generated Gobstones programs. Both must produce the same tokens."""
+
+import sys
+
+import pygobstoneslang.lang.gbs_parser as gbs_parser
+from pygobstoneslang.lang.grammar import XGbsGrammarFile
+from pygobstoneslang.benchmarks import best_time, report
+
+_routine_template = '''
+/*
+  Routine number %(i)u.
+*/
+procedure Fill%(i)u(color, n) {
+    -- puts n stones on every cell of the row
+    IrAlBorde(Oeste)
+    while (puedeMover(Este)) {
+        repeat (n) { Poner(color) }
+        Mover(Este)
+    }
+    if (hayBolitas(Rojo) && nroBolitas(Azul) >= %(i)u) {
+        Sacar(Rojo)
+    } else {
+        BOOM("row %(i)u has no red stones")
+    }
+}
+
+function count%(i)u(dir) {
+    total := 0
+    {- counts the stones
+       in the given direction -}
+    while (puedeMover(dir)) {
+        Mover(dir)
+        total := total + nroBolitas(Verde) * %(i)u - 1
+    }
+    return (total)
+}
+'''
+
+_program_template = '''
+program {
+    Fill0(Rojo, 3)
+    x := count0(Norte)
+}
+'''
+
+def generate_program(routines):
+    "Returns the text of a Gobstones program with the given number of routines."
+    parts = [_routine_template % {'i': i} for i in range(routines)]
+    parts.append(_program_template)
+    return ''.join(parts)
+
+def token_summary(tokens):
+    return [(tok.type, tok.value,
+             tok.pos_begin.start, tok.pos_begin.row, tok.pos_begin.col,
+             tok.pos_end.start, tok.pos_end.row, tok.pos_end.col)
+            for tok in tokens]
+
+def main(argv):
+    sizes = [int(x) for x in argv[1:]] or [100, 1000]
+    analyzer = gbs_parser.create_analizer(XGbsGrammarFile)
+    new_lexer = analyzer.lexer
+    old_lexer = gbs_parser.GbsLexer(new_lexer.tokens, new_lexer.reserved, compiled=False)
+    assert new_lexer._master_regexp is not None
+
+    for size in sizes:
+        program = generate_program(size)
+        for method in ['pure_tokenize', 'tokenize']:
+            old_tokens = token_summary(getattr(old_lexer, method)(program, 'bench.gbs'))
+            new_tokens = token_summary(getattr(new_lexer, method)(program, 'bench.gbs'))
+            if old_tokens != new_tokens:
+                print 'Token streams of %s differ for %u routines' % (method, size)
+                return 1
+
+        old_time = best_time(lambda: list(old_lexer.pure_tokenize(program, 'bench.gbs')))
+        new_time = best_time(lambda: list(new_lexer.pure_tokenize(program, 'bench.gbs')))
+        report('%u lines, %u tokens' % (program.count('\n'), len(new_tokens)), old_time, new_time)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
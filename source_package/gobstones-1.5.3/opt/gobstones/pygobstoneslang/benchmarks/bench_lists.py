@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Runs list-heavy XGobstones programs over lists of n and 2n elements
+(10000 and 20000 by default) and checks their results. Operations that
+take constant time make each program take about twice as long on the
+longer list; copying the list on every step makes it take four times
+as long."""
+
+import sys
+
+import pygobstoneslang.common.i18n as i18n
+import pygobstoneslang.lang as lang
+from pygobstoneslang.benchmarks import best_time
+
+Programs = [
+    ('build with ++', '''
+program {
+  xs := []
+  i := 1
+  repeat (%(n)u) {
+    xs := xs ++ [i]
+    i := i + 1
+  }
+  return (last(xs))
+}''', lambda n: n),
+    ('build with %(Append)s', '''
+program {
+  xs := []
+  i := 1
+  repeat (%(n)u) {
+    %(Append)s(xs, i)
+    i := i + 1
+  }
+  return (head(xs) + last(xs))
+}''', lambda n: n + 1),
+    ('foreach over a range', '''
+program {
+  s := 0
+  foreach x in [1 .. %(n)u] {
+    s := s + x
+  }
+  return (s)
+}''', lambda n: n * (n + 1) // 2),
+    ('recursive tail walk', '''
+function sumList(xs) {
+  if (isEmpty(xs)) {
+    s := 0
+  } else {
+    s := head(xs) + sumList(tail(xs))
+  }
+  return (s)
+}
+program {
+  return (sumList([1 .. %(n)u]))
+}''', lambda n: n * (n + 1) // 2),
+    ('last and init walk', '''
+program {
+  xs := [1 .. %(n)u]
+  s := 0
+  while (not isEmpty(xs)) {
+    s := s + last(xs)
+    xs := init(xs)
+  }
+  return (s)
+}''', lambda n: n * (n + 1) // 2),
+    ('reverse with ++', '''
+program {
+  ys := []
+  foreach x in [1 .. %(n)u] {
+    ys := [x] ++ ys
+  }
+  return (head(ys) - last(ys))
+}''', lambda n: n - 1),
+]
+
+def compile_program(gobstones, source, n):
+    names = {'n': n, 'Append': i18n.i18n('Append')}
+    return gobstones.compile('bench_lists.gbs', source % names)
+
+def run_program(gobstones, compiled):
+    board = lang.Board()
+    return gobstones.run_object_code(compiled.compiled_program, board).result
+
+def main(argv):
+    if len(argv) > 1:
+        n = int(argv[1])
+    else:
+        n = 10000
+    sys.setrecursionlimit(10000)
+    options = lang.GobstonesOptions(lang.GobstonesOptions.LangVersion.XGobstones,
+                                    allow_recursion=True)
+    gobstones = lang.Gobstones(options, lang.ExecutionAPI())
+
+    for name, source, expected in Programs:
+        name = name % {'Append': i18n.i18n('Append')}
+        times = []
+        for size in [n, 2 * n]:
+            compiled = compile_program(gobstones, source, size)
+            result = run_program(gobstones, compiled)
+            if [value for _, value in result] != [str(expected(size))]:
+                print '%s returned %s for %u elements' % (name, result, size)
+                return 1
+            times.append(best_time(lambda: run_program(gobstones, compiled)))
+        print '%-24s n %8.3fs   2n %8.3fs   ratio %5.2f' % (
+            name, times[0], times[1], times[1] / max(times[0], 1e-9))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
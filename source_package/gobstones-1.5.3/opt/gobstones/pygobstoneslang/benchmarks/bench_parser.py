@@ -0,0 +1,114 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Measures the parse throughput over the example programs shipped with
+Gobstones, comparing the parser loop that resolves conflicts and looks
+symbols up by name on every step with the one that uses the finalized
+parse table. Both must produce the same parsing events."""
+
+import os
+import sys
+
+import pygobstoneslang.common.utils as utils
+import pygobstoneslang.lang.bnf_parser as bnf_parser
+import pygobstoneslang.lang.gbs_parser as gbs_parser
+from pygobstoneslang.lang.grammar import XGbsGrammarFile
+from pygobstoneslang.benchmarks import best_time, report
+
+def reference_parse(parser, token_stream):
+    "The parser loop before the parse table was finalized."
+    stack = ['<start>']
+    previous_token = next(token_stream) # BOF
+    token = next(token_stream)
+    while stack != []:
+        top = stack[-1]
+        if bnf_parser.is_nonterminal(top):
+            productions = parser._parse_table.get((top, token.type), None)
+            if productions is None:
+                parser.parse_error(top, previous_token, token)
+            production = utils.dict_min_value(productions,
+                                              key=lambda p: p.rule)
+            stack.pop()
+            res_nonterm = None
+            for nonterm in utils.seq_reversed(production.rule):
+                if nonterm != '':
+                    stack.append(nonterm)
+                res_nonterm = nonterm
+            yield 'PRODUCE', res_nonterm, production
+        elif top == token.type:
+            yield 'CONSUME', top, token
+            previous_token = token
+            token = next(token_stream)
+            stack.pop()
+        else:
+            parser.parse_error(top, previous_token, token)
+
+def example_programs(root):
+    "Returns the (filename, contents) of the .gbs files under root."
+    programs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.gbs'):
+                path = os.path.join(dirpath, filename)
+                programs.append((path, utils.read_file(path)))
+    return programs
+
+def event_summary(events):
+    return [(event, symbol, id(value)) for event, symbol, value in events]
+
+def parse_all(parse, token_lists):
+    for tokens in token_lists:
+        for _ in parse(iter(tokens)):
+            pass
+
+def main(argv):
+    if len(argv) > 1:
+        root = argv[1]
+    else:
+        root = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+    analyzer = gbs_parser.create_analizer(XGbsGrammarFile)
+    lexer = analyzer.lexer
+    parser = analyzer.parser
+
+    token_lists = []
+    for filename, contents in example_programs(root):
+        tokens = list(lexer.tokenize(contents, filename))
+        try:
+            old_events = event_summary(reference_parse(parser, iter(tokens)))
+            new_events = event_summary(parser.parse(iter(tokens)))
+        except bnf_parser.ParserException:
+            continue
+        if old_events != new_events:
+            print 'Parsing events differ for %s' % (filename,)
+            return 1
+        token_lists.append(tokens)
+
+    if token_lists == []:
+        print 'No programs found under %s' % (root,)
+        return 1
+    ntokens = sum([len(tokens) for tokens in token_lists])
+    old_time = best_time(lambda: parse_all(lambda ts: reference_parse(parser, ts), token_lists))
+    new_time = best_time(lambda: parse_all(parser.parse, token_lists))
+    report('%u files, %u tokens' % (len(token_lists), ntokens), old_time, new_time)
+    print '%-24s old %8.0f   new %8.0f   tokens/s' % (
+        '', ntokens / max(old_time, 1e-9), ntokens / max(new_time, 1e-9))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -16,6 +16,7 @@
 #
 
 import os
+import bisect
 
 import i18n as i18n
 from utils import *
@@ -35,32 +36,109 @@ class ProgramElement(object):
   description(): human readable description"""
   def source(self):
     return self.pos_begin.string[self.pos_begin.start:self.pos_end.start]
+  def __getstate__(self):
+    # subclasses keep their most common attributes in slots
+    state = dict(getattr(self, '__dict__', {}))
+    for cls in type(self).__mro__:
+      for name in getattr(cls, '__slots__', ()):
+        if hasattr(self, name):
+          state[name] = getattr(self, name)
+    return state
+  def __setstate__(self, state):
+    for name, value in state.items():
+      setattr(self, name, value)
 
-class Position(object):
-  "Represents a position in a source file or string."
-  def __init__(self, string, filename='...', start=0, row=1, col=1):
+class SourceFile(object):
+  """A source string and the name of its file, shared by all the positions
+inside it. Knows where each line starts, to find the row and column of
+an offset."""
+  def __init__(self, string, filename='...'):
     self.string = string
-    self._filename = filename
+    self.filename = filename
+    self._line_starts = None
+  def line_starts(self):
+    "Returns the sorted offsets where each line of the source starts."
+    if self._line_starts is None:
+      string = self.string
+      starts = [0]
+      i = string.find('\n')
+      while i != -1:
+        starts.append(i + 1)
+        i = string.find('\n', i + 1)
+      self._line_starts = starts
+    return self._line_starts
+  def row_col(self, offset):
+    "Returns the row and column (starting from 1) of the given offset."
+    line_starts = self.line_starts()
+    row = bisect.bisect_right(line_starts, offset)
+    return row, offset - line_starts[row - 1] + 1
+  def __getstate__(self):
+    return self.string, self.filename
+  def __setstate__(self, state):
+    self.string, self.filename = state
+    self._line_starts = None
+
+class SourceFragment(SourceFile):
+  """A fragment of a SourceFile that starts at the given offset and was
+parsed on its own. The positions inside it are relative to the fragment,
+so it can be moved to another offset, or to another version of the
+file, without changing them."""
+  def __init__(self, source_file, offset=0):
+    self.source_file = source_file
+    self.offset = offset
+  def move(self, source_file, offset):
+    "Moves the fragment to the given offset of the source file."
+    self.source_file = source_file
+    self.offset = offset
+  @property
+  def string(self):
+    return self.source_file.string[self.offset:]
+  @property
+  def filename(self):
+    return self.source_file.filename
+  def row_col(self, offset):
+    return self.source_file.row_col(self.offset + offset)
+  def __getstate__(self):
+    return self.source_file, self.offset
+  def __setstate__(self, state):
+    self.source_file, self.offset = state
+
+class Position(object):
+  """Represents a position in a source file or string. Only the offset is
+stored; the row and column are computed when they are needed."""
+  __slots__ = ('source_file', 'start')
+  def __init__(self, source, filename='...', start=0):
+    """The source is either a string or the SourceFile of the string,
+which should be shared by all the positions in it."""
+    if not isinstance(source, SourceFile):
+      source = SourceFile(source, filename)
+    self.source_file = source
     self.start = start
-    self.row = row
-    self.col = col
+  def __getstate__(self):
+    return self.source_file, self.start
+  def __setstate__(self, state):
+    self.source_file, self.start = state
+  @property
+  def string(self):
+    return self.source_file.string
+  @property
+  def row(self):
+    return self.source_file.row_col(self.start)[0]
+  @property
+  def col(self):
+    return self.source_file.row_col(self.start)[1]
   def after_reading(self, string):
     """Returns the position that results after reading the characters
 in the string."""
-    new_start = self.start + len(string)
-    newlines = string.count('\n')
-    new_row = self.row + newlines
-    if newlines == 0:
-      new_col = self.col + len(string)
-    else:
-      new_col = len(string) - string.rindex('\n')
-    return Position(self.string, self._filename, new_start, new_row, new_col)
+    return Position(self.source_file, start=self.start + len(string))
   def __repr__(self):
-    return '%s:%s:%s' % (self._filename, self.row, self.col)
+    row, col = self.source_file.row_col(self.start)
+    return '%s:%s:%s' % (self.source_file.filename, row, col)
   def filename(self):
-    return self._filename
+    return self.source_file.filename
   def row_col(self):
-    return '%s %s, %s %s' % (i18n.i18n('line'), self.row, i18n.i18n('column'), self.col)
+    row, col = self.source_file.row_col(self.start)
+    return '%s %s, %s %s' % (i18n.i18n('line'), row, i18n.i18n('column'), col)
   def file_row_col(self):
     return '%s (%s)' % (self.filename(), self.row_col())
   def file_row(self):
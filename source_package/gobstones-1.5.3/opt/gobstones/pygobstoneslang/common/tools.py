@@ -22,6 +22,7 @@ import pygobstoneslang.lang.gbs_infer as gbs_infer
 import pygobstoneslang.lang.gbs_compiler as gbs_compiler
 import pygobstoneslang.lang.gbs_builtins as gbs_builtins
 import pygobstoneslang.lang.gbs_vm as gbs_vm
+import pygobstoneslang.lang.jit.gbs_jit as gbs_jit
 import pygobstoneslang.lang.gbs_board as gbs_board
 import pygobstoneslang.lang.board.formats as formats
 import i18n as i18n
@@ -39,8 +40,8 @@ tools.typecheck = gbs_infer.typecheck
 tools.compile = gbs_compiler.compile_program
 tools.interp = gbs_vm.interp
 tools.GbsVmInterpreter = gbs_vm.GbsVmInterpreter
-#import jit.gbs_jit
-#tools.GbsVmInterpreter = jit.gbs_jit.JitInterpreter
+tools.JitInterpreter = gbs_jit.JitInterpreter
+tools.jit_compile = gbs_jit.make_runnable
 tools.Board = gbs_board.Board
 tools.board_format = formats.AvailableFormats['gbb']()
 tools.builtins = gbs_builtins
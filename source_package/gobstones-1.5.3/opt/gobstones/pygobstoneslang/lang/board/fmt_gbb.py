@@ -59,22 +59,21 @@ class GbbBoardFormat(basic.BoardFormat):
 
   def dump_with_translator(self, board, translate):
     w, h = board.size
-    output = 'GBB/1.0\r\n'
-    output += '%s %i %i\r\n' % (translate('size'), w, h)
+    output = ['GBB/1.0\r\n']
+    output.append('%s %i %i\r\n' % (translate('size'), w, h))
+    colors = [translate(gbs_builtins.Color(coli).name()) for coli in range(4)]
     for x in range(w):
       for y in range(h):
         cell = []
-        for coli in range(4):
-          cant = board.cells[y][x].num_stones(coli)
+        for coli, cant in board[x, y].all_stones_count():
           if cant == 0: continue
-          col = gbs_builtins.Color(coli).name()
-          cell.append('%s %i' % (translate(col), cant))
+          cell.append('%s %i' % (colors[coli], cant))
         if cell == []: continue
-        output += '%s %i %i %s\r\n' % (translate('cell'), x, y, ' '.join(cell))
+        output.append('%s %i %i %s\r\n' % (translate('cell'), x, y, ' '.join(cell)))
     y, x = board.head
-    output += '%s %i %i\r\n' % (translate('head'), x, y)
-    output += '%%\r\n'
-    return output
+    output.append('%s %i %i\r\n' % (translate('head'), x, y))
+    output.append('%%\r\n')
+    return ''.join(output)
 
   def load(self, board, f):
 
@@ -22,6 +22,7 @@ import functools
 import pygobstoneslang.common.utils as utils
 from gbs_type import UserDefinedTypes, GbsVariantType
 from gbs_io import KeyBuilder
+from gbs_list import PersistentList
 from sets import Set
 
 explicit_builtins = True
@@ -120,6 +121,9 @@ TYPE_BB = GbsFunctionType(
 def clone_value(value):
     if isinstance(value, GbsObject):
         return value.clone()
+    elif isinstance(value, PersistentList):
+        # lists are immutable, their elements are cloned when added
+        return value
     elif isinstance(value, list):
         return [clone_value(val) for val in value]
     elif isinstance(value, dict):
@@ -138,11 +142,24 @@ class GbsObjectRef(object):
         self.get = getter
         self.set = setter
 
+#### Records and arrays are copied on write. Cloning an object makes a
+#### new object that shares its value and bindings, and marks both
+#### objects as shared. The first change made through _getRef or
+#### _SetRefValue to a shared object copies its value and bindings, whose
+#### elements are cloned in turn (thus shared, not copied), so assigning
+#### a large record or array only copies the parts that are changed.
+####
+#### Objects are never stored in a value without cloning them, so an
+#### object that is not shared can only be reached through a single
+#### variable, and can be changed in place.
+
 class GbsObject(object):
     def __init__(self, value, type, bindings = {}):
         self.value = value
         self.bindings = bindings
         self.type = type
+        # whether the value and bindings may be shared with other objects
+        self.shared = False
 
     def full_type(self):
         return self.type
@@ -151,13 +168,20 @@ class GbsObject(object):
         return repr(self.value)
 
     def clone(self):
-        new_value = clone_value(self.value)
-
-        new_bindings = {}
-        for key, value in self.bindings.items():
-            new_bindings[key] = clone_value(value)
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        if not isinstance(self.value, (list, dict)):
+            obj.value = clone_value(self.value)
+        self.shared = obj.shared = True
+        return obj
 
-        return GbsObject(new_value, self.type, new_bindings)
+    def unshare(self):
+        "Copies the value and bindings of the object if they are shared."
+        if self.shared:
+            if isinstance(self.value, (list, dict)):
+                self.value = clone_value(self.value)
+            self.bindings = clone_value(self.bindings)
+            self.shared = False
 
     def __getattr__(self, name):
         return self.value.__getattribute__(name)
@@ -168,23 +192,31 @@ class GbsListBindings(object):
     def __init__(self, lstobj):
         self.lstobj = lstobj
         self.bindings = {}
-        self.references = {
-            i18n.i18n('head'): self.lstobj.first_ref,
-            i18n.i18n('last'): self.lstobj.last_ref,
-            i18n.i18n('current'): self.lstobj.current_ref,
-            i18n.i18n('init'): self.lstobj.init_ref,
-            i18n.i18n('tail'): self.lstobj.tail_ref,
-        }
+        self._references = None
+
+    def references(self):
+        # built when first used, since most lists never use them
+        if self._references is None:
+            self._references = {
+                i18n.i18n('head'): self.lstobj.first_ref,
+                i18n.i18n('last'): self.lstobj.last_ref,
+                i18n.i18n('current'): self.lstobj.current_ref,
+                i18n.i18n('init'): self.lstobj.init_ref,
+                i18n.i18n('tail'): self.lstobj.tail_ref,
+            }
+        return self._references
 
     def __getitem__(self, key):
-        if key in self.references.keys():
-            return self.references[key]()
+        references = self.references()
+        if key in references:
+            return references[key]()
         else:
             return self.bindings[key]
 
     def __setitem__(self, key, value):
-        if key in self.references.keys():
-            self.references[key].set(value)
+        references = self.references()
+        if key in references:
+            references[key]().set(value)
         else:
             self.bindings[key] = value
 
@@ -196,7 +228,11 @@ class GbsListBindings(object):
 
 class GbsListObject(GbsObject):
     # [TODO] Not-empty list operations...
-    def __init__(self, value = []):
+    def __init__(self, value = None):
+        if value is None:
+            value = PersistentList()
+        elif isinstance(value, list):
+            value = PersistentList(value)
         super(GbsListObject, self).__init__(value, poly_typeof(value), GbsListBindings(self))
         self.cursor = 0
 
@@ -204,14 +240,14 @@ class GbsListObject(GbsObject):
         def getter():
             return self.value[0]
         def setter(value):
-            self.value[0] = value
+            self.value = self.value.replace(0, value)
         return GbsObjectRef(getter, setter)
 
     def last_ref(self):
         def getter():
             return self.value[-1]
         def setter(value):
-            self.value[-1] = value
+            self.value = self.value.replace(-1, value)
         return GbsObjectRef(getter, setter)
 
     def current_ref(self):
@@ -222,34 +258,32 @@ class GbsListObject(GbsObject):
                 msg = i18n.i18n('List cursor does not refers to a valid value.')
                 raise GbsRuntimeException(msg, None)
         def setter(value):
-            self.value[self.cursor] = value
+            self.value = self.value.replace(self.cursor, value)
         return GbsObjectRef(getter, setter)
 
     def tail_ref(self):
         def getter():
             if len(self.value) > 1:
-                return GbsListObject(self.value[1:])
+                return GbsListObject(self.value.tail())
             else:
                 return GbsListObject()
         def setter(obj):
-            lst = obj.value
-            self.value = [self.value[0]] + lst
+            self.value = obj.value.cons(self.value[0])
         return GbsObjectRef(getter, setter)
 
     def init_ref(self):
         def getter():
             if len(self.value) > 1:
-                return GbsListObject(self.value[:-1])
+                return GbsListObject(self.value.init())
             else:
                 return GbsListObject()
         def setter(obj):
-            lst = obj.value
-            self.value = lst + [self.value[-1]]
+            self.value = obj.value.snoc(self.value[-1])
 
         return GbsObjectRef(getter, setter)
 
     def clone(self):
-        obj = GbsListObject(clone_value(self.value))
+        obj = GbsListObject(self.value)
         obj.cursor = self.cursor
         return obj
 
@@ -257,9 +291,7 @@ class GbsFieldObject(GbsObject):
     pass
 
 class GbsArrayObject(GbsObject):
-    def clone(self):
-        obj = super(GbsArrayObject, self).clone()
-        return GbsArrayObject(obj.value, obj.type, obj.bindings)
+    pass
 
 class GbsRecordObject(GbsObject):
 
@@ -277,11 +309,6 @@ class GbsRecordObject(GbsObject):
             return self.constructor + '(' + ', '.join([k + ' <- ' + repr(v) for k, v in self.value.items()]) + ')'
         else:
             return self.constructor
-    def clone(self):
-        obj = super(GbsRecordObject, self).clone()
-        rec = GbsRecordObject(obj.value, obj.type, obj.bindings)
-        rec.constructor = self.constructor
-        return rec
 
     def full_type(self):
         if self.constructor == self.type:
@@ -474,7 +501,7 @@ def poly_typeof(value):
         return 'Bool'
     elif isinteger(value):
         return 'Int'
-    elif isinstance(value, list):
+    elif isinstance(value, (list, PersistentList)):
         return 'List'
     elif isinstance(value, str):
         return 'String'
@@ -485,12 +512,17 @@ def poly_typeof(value):
 
 def poly_range(first, last, second):
     "Generate a list between two given basic values. Types must match."
+    return list(poly_range_iter(first, last, second))
+
+def poly_range_iter(first, last, second):
+    """Iterate over the values between two given basic values, without
+    building the list. Types must match."""
     if poly_typeof(first) == poly_typeof(last):
         if isinstance(first, list):
             assert False
         if poly_typeof(first) == poly_typeof(second):
             if poly_ord(first)[0] == poly_ord(second)[0]:
-                return []
+                return
             else:
                 increment = poly_ord(second)[0] - poly_ord(first)[0]
             assert increment != 0
@@ -514,16 +546,13 @@ def poly_range(first, last, second):
             else:
                 return poly_ord(elem1)[0] <= poly_ord(elem2)[0]
 
-        elements = []
         elem = first
         while not elem_reached(elem, last):
-            elements.append(elem)
+            yield elem
             elem = next_elem(elem)
 
         if poly_ord(elem) == poly_ord(last):
-            elements.append(elem)
-
-        return elements
+            yield elem
     else:
         assert False
 
@@ -727,11 +756,14 @@ def board_clear(global_state, board):
 
 def board_put_stone(global_state, board, color):
     """Put a stone in the board."""
+    put_stone(global_state, board.value, color)
+    return board
+
+def put_stone(global_state, board, color):
     if poly_typeof(color) != 'Color':
         msg = i18n.i18n('The argument to PutStone should be a color')
         raise GbsRuntimeException(msg, global_state.area())
-    board.value.put_stone(color)
-    return board
+    board.put_stone(color)
 
 def board_binary_operation(global_state, board, v2, f):
     if poly_typeof(board) != 'Board':
@@ -747,29 +779,35 @@ def board_unary_operation(global_state, board, f):
 
 def board_take_stone(global_state, board, color):
     """Take a stone from the board."""
+    take_stone(global_state, board.value, color)
+    return board
+
+def take_stone(global_state, board, color):
     if poly_typeof(color) != 'Color':
         msg = i18n.i18n('The argument to TakeStone should be a color')
         raise GbsRuntimeException(msg, global_state.area())
-    if board.value.num_stones(color) > 0:
-        board.value.take_stone(color)
+    if board.num_stones(color) > 0:
+        board.take_stone(color)
     else:
         msg = global_state.backtrace(
             i18n.i18n('Cannot take stones of color %s') % (color,))
         raise GbsRuntimeException(msg, global_state.area())
-    return board
 
 def board_move(global_state, board, direction):
     """Move the head."""
+    move(global_state, board.value, direction)
+    return board
+
+def move(global_state, board, direction):
     if poly_typeof(direction) != 'Dir':
         msg = i18n.i18n('The argument to Move should be a direction')
         raise GbsRuntimeException(msg, global_state.area())
-    if board.value.can_move(direction):
-        board.value.move(direction)
+    if board.can_move(direction):
+        board.move(direction)
     else:
         msg = global_state.backtrace(
             i18n.i18n('Cannot move to %s') % (direction,))
         raise GbsRuntimeException(msg, global_state.area())
-    return board
 
 def board_num_stones(global_state, board, color):
     """Number of stones of the given color."""
@@ -793,7 +831,7 @@ def board_can_move(global_state, board, direction):
     return board.can_move(direction)
 
 def internal_read(global_state):
-    return global_state.interpreter.interactive_api.read()
+    return global_state.interpreter.read_key()
 
 def internal_show(global_state, board):
     global_state.interpreter.interactive_api.show(board.value.clone())
@@ -871,13 +909,15 @@ def list_setter(lst, index):
     return set_list
 
 def get_ref(global_state, from_, index):
-    if isinstance(from_, list):
+    if isinstance(from_, (list, PersistentList)):
         if isinstance(index, str):
             msg = global_state.backtrace(i18n.i18n('Cannot apply "." operator to "%s"') % (poly_typeof(from_),))
         else:
             msg = global_state.backtrace(i18n.i18n('"%s" is not indexable.') % (poly_typeof(from_),))
         raise GbsRuntimeException(msg, global_state.area())
 
+    if isinstance(from_, GbsObject):
+        from_.unshare()
     if isinstance(from_, GbsArrayObject):
         if index in range(0, len(from_.value)):
             content = from_.value
@@ -917,6 +957,7 @@ def assign_ref(global_state, ref, value):
         ref.value = rvalue.value
         ref.type = rvalue.type
         ref.bindings = rvalue.bindings
+        ref.shared = rvalue.shared
     else:
         ref.set(rvalue)
 
@@ -1014,7 +1055,12 @@ BUILTINS_EXPLICIT_BOARD = [
 
 def implicit_board_func(f):
     def ff(gs, *values):
-        return f(gs, gs.board.clone(), *values)
+        board = gs.board
+        board.push_state()
+        try:
+            return f(gs, board, *values)
+        finally:
+            board.pop_state()
     return ff
 
 def implicit_board_proc(f):
@@ -1022,6 +1068,20 @@ def implicit_board_proc(f):
         f(gs, GbsObject(gs.board, 'Board'), *values)
     return ff
 
+#### The most used board primitives take the global board itself: the
+#### procedures without wrapping it in a Board value, and the functions
+#### without saving and restoring its state, since they do not change it.
+
+def implicit_board_fast_proc(f):
+    def ff(gs, value):
+        f(gs, gs.board, value)
+    return ff
+
+def implicit_board_fast_func(f):
+    def ff(gs, value):
+        return f(gs, gs.board, value)
+    return ff
+
 def disabled_references(global_state, *args):
     msg = i18n.i18n('Passing by reference is disabled when using implicit board.')
     raise GbsRuntimeException(msg, global_state.area())
@@ -1063,19 +1123,19 @@ BUILTINS_IMPLICIT_BOARD = [
     BuiltinProcedure(
         i18n.i18n('PutStone'),
         GbsProcedureType(GbsTupleType([GbsColorType()])),
-        implicit_board_proc(board_put_stone)
+        implicit_board_fast_proc(put_stone)
     ),
 
     BuiltinProcedure(
         i18n.i18n('TakeStone'),
         GbsProcedureType(GbsTupleType([GbsColorType()])),
-        implicit_board_proc(board_take_stone)
+        implicit_board_fast_proc(take_stone)
     ),
 
     BuiltinProcedure(
         i18n.i18n('Move'),
         GbsProcedureType(GbsTupleType([GbsDirType()])),
-        implicit_board_proc(board_move)
+        implicit_board_fast_proc(move)
     ),
 
     BuiltinProcedure(
@@ -1097,7 +1157,7 @@ BUILTINS_IMPLICIT_BOARD = [
         GbsFunctionType(
             GbsTupleType([GbsColorType()]),
             GbsTupleType([GbsIntType()])),
-        implicit_board_func(board_num_stones)
+        implicit_board_fast_func(board_num_stones)
     ),
 
     BuiltinFunction(
@@ -1105,7 +1165,7 @@ BUILTINS_IMPLICIT_BOARD = [
         GbsFunctionType(
             GbsTupleType([GbsColorType()]),
             GbsTupleType([GbsBoolType()])),
-        implicit_board_func(board_exist_stones)
+        implicit_board_fast_func(board_exist_stones)
     ),
 
     BuiltinFunction(
@@ -1113,7 +1173,7 @@ BUILTINS_IMPLICIT_BOARD = [
         GbsFunctionType(
             GbsTupleType([GbsDirType()]),
             GbsTupleType([GbsBoolType()])),
-        implicit_board_func(board_can_move)
+        implicit_board_fast_func(board_can_move)
     ),
 ]
 
@@ -1419,31 +1479,38 @@ def list_isempty(global_state, lst):
 
 def list_head(global_state, lst):
     "Return the first element of the list."
-    return notempty_list_operation(global_state, lst, lambda lst: lst[0])
+    return notempty_list_operation(global_state, lst, lambda lst: lst.head())
 
 def list_tail(global_state, lst):
     "Return the tail of the list."
-    return notempty_list_operation(global_state, lst, lambda lst: lst[1:])
+    return notempty_list_operation(global_state, lst, lambda lst: lst.tail())
 
 def list_concat(global_state, lst1, lst2):
-    return list_binary_operation(global_state, lst1, lst2, lambda lst1, lst2: lst1 + lst2)
+    return list_binary_operation(global_state, lst1, lst2, lambda lst1, lst2: lst1.concat(lst2))
 
 def list_last(global_state, lst):
     "Return the last element of the list."
-    return notempty_list_operation(global_state, lst, lambda lst: lst[-1])
+    return notempty_list_operation(global_state, lst, lambda lst: lst.last())
 
 def list_init(global_state, lst):
     "Return the initial segment of the list."
-    return notempty_list_operation(global_state, lst, lambda lst: lst[:-1])
+    return notempty_list_operation(global_state, lst, lambda lst: lst.init())
+
+def list_element(value):
+    "Return the value to be stored as an element of a list."
+    if isinstance(value, GbsObject):
+        return value.clone()
+    else:
+        return wrap_value(value)
 
 def list_gen(global_state, value):
-    return [wrap_value(value)]
+    return PersistentList([list_element(value)])
 
 def list_nil(global_state):
-    return []
+    return PersistentList()
 
 def list_range(global_state, x, y, z):
-    return poly_range(x,y,z)
+    return PersistentList(poly_range(x,y,z))
 
 def list_wrapper(lst):
     return GbsListObject(lst)
@@ -1460,28 +1527,20 @@ def list_next(global_state, lst):
     return lst
 
 def list_append(global_state, lst, element):
-    lst.append(wrap_value(element))
+    lst.value = lst.value.snoc(list_element(element))
     return lst
 
 def list_add_first(global_state, lst, element):
-    lst.insert(0, wrap_value(element))
+    lst.value = lst.value.cons(list_element(element))
     return lst
 
 def list_drop_first(global_state, lst):
-    def inner_impl(lst):
-        if len(lst) > 1:
-            return lst[1:]
-        else:
-            return []
-    return notempty_list_operation(global_state, lst, inner_impl)
+    lst.value = notempty_list_operation(global_state, lst.value, lambda lst: lst.tail())
+    return lst
 
 def list_drop_last(global_state, lst):
-    def inner_impl(lst):
-        if len(lst) > 1:
-            return lst[:-1]
-        else:
-            return []
-    return notempty_list_operation(global_state, lst, inner_impl)
+    lst.value = notempty_list_operation(global_state, lst.value, lambda lst: lst.init())
+    return lst
 
 TYPE_LB = GbsForallType(
             [TYPEVAR_X],
@@ -1622,7 +1681,7 @@ def mk_record(global_state, type, fields, bindings={}):
         for k in bindings.keys():
             _bindings[k] = bindings[k].clone()
         for field in fields:
-            _bindings[field.value[0]] = wrap_value(field.value[1])
+            _bindings[field.value[0]] = wrap_value(clone_value(field.value[1]))
         return GbsRecordObject(_bindings, type, _bindings)
     except Exception as exception:
         "Just in case..."
@@ -1957,8 +2016,10 @@ def parse_constant(string):
 
 # Builtins getters
 
-def get_builtins():
-    if explicit_builtins:
+def get_builtins(explicit=None):
+    if explicit is None:
+        explicit = explicit_builtins
+    if explicit:
         return BUILTINS + BUILTINS_EXPLICIT_BOARD
     else:
         return BUILTINS + BUILTINS_IMPLICIT_BOARD
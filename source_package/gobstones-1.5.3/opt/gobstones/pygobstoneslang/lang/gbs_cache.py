@@ -0,0 +1,327 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"On-disk cache of compiled Gobstones programs."
+
+import os
+import sys
+import glob
+import types
+import tempfile
+import cPickle
+import StringIO
+
+import pygobstoneslang.common.i18n as i18n
+import pygobstoneslang.common.utils as utils
+
+import gbs_builtins
+import gbs_parser
+import gbs_type
+
+#### Compiling a program parses, lints and compiles the program, its
+#### Prelude and every module it imports. The cache stores the linted
+#### AST and the compiled program, keyed by the hash of the source, the
+#### name of the file, the grammar and language, the checking options
+#### and the implementation of the language itself.
+####
+#### Each entry also records the hash of the contents of the modules
+#### and Prelude that were read to compile the program (or that no
+#### Prelude was found). An entry is only used while they are unchanged,
+#### so editing a module only invalidates the programs that import it.
+####
+#### Entries do not depend on the directory where the program lives:
+#### the names of the program and module files are stored relative to
+#### the directory of the program, together with the objects that hold
+#### them, and relocated when an entry is loaded.
+
+CACHE_VERSION = 1
+
+CacheDir = os.path.join(os.path.expanduser('~'), '.pygobstones', 'cache', 'compiled')
+
+MaxEntries = 256
+
+# Pickling recurses on the nesting of the AST, deeper than what the
+# default recursion limit allows for most programs.
+PickleRecursionLimit = 10000
+
+def _with_recursion_limit(function):
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, PickleRecursionLimit))
+    try:
+        return function()
+    finally:
+        sys.setrecursionlimit(limit)
+
+class CompiledProgram(object):
+    "A linted AST, its compiled program and the types it defines."
+
+    def __init__(self, tree, compiled_program, types):
+        self.tree = tree
+        self.compiled_program = compiled_program
+        self.types = types
+
+    def install(self):
+        """Restores the global state that linting the program leaves,
+        which the compiled program relies on when it is run."""
+        gbs_builtins.explicit_builtins = self.compiled_program.explicit_builtins
+        gbs_type.set_user_defined_types(self.types)
+
+_implementation_hash = []
+
+def implementation_hash():
+    """Returns a hash of the source files of the language implementation,
+    so that entries made by other versions of it are not used."""
+    if _implementation_hash == []:
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        filenames = []
+        for pattern in ['common/*.py', 'lang/*.py', 'lang/*/*.py', 'lang/grammar/*.bnf']:
+            filenames.extend(glob.glob(os.path.join(package_dir, pattern)))
+        hashes = [utils.md5sum(utils.read_file(filename))
+                  for filename in utils.seq_sorted(filenames)]
+        _implementation_hash.append(utils.md5sum(''.join(hashes)))
+    return _implementation_hash[0]
+
+def _relative(filename, directory):
+    """Returns the name of the file relative to the directory, or None
+    if the file is not inside it."""
+    if directory == '':
+        if os.path.isabs(filename):
+            return None
+        return filename
+    if filename.startswith(directory + os.sep):
+        return filename[len(directory) + len(os.sep):]
+    return None
+
+def _file_hash(filename):
+    "Returns the hash of the contents of the file, or None if it does not exist."
+    if not os.path.exists(filename):
+        return None
+    return utils.md5sum(utils.read_file(filename))
+
+def _prelude_candidate(filename):
+    "Returns the name of the Prelude that would be used for the file, if any."
+    prelude_basename = i18n.i18n('Prelude') + '.gbs'
+    if os.path.basename(filename) == prelude_basename:
+        return None
+    return os.path.join(os.path.dirname(filename), prelude_basename)
+
+def dependencies(tree, filename):
+    """Returns the names of the files that were read to compile the
+    program (or would be read, as a Prelude that does not exist)."""
+    deps = {}
+    def visit(tree, filename):
+        prelude = _prelude_candidate(filename)
+        if prelude is not None:
+            utils.set_add(deps, prelude)
+        module_handler = getattr(tree, 'module_handler', None)
+        if module_handler is None:
+            return
+        for module_name, module_tree in module_handler.parse_trees():
+            module_filename = module_handler.filename_for(module_name)
+            if module_filename not in deps:
+                utils.set_add(deps, module_filename)
+                visit(module_tree, module_filename)
+    visit(tree, filename)
+    return utils.seq_sorted(deps.keys())
+
+_atomic_types = (int, long, float, complex, bool, type(None), type,
+                 types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType)
+
+def _filename_holders(root, relocated):
+    """Returns the places in the object graph of root that hold one of
+    the file names in relocated, as (object, is_item, key, relative_name)
+    tuples, where the file name is object[key] if is_item and the
+    attribute key of object otherwise."""
+    holders = []
+    visited = {}
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in visited:
+            continue
+        visited[id(obj)] = obj
+        if isinstance(obj, dict):
+            places = [(True, key, value) for key, value in obj.iteritems()]
+        elif isinstance(obj, list):
+            places = [(True, index, value) for index, value in enumerate(obj)]
+        elif isinstance(obj, tuple):
+            # tuples are immutable, their file names are not relocated
+            stack.extend([value for value in obj
+                          if not isinstance(value, (basestring,) + _atomic_types)])
+            continue
+        else:
+            places = [(False, name, value)
+                      for name, value in getattr(obj, '__dict__', {}).items()]
+            for cls in type(obj).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, name):
+                        places.append((False, name, getattr(obj, name)))
+        for is_item, key, value in places:
+            if isinstance(value, basestring):
+                if value in relocated:
+                    holders.append((obj, is_item, key, relocated[value]))
+            elif not isinstance(value, _atomic_types):
+                stack.append(value)
+    return holders
+
+def _relocate(holders, directory):
+    "Sets the file names of the holders relative to the given directory."
+    for obj, is_item, key, relative_name in holders:
+        if is_item:
+            obj[key] = os.path.join(directory, relative_name)
+        else:
+            setattr(obj, key, os.path.join(directory, relative_name))
+
+class CompileCache(object):
+    "Cache of compiled programs stored in the given directory."
+
+    def __init__(self, directory=CacheDir, max_entries=MaxEntries):
+        self.directory = directory
+        self.max_entries = max_entries
+
+    def key(self, filename, program_text, grammar_file, options, toplevel_filename=None):
+        """Returns the key of the entry for the given program. The options
+        are the ones that change the result of checking the program."""
+        directory = os.path.dirname(filename)
+        if toplevel_filename is None:
+            toplevel = None
+        else:
+            toplevel = _relative(toplevel_filename, directory) or toplevel_filename
+        return utils.md5sum(repr((
+            CACHE_VERSION,
+            implementation_hash(),
+            gbs_parser.analyzer_key(grammar_file),
+            tuple(options),
+            os.path.basename(filename),
+            toplevel,
+            utils.md5sum(program_text),
+        )))
+
+    def _entry_filename(self, key):
+        return os.path.join(self.directory, key + '.gbc')
+
+    def load(self, key, filename):
+        """Returns the CompiledProgram stored under the key, with its file
+        names relocated to the directory of the given file, or None if
+        there is no such entry or the files it depends on have changed."""
+        directory = os.path.dirname(filename)
+        try:
+            f = open(self._entry_filename(key), 'rb')
+            try:
+                header = cPickle.load(f)
+                if header.get('version') != CACHE_VERSION:
+                    return None
+                for relative_name, content_hash in header['dependencies']:
+                    if _file_hash(os.path.join(directory, relative_name)) != content_hash:
+                        return None
+                compiled, holders = _with_recursion_limit(lambda: cPickle.load(f))
+                _relocate(holders, directory)
+                return compiled
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError,
+                AttributeError, ImportError, IndexError, cPickle.UnpicklingError):
+            return None
+
+    def store(self, key, filename, compiled, toplevel_filename=None):
+        """Stores the CompiledProgram under the key. Returns False if the
+        entry could not be written."""
+        directory = os.path.dirname(filename)
+        relocated = {}
+        header_deps = []
+        for dep_filename in dependencies(compiled.tree, filename):
+            relative_name = _relative(dep_filename, directory)
+            if relative_name is None:
+                # not relocatable, depend on it by its absolute name
+                relative_name = dep_filename
+            else:
+                relocated[dep_filename] = relative_name
+            header_deps.append((relative_name, _file_hash(dep_filename)))
+        for name in [filename, toplevel_filename]:
+            if name is not None and _relative(name, directory) is not None:
+                relocated[name] = _relative(name, directory)
+
+        holders = _filename_holders(compiled, relocated)
+        payload = StringIO.StringIO()
+        try:
+            _with_recursion_limit(lambda: cPickle.dump((compiled, holders), payload, 2))
+        except (cPickle.PicklingError, TypeError, RuntimeError):
+            return False
+        header = {'version': CACHE_VERSION, 'dependencies': header_deps}
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp_filename = tempfile.mkstemp(dir=self.directory)
+            f = os.fdopen(fd, 'wb')
+            try:
+                cPickle.dump(header, f, 2)
+                f.write(payload.getvalue())
+            finally:
+                f.close()
+            os.chmod(tmp_filename, 0644)
+            os.rename(tmp_filename, self._entry_filename(key))
+        except (IOError, OSError):
+            return False
+        self._evict()
+        return True
+
+    def _evict(self):
+        "Removes the least recently written entries beyond max_entries."
+        try:
+            entries = [(os.path.getmtime(name), name)
+                       for name in glob.glob(os.path.join(self.directory, '*.gbc'))]
+            entries.sort()
+            for _, name in entries[:max(0, len(entries) - self.max_entries)]:
+                os.remove(name)
+        except (IOError, OSError):
+            pass
+
+    def clear(self):
+        "Removes every entry."
+        for name in glob.glob(os.path.join(self.directory, '*.gbc')):
+            try:
+                os.remove(name)
+            except (IOError, OSError):
+                pass
+
+_shared_cache = []
+
+def shared_cache():
+    "Returns the cache shared by every user of the language in this account."
+    if _shared_cache == []:
+        _shared_cache.append(CompileCache())
+    return _shared_cache[0]
+
+def compile_cached(compile_program, filename, program_text, grammar_file, options,
+                   toplevel_filename=None, cache=None):
+    """Returns the CompiledProgram for the given program, from the cache
+    if possible. Otherwise it is made by compile_program(), which should
+    return a CompiledProgram, and stored. The options are those that
+    change the result of checking the program."""
+    if cache is None:
+        cache = shared_cache()
+    key = cache.key(filename, program_text, grammar_file, options, toplevel_filename)
+    compiled = cache.load(key, filename)
+    if compiled is not None:
+        compiled.install()
+        return compiled
+    compiled = compile_program()
+    cache.store(key, filename, compiled, toplevel_filename)
+    return compiled
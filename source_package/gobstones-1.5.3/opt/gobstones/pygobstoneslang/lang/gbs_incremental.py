@@ -0,0 +1,320 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"Incremental checking of the programs being edited."
+
+import pygobstoneslang.common.i18n as i18n
+import pygobstoneslang.common.position as position
+
+import ast
+import bnf_parser
+import gbs_parser
+import gbs_mexpl
+import gbs_lint
+import gbs_liveness
+import gbs_type
+import gbs_def_helper as def_helper
+
+#### Editors check the program being edited after almost every change,
+#### and most changes touch a single definition. The incremental checker
+#### splits the program into its header (the imports) and its top-level
+#### definitions, and parses each definition on its own, in a fragment
+#### of the source that can be moved when the text before it changes.
+#### Parsed definitions are kept, indexed by their text, so the next
+#### check only parses the definitions that changed. Entry points are
+#### always parsed again, since exploding macros changes them.
+####
+#### Linting always runs the first pass over every definition, so that
+#### the symbol table is the same as when checking the whole program.
+#### The second pass over an unchanged routine is skipped if every name
+#### it refers to is bound to a construct with the same signature as
+#### when it last passed: routines that call a routine whose parameters
+#### changed, or that use a type that changed, are checked again. The
+#### invocations made by a skipped routine are replayed, so recursion is
+#### still detected. Likewise, liveness is only checked for the routines
+#### that did not pass it unchanged.
+####
+#### Only the results of definitions that passed are kept, so errors are
+#### always reported at their current positions. If a definition cannot
+#### be parsed on its own (typically, because of a syntax error), the
+#### whole program is parsed and checked as usual, so that errors are
+#### reported exactly as when checking the whole program.
+
+class Definition(object):
+    "A top-level definition parsed on its own, and what it passed."
+
+    def __init__(self, tree, fragment):
+        self.tree = tree
+        self.fragment = fragment
+        self._names = None
+        # signature of the names when the routine passed linting,
+        # and the invocations it made
+        self.lint_key = None
+        self.invocations = []
+        self.live_checked = False
+
+    def is_reusable(self):
+        return self.tree.children[0] != 'entrypoint'
+
+    def names(self):
+        "Returns the names of the tokens inside the definition."
+        if self._names is None:
+            names = {}
+            stack = [self.tree]
+            while stack:
+                elem = stack.pop()
+                if isinstance(elem, ast.ASTNode):
+                    stack.extend(elem.children)
+                elif isinstance(elem, bnf_parser.Token):
+                    names[elem.value] = True
+            self._names = sorted(names.keys())
+        return self._names
+
+def _relocate(tree, source_file):
+    "Makes every position inside the tree belong to the source file."
+    stack = [tree]
+    while stack:
+        elem = stack.pop()
+        if isinstance(elem, ast.ASTNode):
+            stack.extend(elem.children)
+            stack.extend(elem.annotations.values())
+        elif not isinstance(elem, bnf_parser.Token):
+            continue
+        elem.pos_begin.source_file = source_file
+        elem.pos_end.source_file = source_file
+
+def _definition_starts(analyzer, string):
+    """Returns the offsets where the top-level definitions of the program
+    start, guessed from its tokens. Parsing each definition tells whether
+    the guess was right."""
+    def_starts = analyzer.parser.first(['<def>'])
+    starts = []
+    depth = 0
+    previous = None
+    pending = None
+    for tok_type, start in analyzer.lexer.token_starts(string):
+        if pending is not None:
+            # a lowerid only starts a definition as in "t.program"
+            if tok_type == '.':
+                starts.append(pending)
+            pending = None
+        if tok_type in ['(', '{', '[']:
+            depth += 1
+        elif tok_type in [')', '}', ']']:
+            depth -= 1
+        elif depth == 0 and tok_type in def_starts and \
+             previous not in def_starts and previous != '.':
+            if tok_type == 'lowerid':
+                pending = start
+            else:
+                starts.append(start)
+        previous = tok_type
+    return starts
+
+class IncrementalChecker(object):
+    "Checks successive versions of a program, reusing what did not change."
+
+    def __init__(self, filename, options):
+        self.filename = filename
+        self.options = options
+        self.definitions = {}
+
+    def check(self, gobstones, program_text):
+        """Parses and checks the program as gobstones.parse and
+        gobstones.check would do, and returns the types it defines."""
+        gobstones.api.log(i18n.i18n('Parsing.'))
+        tree = self.parse(program_text)
+        if tree is None:
+            return gobstones.check(gobstones.parse(self.filename, program_text).tree)
+        gobstones.api.log(i18n.i18n('Exploding program macros.'))
+        gbs_mexpl.mexpl(tree)
+        gobstones.api.log(i18n.i18n('Performing semantic checks.'))
+        types = self.lint(tree)
+        if self.options.check_liveness:
+            self.check_live_variables(tree)
+        return types
+
+    def parse(self, program_text):
+        """Returns the tree of the program, built from the trees of its
+        definitions, or None if it could not be built that way."""
+        if program_text == '':
+            return None
+        grammar_file = self.options.get_lang_grammar()
+        starts = _definition_starts(gbs_parser.create_analizer(grammar_file), program_text)
+        if starts == []:
+            return None
+        source = position.SourceFile(program_text, self.filename)
+
+        header = self._parse_fragment(program_text[:starts[0]], grammar_file)
+        if header is None or header.children[2].children != []:
+            return None
+        _relocate(header, source)
+
+        previous = self.definitions
+        self.definitions = {}
+        def_trees = []
+        for start, end in zip(starts, starts[1:] + [len(program_text)]):
+            line_start = program_text.rfind('\n', 0, start) + 1
+            # blank the rest of the line before the definition, so
+            # that the fragment can start at the beginning of the line
+            text = ' ' * (start - line_start) + program_text[start:end]
+            definition = previous.pop(text, None)
+            if definition is None:
+                definition = self._parse_definition(text, grammar_file)
+                if definition is None:
+                    self.definitions.update(previous)
+                    return None
+            definition.fragment.move(source, line_start)
+            if definition.is_reusable():
+                self.definitions[text] = definition
+            def_trees.append(definition.tree)
+
+        first = def_trees[0].pos_begin
+        last = def_trees[-1].pos_end
+        defs = ast.ASTNode(def_trees,
+                           position.Position(source, start=first.source_file.offset + first.start),
+                           position.Position(source, start=last.source_file.offset + last.start))
+        tree = ast.ASTNode(['program', header.children[1], defs], header.pos_begin, defs.pos_end)
+        tree.source_filename = self.filename
+        tree.toplevel_filename = self.filename
+        gbs_parser.add_prelude_import(tree, source, self.filename)
+        return tree
+
+    def _parse_fragment(self, text, grammar_file):
+        # errors are reported by parsing the whole program, since
+        # their messages may refer to positions inside the fragment
+        try:
+            return gbs_parser.build_ast(text, self.filename, grammar_file)
+        except Exception:
+            return None
+
+    def _parse_definition(self, text, grammar_file):
+        tree = self._parse_fragment(text, grammar_file)
+        if tree is None or tree.children[1].children != [] or len(tree.children[2].children) != 1:
+            return None
+        def_tree = tree.children[2].children[0]
+        fragment = position.SourceFragment(None)
+        _relocate(def_tree, fragment)
+        return Definition(def_tree, fragment)
+
+    def _definitions_by_tree(self):
+        by_tree = {}
+        for definition in self.definitions.values():
+            by_tree[id(definition.tree)] = definition
+        return by_tree
+
+    def lint(self, tree):
+        checker = IncrementalSemanticChecker(self._definitions_by_tree(),
+                                             strictness=self.options.lint_mode,
+                                             allow_recursion=self.options.allow_recursion)
+        checker.check_program(tree)
+        gbs_type.set_user_defined_types(checker.types)
+        return checker.types
+
+    def check_live_variables(self, tree):
+        by_tree = self._definitions_by_tree()
+        pending = []
+        for def_ in def_helper.routine_defs(tree.children[2]):
+            definition = by_tree.get(id(def_))
+            if definition is None or not definition.live_checked:
+                pending.append(def_)
+        analyzer = gbs_liveness.GbsLivenessAnalyzer()
+        for def_ in pending:
+            analyzer.annotate_def(def_)
+        for def_ in pending:
+            analyzer.check_defs(ast.ASTNode([def_], def_.pos_begin, def_.pos_end))
+            if id(def_) in by_tree:
+                by_tree[id(def_)].live_checked = True
+
+def _construct_signature(construct):
+    "Returns what checking a use of the construct depends on."
+    if construct is None:
+        return None
+    signature = [construct.__class__, construct.name(), construct.type(), construct.kind()]
+    for method in ['params', 'num_retvals']:
+        if hasattr(construct, method):
+            signature.append(getattr(construct, method)())
+    return signature
+
+class IncrementalSemanticChecker(gbs_lint.GbsSemanticChecker):
+    """Semantic checker that skips the second pass over the routines that
+    passed it unchanged, if the names they refer to mean the same."""
+
+    def __init__(self, definitions, **kwargs):
+        gbs_lint.GbsSemanticChecker.__init__(self, **kwargs)
+        self.definitions = definitions
+        self.invocations = None
+        self.signatures = {}
+
+    def signature(self, name):
+        "Returns the signatures of the global constructs bound to the name."
+        if name not in self.signatures:
+            signature = []
+            tables = self.symbol_table.tables
+            for table_name in ['type_proc', 'rtn', 'name']:
+                for kind in ['callable', 'atomic']:
+                    signature.append(_construct_signature(tables[table_name].get(kind, name, None)))
+            self.signatures[name] = signature
+        return self.signatures[name]
+
+    def names_key(self, names):
+        "Returns the signatures of the constructs bound to the names."
+        key = [self.explicit_board]
+        for name in names:
+            key.append(self.signature(name))
+        return key
+
+    def add_field_getter_function(self, type_name, field):
+        gbs_lint.GbsSemanticChecker.add_field_getter_function(self, type_name, field)
+        self.signatures = {}
+
+    def check_routine_definition2(self, tree):
+        definition = self.definitions.get(id(tree))
+        if definition is None:
+            gbs_lint.GbsSemanticChecker.check_routine_definition2(self, tree)
+            return
+        key = self.names_key(definition.names())
+        if definition.lint_key == key:
+            for invoker_name, invoked_name, area in definition.invocations:
+                self.check_invocation(invoker_name, invoked_name, area)
+            return
+        definition.lint_key = None
+        self.invocations = []
+        gbs_lint.GbsSemanticChecker.check_routine_definition2(self, tree)
+        definition.lint_key = key
+        definition.invocations = self.invocations
+        self.invocations = None
+
+    def check_invocation(self, invoker_name, invoked_name, area):
+        gbs_lint.GbsSemanticChecker.check_invocation(self, invoker_name, invoked_name, area)
+        if self.invocations is not None:
+            self.invocations.append((invoker_name, invoked_name, area))
+
+# Checkers of the programs being edited, by file name and options.
+_checkers = {}
+
+MaxCheckers = 16
+
+def checker_for(filename, options):
+    "Returns the incremental checker of the given file and options."
+    key = (filename, options.get_lang_grammar(), i18n.language_code()) + tuple(options.check_options())
+    if key not in _checkers:
+        if len(_checkers) >= MaxCheckers:
+            _checkers.clear()
+        _checkers[key] = IncrementalChecker(filename, options)
+    return _checkers[key]
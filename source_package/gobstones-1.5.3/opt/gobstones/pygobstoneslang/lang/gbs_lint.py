@@ -83,54 +83,82 @@ def is_variable(toktype):
     return toktype == "variable"
 
 class InvocationGraph(object):
+    """Graph of the invocations between routines. Besides the callers of
+    each routine, it keeps the set of routines that invoke it directly or
+    indirectly, so that checking if an invocation closes a cycle does not
+    have to walk the graph."""
 
     def __init__(self):
         self.graph = {}
         self.inverse_graph = {}
+        self.ancestors = {}
 
     def add(self, invoker, invoked):
+        if invoked in self.graph.get(invoker, {}):
+            return
         self.add_graph(invoker, invoked)
         self.add_inverse(invoker, invoked)
+        self.add_ancestors(invoker, invoked)
 
     def add_graph(self, invoker, invoked):
-        if not invoker in self.graph.keys():
+        if not invoker in self.graph:
             self.graph[invoker] = {}
-        self.graph[invoker] = invoked
+        self.graph[invoker][invoked] = True
 
     def add_inverse(self, invoker, invoked):
-        if not invoked in self.inverse_graph.keys():
+        if not invoked in self.inverse_graph:
             self.inverse_graph[invoked] = {}
         self.inverse_graph[invoked][invoker] = True
 
+    def add_ancestors(self, invoker, invoked):
+        "Propagates the ancestors of the invoker to the invoked and below."
+        new_ancestors = self.ancestors_for(invoker).keys() + [invoker]
+        pending = [invoked]
+        while pending:
+            name = pending.pop()
+            if not name in self.ancestors:
+                self.ancestors[name] = {}
+            ancestors = self.ancestors[name]
+            changed = False
+            for ancestor in new_ancestors:
+                if not ancestor in ancestors:
+                    ancestors[ancestor] = True
+                    changed = True
+            if changed:
+                pending.extend(self.graph.get(name, {}).keys())
+
+    def ancestors_for(self, name):
+        return self.ancestors.get(name, {})
+
     def invocation_chain_includes(self, invoker, invoked):
-        for chain in self.get_invocation_chains(invoker):
-            if invoked in chain:
-                return True
-        return False
+        return invoked in self.ancestors_for(invoker)
 
     def callers_for(self, name):
-        if name in self.inverse_graph.keys():
+        if name in self.inverse_graph:
             return self.inverse_graph[name].keys()
         else:
             return []
 
-    def get_invocation_chains(self, invoker):
-        chains = []
-        for parent_invoker in self.callers_for(invoker):
-            chains += [[invoker] + chain for chain in self.get_invocation_chains(parent_invoker)]
-        if len(chains) == 0:
-            chains = [[invoker]]
-        return chains
-
     def recursive_invocation(self, invoker, invoked):
         return invoker == invoked or self.invocation_chain_includes(invoker, invoked)
 
-    def get_invocation_chains_with_ancestor(self, invocable, ancestor):
-        result = []
-        for chain in self.get_invocation_chains(invocable):
-            if ancestor in chain:
-                result += [chain]
-        return result
+    def invocation_chain(self, invocable, ancestor):
+        """Returns a chain of callers, starting from the invocable, that
+        goes through the ancestor and ends in a routine with no callers."""
+        chain = [invocable]
+        name = invocable
+        while name != ancestor:
+            for caller in self.callers_for(name):
+                if caller == ancestor or self.invocation_chain_includes(caller, ancestor):
+                    break
+            chain.append(caller)
+            name = caller
+        callers = self.callers_for(name)
+        while callers != []:
+            name = callers[0]
+            chain.append(name)
+            callers = self.callers_for(name)
+        return chain
 
 class SymbolTableManager(object):
     """ Manages a routine symbol table and a variable/index/param
@@ -700,7 +728,7 @@ class GbsSemanticChecker(object):
 
     def check_invocation(self, invoker_name, invoked_name, area):
         if not self.allow_recursion and self.invocation_graph.recursive_invocation(invoker_name, invoked_name):
-            chain = [invoked_name] + self.invocation_graph.get_invocation_chains_with_ancestor(invoker_name, invoked_name)[0]
+            chain = [invoked_name] + self.invocation_graph.invocation_chain(invoker_name, invoked_name)
             chain.reverse()
             raise GbsLintException(i18n.i18n("Recursion is not allowed") + ". " + i18n.i18n("Invocation chain") + ": " + "->".join(chain), area)
         self.invocation_graph.add(invoker_name, invoked_name)
@@ -978,3 +1006,4 @@ def lint(tree, strictness='lax', allow_recursion=True):
     checker = GbsSemanticChecker(strictness=strictness, allow_recursion=allow_recursion)
     checker.check_program(tree)
     gbs_type.set_user_defined_types(checker.types)
+    return checker.types
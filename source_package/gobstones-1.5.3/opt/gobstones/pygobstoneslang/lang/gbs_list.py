@@ -0,0 +1,172 @@
+#
+# Copyright (C) 2011-2013 Pablo Barenbaum <foones@gmail.com>,
+#                         Ary Pablo Batista <arypbatista@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+"Persistent lists, the values of the XGobstones list type."
+
+import itertools
+
+#### A list is never modified once it is built: operations return new
+#### lists, which share the elements of the lists they were made from.
+#### Assigning a list to a variable does not copy it.
+####
+#### Every list is a view of a range of positions of a buffer. Positions
+#### 0, 1, 2, ... are stored in the back of the buffer, and positions
+#### -1, -2, ... are stored, in that order, in its front, so the buffer
+#### can grow on both ends. Lists made from one another share their
+#### buffer, and elements are only ever added beyond both of its ends,
+#### which no list sees yet.
+####
+#### len, head, last, tail and init take constant time. Adding an
+#### element before a list that starts where its buffer starts (or after
+#### a list that ends where its buffer ends) grows the buffer, in
+#### amortized constant time; adding it anywhere else copies the list.
+#### The lists built by a program usually start or end there: the list
+#### an element was last added to is always such a list. Concatenation
+#### grows the buffer of one of the lists with the elements of the other
+#### one, the shortest if possible, and only copies both lists if
+#### neither of them can grow.
+
+class _Buffer(object):
+    "Storage shared by the lists made from one another."
+
+    __slots__ = ('front', 'back')
+
+    def __init__(self, back):
+        self.front = []
+        self.back = back
+
+    def elements(self, start, end):
+        "Returns a Python list with the elements at positions [start, end)."
+        if start >= 0:
+            return self.back[start:end]
+        elif end <= 0:
+            elements = self.front[-end:-start]
+            elements.reverse()
+            return elements
+        else:
+            elements = self.front[:-start]
+            elements.reverse()
+            return elements + self.back[:end]
+
+class PersistentList(object):
+    "An immutable list of Gobstones values."
+
+    __slots__ = ('_buffer', '_start', '_end')
+
+    def __init__(self, elements=()):
+        self._buffer = _Buffer(list(elements))
+        self._start = 0
+        self._end = len(self._buffer.back)
+
+    def _view(self, buffer, start, end):
+        lst = PersistentList.__new__(PersistentList)
+        lst._buffer = buffer
+        lst._start = start
+        lst._end = end
+        return lst
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._end - self._start
+        if index < 0 or index >= self._end - self._start:
+            raise IndexError('list index out of range')
+        position = self._start + index
+        if position >= 0:
+            return self._buffer.back[position]
+        else:
+            return self._buffer.front[-position - 1]
+
+    def __iter__(self):
+        # walks the positions of the buffer, without copying the list
+        front = self._buffer.front
+        back = self._buffer.back
+        return itertools.chain(
+            itertools.imap(front.__getitem__, xrange(-self._start - 1, -min(self._end, 0) - 1, -1)),
+            itertools.imap(back.__getitem__, xrange(max(self._start, 0), self._end)))
+
+    def __repr__(self):
+        return '[' + ', '.join([repr(element) for element in self.elements()]) + ']'
+
+    def __reduce__(self):
+        return (PersistentList, (self.elements(),))
+
+    def elements(self):
+        "Returns a Python list with the elements of the list."
+        return self._buffer.elements(self._start, self._end)
+
+    def _at_front(self):
+        return self._start == -len(self._buffer.front)
+
+    def _at_back(self):
+        return self._end == len(self._buffer.back)
+
+    def head(self):
+        return self[0]
+
+    def last(self):
+        return self[-1]
+
+    def tail(self):
+        "Returns the list without its first element."
+        return self._view(self._buffer, self._start + 1, self._end)
+
+    def init(self):
+        "Returns the list without its last element."
+        return self._view(self._buffer, self._start, self._end - 1)
+
+    def cons(self, element):
+        "Returns the list with the element added before its first one."
+        if self._at_front():
+            self._buffer.front.append(element)
+            return self._view(self._buffer, self._start - 1, self._end)
+        return PersistentList([element] + self.elements())
+
+    def snoc(self, element):
+        "Returns the list with the element added after its last one."
+        if self._at_back():
+            self._buffer.back.append(element)
+            return self._view(self._buffer, self._start, self._end + 1)
+        return PersistentList(self.elements() + [element])
+
+    def concat(self, other):
+        "Returns the elements of this list followed by those of the other one."
+        if len(other) == 0:
+            return self
+        elif len(self) == 0:
+            return other
+        can_append = self._at_back()
+        can_prepend = other._at_front()
+        if can_prepend and (not can_append or len(self) <= len(other)):
+            elements = self.elements()
+            elements.reverse()
+            other._buffer.front.extend(elements)
+            return self._view(other._buffer, other._start - len(self), other._end)
+        elif can_append:
+            self._buffer.back.extend(other.elements())
+            return self._view(self._buffer, self._start, self._end + len(other))
+        else:
+            return PersistentList(self.elements() + other.elements())
+
+    def replace(self, index, element):
+        "Returns a copy of the list with the element at the index replaced."
+        elements = self.elements()
+        elements[index] = element
+        return PersistentList(elements)
@@ -17,8 +17,25 @@
 
 import os
 
+import pygobstoneslang.common.i18n as i18n
 import pygobstoneslang.common.utils as utils
 import gbs_parser
+import gbs_def_helper
+
+# Parsed modules, by file name, language and hash of their contents.
+# Checking a module changes its tree, so each handler gets a copy.
+_module_trees = {}
+
+MaxModuleTrees = 64
+
+def parse_module(filename):
+    "Returns a copy of the parsed module in the given file."
+    key = (filename, i18n.language_code(), utils.md5sum(utils.read_file(filename)))
+    if key not in _module_trees:
+        if len(_module_trees) >= MaxModuleTrees:
+            _module_trees.clear()
+        _module_trees[key] = gbs_parser.parse_file(filename)
+    return gbs_def_helper.clone_tree(_module_trees[key])
 
 class GbsModuleHandler(object):
 
@@ -40,7 +57,7 @@ class GbsModuleHandler(object):
 
     def parse_tree(self, module_name):
         if module_name not in self._parse_trees:
-            self._parse_trees[module_name] = gbs_parser.parse_file(
+            self._parse_trees[module_name] = parse_module(
                 self.filename_for(module_name)
             )
         return self._parse_trees[module_name]
@@ -20,13 +20,14 @@ import re
 
 import pygobstoneslang.common.position as position
 import bnf_parser
+import bnf_codegen
 import ast
 import gbs_builtins
 import pygobstoneslang.common.i18n as i18n
 from pygobstoneslang.common.utils import *
 import grammar.i18n
 from gbs_api import GobstonesOptions
-from grammar import XGbsGrammarFile
+from grammar import GbsGrammarFile, XGbsGrammarFile
 
 #### Parser of Gobstones programs.
 ####
@@ -203,24 +204,123 @@ class GbsParser(bnf_parser.Parser):
         bnf_parser.Parser.parse_error(self, nonterminal, previous_token, token)
 
 class GbsAnalyzer(bnf_parser.Analyzer):
-    def __init__(self, grammar, warn=std_warn):
-        bnf_parser.Analyzer.__init__(self, GbsLexer, GbsParser, bnf_contents=grammar, warn=warn)
+    def __init__(self, grammar, warn=std_warn, tables_filenames=[]):
+        bnf_parser.Analyzer.__init__(self, GbsLexer, GbsParser, bnf_contents=grammar, warn=warn,
+                                     tables_filenames=tables_filenames)
+        self.generated_parser = None
+
+TablesCacheDir = os.path.join(os.path.expanduser('~'), '.pygobstones', 'cache')
+
+def tables_filenames(grammar_file):
+    """Returns the files where the precomputed tables of the given grammar,
+       in the current language, are looked for: under the user's cache
+       directory and next to the grammar (e.g. shipped with the package)."""
+    basename = '%s_%s.tables' % (os.path.basename(grammar_file),
+                                 i18n.language_code().lower())
+    return [os.path.join(TablesCacheDir, basename),
+            os.path.join(os.path.dirname(os.path.abspath(grammar_file)), basename)]
+
+#### Building an analyzer translates the grammar, compiles every token
+#### regexp and computes the LL(1) tables, which usually costs more than
+#### parsing the program itself. Analyzers are therefore built once per
+#### process and shared, keyed by grammar file, language and the hash of
+#### the translated grammar contents.
+
+_grammar_contents_cache = {}
+_analyzer_cache = {}
+
+def _translated_grammar(grammar_file):
+    """Returns the translated BNF contents of the given grammar file and
+       their hash, re-reading the file only when it changes on disk."""
+    grammar_file = os.path.abspath(grammar_file)
+    stat = os.stat(grammar_file)
+    stamp = (stat.st_mtime, stat.st_size)
+    cached = _grammar_contents_cache.get(grammar_file)
+    if cached is None or cached[0] != stamp:
+        bnf = grammar.i18n.translate(read_file(grammar_file))
+        cached = (stamp, bnf, md5sum(bnf))
+        _grammar_contents_cache[grammar_file] = cached
+    return cached[1], cached[2]
+
+def analyzer_key(grammar_file):
+    "Returns the key under which the analyzer for the grammar is cached."
+    bnf, bnf_hash = _translated_grammar(grammar_file)
+    return (os.path.abspath(grammar_file), i18n.language_code(), bnf_hash)
 
 def create_analizer(grammar_file):
-    bnf = grammar.i18n.translate(read_file(grammar_file))
-    return GbsAnalyzer(bnf)
+    """Returns the analyzer for the given grammar file, building it only
+       the first time it is requested in this process."""
+    key = analyzer_key(grammar_file)
+    analyzer = _analyzer_cache.get(key)
+    if analyzer is None:
+        bnf, bnf_hash = _translated_grammar(grammar_file)
+        analyzer = GbsAnalyzer(bnf, tables_filenames=tables_filenames(grammar_file))
+        _analyzer_cache[key] = analyzer
+    return analyzer
+
+def warm_up(grammar_files=(GbsGrammarFile, XGbsGrammarFile)):
+    """Builds the analyzers for the given grammar files in advance, so that
+       long-lived processes (e.g. workers) do not pay for it on their first
+       parse."""
+    for grammar_file in grammar_files:
+        create_analizer(grammar_file)
+
+def clear_analyzer_cache():
+    "Forgets every analyzer built so far."
+    _grammar_contents_cache.clear()
+    _analyzer_cache.clear()
 
 def check_grammar_conflicts(grammar_file):
     """Checks if the BNF grammar has any conflict (an LL(1) prediction
        with two productions)."""
     create_analizer(grammar_file).parser.check_conflicts()
 
+#### Programs are parsed by a recursive-descent parser generated from
+#### the grammar (see bnf_codegen), which builds the same AST as the
+#### table-driven bnf_parser.Parser and ast.ASTBuilder. The generated
+#### parsers are saved next to the precomputed tables and regenerated
+#### when the grammar changes.
+
+UseGeneratedParser = True
+
+def generated_parser_filenames(grammar_file):
+    """Returns the files where the generated parser of the given grammar,
+       in the current language, is looked for."""
+    basename = '%s_%s_parser.py' % (
+                    os.path.splitext(os.path.basename(grammar_file))[0],
+                    i18n.language_code().lower())
+    return [os.path.join(TablesCacheDir, basename),
+            os.path.join(os.path.dirname(os.path.abspath(grammar_file)), basename)]
+
+def generated_parser(grammar_file):
+    "Returns the generated parser module for the given grammar file."
+    analyzer = create_analizer(grammar_file)
+    if analyzer.generated_parser is None:
+        analyzer.generated_parser = bnf_codegen.load_parser(
+                                        analyzer.parser,
+                                        analyzer.bnf_hash(),
+                                        generated_parser_filenames(grammar_file))
+    return analyzer.generated_parser
+
+def build_ast(string, filename='...', grammar_file=XGbsGrammarFile):
+    "Parse a string and return the abstract syntax tree built by the grammar."
+    analyzer = create_analizer(grammar_file)
+    if UseGeneratedParser:
+        builder = ast.ASTBuilder(position.Position(string, filename))
+        try:
+            return generated_parser(grammar_file).parse(
+                        analyzer.parser, builder,
+                        analyzer.lexer.tokenize(string, filename))
+        except RuntimeError:
+            # Too deeply nested for a recursive parser: parse it again
+            # with the table-driven one.
+            pass
+    builder = ast.ASTBuilder(position.Position(string, filename))
+    return builder.build_ast_from(analyzer.parse(string, filename))
+
 def parse_string(string, filename='...', toplevel_filename=None, grammar_file=XGbsGrammarFile):
     "Parse a string and return an abstract syntax tree."
-    analyzer = create_analizer(grammar_file)
-    parsing_stream = analyzer.parse(string, filename)
-    start_pos = position.Position(string, filename)
-    tree = ast.ASTBuilder(start_pos).build_ast_from(parsing_stream)
+    tree = build_ast(string, filename, grammar_file)
     tree.source_filename = filename
     if toplevel_filename is None:
         tree.toplevel_filename = tree.source_filename
@@ -255,13 +355,14 @@ def parse_names(string, filename, toplevel_filename=None, grammar_file=XGbsGramm
         names.update(get_names(open(prelude_filename).read()))
     return names
 
-def parse_string_try_prelude(string, filename, toplevel_filename=None, grammar_file=XGbsGrammarFile):
-    main_program = parse_string(string, filename, toplevel_filename, grammar_file)
-
+def add_prelude_import(main_program, source, filename):
+    """Makes the program import everything from the Prelude next to its
+    file, if there is one. The source is the program string or its
+    SourceFile."""
     prelude_filename = prelude_for_file(filename)
     if prelude_filename is not None:
         prelude_barename = i18n.i18n('Prelude')
-        pos = position.Position(string, filename)
+        pos = position.Position(source, filename)
         main_imports = main_program.children[1].children
         main_imports.insert(0, ast.ASTNode([
             'import',
@@ -271,6 +372,9 @@ def parse_string_try_prelude(string, filename, toplevel_filename=None, grammar_f
             ], pos, pos)
         ], pos, pos))
 
+def parse_string_try_prelude(string, filename, toplevel_filename=None, grammar_file=XGbsGrammarFile):
+    main_program = parse_string(string, filename, toplevel_filename, grammar_file)
+    add_prelude_import(main_program, string, filename)
     return main_program
 
 def parse_file(filename, grammar_file=XGbsGrammarFile):
@@ -23,12 +23,14 @@ from gbs_builtins import (clone_value, get_builtins,
     poly_typeof,
     polyname_name
     )
+import gbs_builtins
 import gbs_constructs
 import gbs_runnable
 import gbs_io
 import pygobstoneslang.common.position as position
 import pygobstoneslang.common.i18n as i18n
 import random
+import time
 from pygobstoneslang.common.utils import (
     DynamicException, 
     seq_sorted,
@@ -48,9 +50,10 @@ from pygobstoneslang.common.utils import (
 ## Opcodes:
 ## ---
 ## pushConst   const_name                  |           -- const
-## pushFrom     var_name                    |           -- var
-## popTo      var_name                    | value     --
+## pushFrom    slot                        |           -- var
+## popTo       slot                        | value     --
 ## call        rtn_name, nargs             | a1 ... an -- r1 ... rm
+## callBuiltin rtn_name, nargs             | a1 ... an -- r1 ... rm
 ## THROW_ERROR        str                         |           --
 ## label       label                       |           --
 ## jump        label                       |           --
@@ -59,28 +62,243 @@ from pygobstoneslang.common.utils import (
 ## return      nvals                       | a1 ... an -- a1 ... an
 ## enter                                   | push global state when entering function
 ## leave                                   | pop global state when leaving function
-## delVar      var_name                    | remove variable from local environment
+## delVar      slot                        | remove variable from local environment
+## setImmutable   slot                     | forbid assignments to the variable
+## unsetImmutable slot                     | allow assignments to the variable
+## iterInit    slot, kind                  | a1 ... an --
+## iterNext    slot, label[, var_slot]     |           --
+## iterEnd     slot[, var_slot]            |           --
 ## ---
 ##
 ## Arguments are always processed from left to right.
 ##
+## The iteration ops implement foreach and repeat. iterInit pops what
+## is iterated and keeps a cursor over it in the given slot: a list
+## (kind 'list'), the number of times to repeat (kind 'repeat'), or the
+## bounds of a range, which is not built as a list (kind 'range' takes
+## the first and last values, and 'steppedRange' the first, last and
+## second ones). iterNext jumps to the label if the cursor is at its
+## end, and otherwise advances it, assigning the value it was at to the
+## variable in var_slot, if given. iterEnd unbinds the cursor and the
+## variable.
+##
+## The variables and parameters of a routine are numbered by the
+## compiler (GbsCompiledCode.slot): the parameters take the first slots,
+## in order, and every other variable takes the next free slot the first
+## time it is used. Ops that refer to a variable take its slot number,
+## and the routine keeps the name of each slot in its varnames table,
+## which is used to report errors and to show the state of the machine.
+##
+## Once a routine is compiled it is linked (GbsCompiledCode.link):
+## the labels that jump, jumpIfFalse, jumpIfNotIn and iterNext lead to
+## are replaced by the absolute index of the instruction they lead to,
+## and label pseudo-ops are removed from the code. The calls to builtins
+## that are given as many arguments as the builtin takes become
+## callBuiltin ops. The call op still calls builtins, checking their
+## arity when it runs: in lax mode a call with the wrong number of
+## arguments is only an error if it is run. It is also used by objects
+## linked before callBuiltin existed.
+##
+## Before execution, the ops of each routine are decoded once into
+## tuples whose first component is an integer opcode (the index of the
+## opcode name in OPCODES) and whose operands are resolved where
+## possible: jump labels are replaced by the index of the instruction
+## they lead to, and callBuiltin ops get the function that calls their
+## builtin (builtin_caller), which takes its arguments from the stack
+## unwrapped as the builtin expects them. The interpreter dispatches on
+## the integer opcode through a table of handlers.
+##
+
+OPCODES = [
+    'pushConst',
+    'pushFrom',
+    'popTo',
+    'call',
+    'THROW_ERROR',
+    'label',
+    'jump',
+    'jumpIfFalse',
+    'jumpIfNotIn',
+    'return',
+    'returnVars',
+    'enter',
+    'leave',
+    'delVar',
+    'setImmutable',
+    'unsetImmutable',
+    'iterInit',
+    'iterNext',
+    'iterEnd',
+    'callBuiltin',
+]
+
+OPCODE_NUMBERS = {}
+for _opnum, _opname in enumerate(OPCODES):
+    OPCODE_NUMBERS[_opname] = _opnum
+
+OP_PUSH_CONST = OPCODE_NUMBERS['pushConst']
+OP_PUSH_FROM = OPCODE_NUMBERS['pushFrom']
+OP_JUMP = OPCODE_NUMBERS['jump']
+OP_JUMP_IF_FALSE = OPCODE_NUMBERS['jumpIfFalse']
+OP_JUMP_IF_NOT_IN = OPCODE_NUMBERS['jumpIfNotIn']
+OP_ITER_NEXT = OPCODE_NUMBERS['iterNext']
+OP_CALL_BUILTIN = OPCODE_NUMBERS['callBuiltin']
+
+# Opcodes that call a routine or builtin
+CALL_OPCODES = ['call', 'callBuiltin']
+
+# Opcodes whose operand is the slot of a variable
+VAR_OPCODES = ['pushFrom', 'popTo', 'delVar', 'setImmutable', 'unsetImmutable']
+
+# Iteration ops, and the positions of their operands that are slots
+ITER_OPCODES = {
+    'iterInit': [1],
+    'iterNext': [1, 3],
+    'iterEnd': [1, 2],
+}
+
+# Kinds of iterInit, and the number of values each one pops
+ITER_KINDS = {
+    'list': 1,
+    'repeat': 1,
+    'range': 2,
+    'steppedRange': 3,
+}
+
+CONTINUE = ('CONTINUE', None)
 
 class GbsVmException(DynamicException):
     def error_type(self):
         return i18n.i18n('Runtime error')
 
 
+class GbsVmLimitException(GbsVmException):
+    "Raised when the program exceeds one of its execution limits."
+
+    def __init__(self, msg, area, limit):
+        super(GbsVmLimitException, self).__init__(msg, area)
+        self.limit = limit
+
+    def error_type(self):
+        return i18n.i18n('Execution limit exceeded')
+
+
+class ExecutionLimits(object):
+    """Bounds on the resources a program may use. Any of them can be
+    None, meaning unlimited.
+
+    max_steps        number of VM instructions executed
+    max_call_depth   number of nested routine calls
+    max_board_cells  number of cells of the board (width * height)
+    max_time         seconds spent running, not counting the time
+                     the program is suspended waiting for a key
+    """
+
+    def __init__(self, max_steps=None, max_call_depth=None, max_board_cells=None, max_time=None):
+        self.max_steps = max_steps
+        self.max_call_depth = max_call_depth
+        self.max_board_cells = max_board_cells
+        self.max_time = max_time
+
+    def unlimited(self):
+        return (self.max_steps is None and self.max_call_depth is None and
+                self.max_board_cells is None and self.max_time is None)
+
+NO_LIMITS = ExecutionLimits()
+
+## The step and time limits are not checked on every instruction:
+## the interpreter counts down from LIMIT_CHECK_INTERVAL (or the steps
+## left, if fewer) and checks them when the countdown reaches zero.
+LIMIT_CHECK_INTERVAL = 4096
+
+
+def arity_error(construct, nargs):
+    """Returns the message of the error of calling the construct with
+    nargs arguments, or None if it takes that many parameters."""
+    nparams = construct.num_params()
+    if nparams == nargs: return None
+    if nparams < nargs:
+        many_few = 'many'
+    else:
+        many_few = 'few'
+    msg = 'Too %s arguments for %s "%%s".\nExpected %%i (%%s), received %%i' % (
+                         many_few, construct.type())
+    return i18n.i18n(msg) % (construct.name(),
+                             nparams,
+                             ', '.join(construct.params()),
+                             nargs)
+
+
+def builtin_caller(builtin, nargs):
+    """Returns a function that pops nargs values from the stack, calls the
+    builtin with them and returns its result. Functions take the values
+    unwrapped, and procedures that take more than one value take all of
+    them unwrapped but the first one, which is the board."""
+    primitive = builtin.primitive()
+    if isinstance(builtin, gbs_constructs.BuiltinFunction):
+        first = 0
+    elif isinstance(builtin, gbs_constructs.BuiltinProcedure) and nargs > 1:
+        first = 1
+    else:
+        first = nargs
+    # the most frequent arities pop their arguments one by one
+    if nargs == 0:
+        return lambda global_state, stack: primitive(global_state)
+    elif nargs == 1 and first == 0:
+        return lambda global_state, stack: primitive(global_state, unwrap_value(stack.pop()))
+    elif nargs == 1:
+        return lambda global_state, stack: primitive(global_state, stack.pop())
+    elif nargs == 2 and first == 0:
+        def call(global_state, stack):
+            y = stack.pop()
+            x = unwrap_value(stack.pop())
+            return primitive(global_state, x, unwrap_value(y))
+        return call
+    elif nargs == 2 and first == 1:
+        def call(global_state, stack):
+            y = unwrap_value(stack.pop())
+            return primitive(global_state, stack.pop(), y)
+        return call
+    else:
+        def call(global_state, stack):
+            args = stack[-nargs:]
+            del stack[-nargs:]
+            return primitive(global_state, *(args[:first] + unwrap_values(args[first:])))
+        return call
+
+
+class ReadSuspension(Exception):
+    """Raised when the program reads a key while running with
+    suspend_on_read and no key has been given yet."""
+    pass
+
+
 class GbsCompiledProgram(object):
     
     def __init__(self, tree, module_prefix=''):
         self.tree = tree
         self.module_prefix = module_prefix
+        self.explicit_builtins = gbs_builtins.explicit_builtins
+        self._init_builtins()
+        self.routines = {}
+        self.external_routines = {}
+
+    def _init_builtins(self):
         self.builtins = {}
-        for b in get_builtins():
+        for b in get_builtins(self.explicit_builtins):
             bname, b = b.name(), b.underlying_construct()
             self.builtins[bname] = b
-        self.routines = {}
-        self.external_routines = {}
+
+    def __getstate__(self):
+        # The builtins hold Python functions, which cannot be pickled,
+        # so they are looked up again when the program is unpickled
+        state = self.__dict__.copy()
+        del state['builtins']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_builtins()
 
     def __repr__(self):
         sr = seq_sorted(self.routines.values(), key=lambda r: r.name)
@@ -110,6 +328,12 @@ class GbsCompiledCode(object):
         self.label_table = {}
         self.nearby_elems = {}
         self.explicit_board = explicit_board
+        self.varnames = []
+        self.slots = {}
+        for param in params:
+            self.slot(param)
+        self.linked = False
+        self._decoded_ops = None
 
     def is_function(self):
         return self.prfn == 'function'
@@ -120,6 +344,13 @@ class GbsCompiledCode(object):
     def is_entrypoint(self):
         return self.prfn == 'entrypoint'
 
+    def slot(self, varname):
+        "Returns the slot of the variable, assigning it the next free one."
+        if varname not in self.slots:
+            self.slots[varname] = len(self.varnames)
+            self.varnames.append(varname)
+        return self.slots[varname]
+
     def push(self, op, near=None):
         if near:
             self.nearby_elems[len(self.ops)] = near
@@ -132,6 +363,79 @@ class GbsCompiledCode(object):
                 self.label_table[id(op[1])] = i + 1
             i += 1
 
+    def link(self, builtins=None):
+        """Resolves the jumps to absolute instruction indexes and removes
+        the labels from the code, keeping the source mapping of every
+        remaining instruction. Requires the label table to be built.
+
+        If the builtins of the program are given, the calls to them
+        that pass as many arguments as the builtin takes become
+        callBuiltin ops. The other calls are left as they are, so that
+        the arity error is raised if they are ever run."""
+        if self.linked:
+            return
+        new_index = []
+        i = 0
+        for op in self.ops:
+            new_index.append(i)
+            if op[0] != 'label':
+                i += 1
+        new_index.append(i)
+
+        def target(label):
+            return new_index[self.label_table[id(label)]]
+
+        ops = []
+        nearby_elems = {}
+        for old_i, op in enumerate(self.ops):
+            opcode = op[0]
+            if opcode == 'label':
+                continue
+            elif opcode in ['jump', 'jumpIfFalse']:
+                op = (opcode, target(op[1]))
+            elif opcode in ['jumpIfNotIn', 'iterNext']:
+                op = (opcode, op[1], target(op[2])) + tuple(op[3:])
+            elif (opcode == 'call' and builtins is not None and op[1] in builtins
+                  and arity_error(builtins[op[1]], op[2]) is None):
+                op = ('callBuiltin', op[1], op[2])
+            if old_i in self.nearby_elems:
+                nearby_elems[len(ops)] = self.nearby_elems[old_i]
+            ops.append(op)
+        self.ops = ops
+        self.nearby_elems = nearby_elems
+        self.label_table = {}
+        self.linked = True
+        self._decoded_ops = None
+
+    def __getstate__(self):
+        # The decoded ops hold the functions that call the builtins,
+        # which cannot be pickled, so they are decoded again when needed
+        state = self.__dict__.copy()
+        state['_decoded_ops'] = None
+        return state
+
+    def decoded_ops(self, builtins):
+        """Returns the ops of the routine decoded for execution: opcodes
+        are integers, jump labels are resolved to instruction indexes and
+        callBuiltin ops get the function that calls their builtin, among
+        the given builtins of the program. The ops are decoded only once."""
+        if self._decoded_ops is None:
+            self._decoded_ops = [self._decode_op(op, builtins) for op in self.ops]
+        return self._decoded_ops
+
+    def _decode_op(self, op, builtins):
+        opnum = OPCODE_NUMBERS[op[0]]
+        if opnum == OP_CALL_BUILTIN:
+            return (opnum, op[1], op[2], builtin_caller(builtins[op[1]], op[2]))
+        elif self.linked:
+            return (opnum,) + tuple(op[1:])
+        elif opnum == OP_JUMP or opnum == OP_JUMP_IF_FALSE:
+            return (opnum, self.label_table[id(op[1])])
+        elif opnum == OP_JUMP_IF_NOT_IN or opnum == OP_ITER_NEXT:
+            return (opnum, op[1], self.label_table[id(op[2])]) + tuple(op[3:])
+        else:
+            return (opnum,) + tuple(op[1:])
+
     def add_enter(self):
         if self.prfn == 'function':
             self.push(('enter',))
@@ -160,7 +464,15 @@ class GbsCompiledCode(object):
 
     def __repr__(self):
         def showop(op):
-            if op[0] == 'jumpIfNotIn':
+            if op[0] in VAR_OPCODES:
+                return '    %s %s' % (op[0], self.varnames[op[1]])
+            elif op[0] in ITER_OPCODES:
+                op = list(op)
+                for i in ITER_OPCODES[op[0]]:
+                    if i < len(op):
+                        op[i] = self.varnames[op[i]]
+                return '    ' + ' '.join([str(x) for x in op])
+            elif op[0] == 'jumpIfNotIn':
                 opname, lits, label = op
                 return '    %s %s %s' % (opname, label, ' '.join([str(x) for x in lits]))
             elif op[0] == 'returnVars':
@@ -175,64 +487,84 @@ class GbsCompiledCode(object):
 
 
 class ActivationRecord(object):
+    """The state of a routine being executed. Its variables are kept in
+    the list of slots of the routine, where unbound variables are None,
+    and the slots of the immutable variables are the bits set in the
+    immutable mask."""
 
     def __init__(self, program, routine):
         self.program = program
         self.routine = routine
+        self.code = routine.decoded_ops(program.builtins)
         self.ip = 0
-        self.bindings = {}
-        self.immutable_names = []
+        self.locals = [None] * len(routine.varnames)
+        self.immutable = 0
 
     def is_immutable(self, name):
-        return name in self.immutable_names
+        slot = self.routine.slots.get(name)
+        return slot is not None and self.is_immutable_slot(slot)
 
-    def set_immutable(self, name):
-        self.immutable_names.append(name)
+    def is_immutable_slot(self, slot):
+        return (self.immutable >> slot) & 1 == 1
 
-    def unset_immutable(self, name):
-        self.immutable_names.remove(name)
+    def set_immutable(self, slot):
+        self.immutable |= 1 << slot
 
-    def init_binding(self, name, val):
-        if name in self.bindings:
-            raise GbsVmException(i18n.i18n("Binding '%s' already exists") % (name,),
+    def unset_immutable(self, slot):
+        self.immutable &= ~(1 << slot)
+
+    def init_binding(self, slot, val):
+        if self.locals[slot] is not None:
+            raise GbsVmException(i18n.i18n("Binding '%s' already exists") % (self.routine.varnames[slot],),
                            position.ProgramAreaNear(self.program.tree))
         else:
-            self.bindings[name] = val
+            self.locals[slot] = val
 
-    def set_binding(self, name, val):
-        if not self.is_immutable(name):
-            self.bindings[name] = val
+    def set_binding(self, slot, val):
+        if not self.is_immutable_slot(slot):
+            self.locals[slot] = val
         else:
+            name = self.routine.varnames[slot]
             raise GbsVmException(i18n.i18n('Cannot modify "%s": %s is immutable') % (name, name),
                            position.ProgramAreaNear(self.program.tree))
 
-    def unset_binding(self, name):
-        del self.bindings[name]
+    def unset_binding(self, slot):
+        self.locals[slot] = None
+
+    def get_binding(self, slot):
+        return self.locals[slot]
 
-    def get_binding(self, name):
-        return self.bindings[name]
+    def is_binded(self, slot):
+        return self.locals[slot] is not None
 
-    def is_binded(self, name):
-        return name in self.bindings.keys()
+    def bindings(self):
+        "Returns the values of the bound variables, by name."
+        bindings = {}
+        for name, val in zip(self.routine.varnames, self.locals):
+            if val is not None:
+                bindings[name] = val
+        return bindings
 
     def free_bindings(self):
-        self.bindings = {}
-        self.immutable_names = []
+        self.locals = [None] * len(self.locals)
+        self.immutable = 0
 
 
 class GlobalState(object):
     
     def __init__(self, interpreter, board):
         self.interpreter = interpreter
-        self.board_states = []
         self.board = board
     
     def push(self):
-        self.board_states.append(self.board)
-        self.board = self.board.clone()
+        # Builtins of programs with an explicit board do not use the
+        # global board, which is the board bound to the program.
+        if not self.interpreter.explicit_board:
+            self.board.push_state()
     
     def pop(self):
-        self.board = self.board_states.pop()
+        if not self.interpreter.explicit_board:
+            self.board.pop_state()
     
     def backtrace(self, msg):
         return self.interpreter.backtrace(msg)
@@ -243,8 +575,9 @@ class GlobalState(object):
 
 class GbsVmInterpreter(object):
    
-    def __init__(self, toplevel_filename=None):
+    def __init__(self, toplevel_filename=None, limits=NO_LIMITS):
         self.toplevel_filename = toplevel_filename
+        self.limits = limits
         self.interactive_api = None
         self.program = None
         self.ar = None
@@ -252,6 +585,12 @@ class GbsVmInterpreter(object):
         self.stack = None
         self.global_state = None
         self.explicit_board = None
+        self._handlers = [getattr(self, '_op_' + opname) for opname in OPCODES]
+        self._suspend_on_read = False
+        self._pending_key = None
+        self.steps = 0
+        self._chunk = 0
+        self._running_time = 0.0
 
     def area_near(self, ar):
         elem = ar.routine.nearby_elems.get(ar.ip, self.program.tree)
@@ -288,9 +627,13 @@ class GbsVmInterpreter(object):
         self.callstack = []
         self.stack = []
         self.global_state = GlobalState(self, board)
+        self.steps = 0
+        self._chunk = 0
+        self._running_time = 0.0
         self.explicit_board = len(self.ar.routine.params) > 0
         if self.explicit_board:
-            self.ar.bindings[self.ar.routine.params[0]] = GbsObject(board, 'Board')
+            self.ar.locals[0] = GbsObject(board, 'Board')
+        self._check_board_cells(board)
 
     def push_stack(self, value):
         self.stack.append(value)
@@ -299,17 +642,18 @@ class GbsVmInterpreter(object):
         return self.stack.pop()
 
     def _read_arguments(self, params):
+        # the parameters take the first slots of the routine
         args = []
         for _ in range(len(params)):
             args.insert(0, self.pop_stack())
-        for p, a in zip(params, args):
-            self.ar.init_binding(p, a)
+        for slot, a in enumerate(args):
+            self.ar.init_binding(slot, a)
 
     def show_state(self):
         return '\n'.join([
             '    IP: %s(%i)' % (self.ar.routine.name, self.ar.ip),
             '    STACK: %s' % (self.stack,),
-            '    LOCALS: %s' % (self.ar.bindings,),
+            '    LOCALS: %s' % (self.ar.bindings(),),
         ])
 
     def backtrace(self, msg):
@@ -324,224 +668,371 @@ class GbsVmInterpreter(object):
                              describe(x, y)
                              for x, y in zip(cs, range(0, len(cs)))
                            ])) + '\n'
-        bindings = [(k, v) for k, v in seq_sorted(self.ar.bindings.items())
+        bindings = [(k, v) for k, v in seq_sorted(self.ar.bindings().items())
                            if k[0] != '_']
         if len(bindings) > 0:
             res += i18n.i18n('Locals:') + '\n'
             res += indent('\n'.join(['%s: %s' % (k, v) for k, v in bindings]))
         return res
 
+    def limit_exceeded(self, msg, limit):
+        raise GbsVmLimitException(self.backtrace(msg), self.current_area(), limit)
+
+    def _check_board_cells(self, board):
+        max_cells = self.limits.max_board_cells
+        if max_cells is not None and board.size[0] * board.size[1] > max_cells:
+            self.limit_exceeded(i18n.i18n('The board has more than %s cells') % (max_cells,),
+                                'max_board_cells')
+
+    def _check_call_depth(self):
+        max_depth = self.limits.max_call_depth
+        if max_depth is not None and len(self.callstack) >= max_depth:
+            self.limit_exceeded(i18n.i18n('The program made more than %s nested calls') % (max_depth,),
+                                'max_call_depth')
+
+    def _check_limits(self, running_since):
+        """Checks the limits on the steps done, the running time and the
+        size of the board, returning the number of instructions that can
+        be executed before they have to be checked again."""
+        limits = self.limits
+        if limits.max_steps is not None and self.steps >= limits.max_steps:
+            self.limit_exceeded(i18n.i18n('The program executed more than %s steps') % (limits.max_steps,),
+                                'max_steps')
+        if limits.max_time is not None:
+            if self._running_time + time.time() - running_since > limits.max_time:
+                self.limit_exceeded(i18n.i18n('The program ran for more than %s seconds') % (limits.max_time,),
+                                    'max_time')
+        if not self.explicit_board:
+            self._check_board_cells(self.global_state.board)
+        chunk = LIMIT_CHECK_INTERVAL
+        if limits.max_steps is not None:
+            chunk = min(chunk, limits.max_steps - self.steps)
+        return chunk
+
     def arity_check(self, construct, nargs):
-        nparams = construct.num_params()
-        if nparams == nargs: return
-        if nparams < nargs:
-            many_few = 'many'
-        else:
-            many_few = 'few'
-        msg = 'Too %s arguments for %s "%%s".\nExpected %%i (%%s), received %%i' % (
-                             many_few, construct.type())
-        raise GbsVmException(i18n.i18n(msg) % (construct.name(),
-                                               nparams,
-                                               ', '.join(construct.params()),
-                                               nargs),
-                                               self.current_area())
-
-    def check_uninitialized_variable(self, varname, bindings):
-        if varname not in bindings:
-            raise GbsVmException(i18n.i18n('Identifier "%s" does not exists.') % (varname,),
+        msg = arity_error(construct, nargs)
+        if msg is not None:
+            raise GbsVmException(msg, self.current_area())
+
+    def check_uninitialized_variable(self, slot):
+        if not self.ar.is_binded(slot):
+            raise GbsVmException(i18n.i18n('Identifier "%s" does not exists.') % (self.ar.routine.varnames[slot],),
                                  self.current_area())
 
-    def get_binding(self, name):
-        self.check_uninitialized_variable(name, self.ar.bindings)
-        return self.ar.get_binding(name)
+    def get_binding(self, slot):
+        self.check_uninitialized_variable(slot)
+        return self.ar.get_binding(slot)
+
+    def read_key(self):
+        """Returns the next key read by the program. If the execution is
+        to be suspended on reads and no key was given with input_key,
+        raises ReadSuspension."""
+        if self._pending_key is not None:
+            key = self._pending_key
+            self._pending_key = None
+            return key
+        elif self._suspend_on_read:
+            raise ReadSuspension()
+        else:
+            # the time spent waiting for the key is not running time
+            waiting_since = time.time()
+            try:
+                return self.interactive_api.read()
+            finally:
+                self._running_time -= time.time() - waiting_since
+
+    def input_key(self, key):
+        "Gives the key for the read on which the execution was suspended."
+        self._pending_key = self.interactive_api.adapt_key(key)
+
+    def run(self, suspend_on_read=False):
+        """Executes instructions until the program ends, returning the
+        ('END', retvals, board) tuple that the last step() would return.
+
+        If suspend_on_read is True and the program reads a key that has
+        not been given with input_key, ('READ', None) is returned instead.
+        The machine is left right before the read, so the execution can
+        be resumed by calling input_key and then run again.
+
+        The number of instructions executed since init_program is kept
+        in self.steps. GbsVmLimitException is raised if the program
+        exceeds any of self.limits."""
+        handlers = self._handlers
+        stack = self.stack
+        running_since = time.time()
+        countdown = self._chunk = self._check_limits(running_since)
+        self._suspend_on_read = suspend_on_read
+        try:
+            while True:
+                if not countdown:
+                    self.steps += self._chunk
+                    self._chunk = 0
+                    countdown = self._chunk = self._check_limits(running_since)
+                    continue
+                countdown -= 1
+                ar = self.ar
+                op = ar.code[ar.ip]
+                opnum = op[0]
+                if opnum == OP_PUSH_CONST:
+                    stack.append(op[1])
+                    ar.ip += 1
+                elif opnum == OP_PUSH_FROM and ar.locals[op[1]] is not None:
+                    stack.append(ar.locals[op[1]])
+                    ar.ip += 1
+                elif opnum == OP_JUMP:
+                    ar.ip = op[1]
+                elif opnum == OP_CALL_BUILTIN:
+                    res = op[3](self.global_state, stack)
+                    if res is not None:
+                        stack.append(res)
+                    ar.ip += 1
+                else:
+                    res = handlers[opnum](op)
+                    if res is not None:
+                        return res
+        except ReadSuspension:
+            return 'READ', None
+        finally:
+            self.steps += self._chunk - countdown
+            self._chunk = 0
+            self._running_time += time.time() - running_since
+            self._suspend_on_read = False
 
     def step(self):
-        assert self.ar.ip < len(self.ar.routine.ops)
-        op = self.ar.routine.ops[self.ar.ip]
-        opcode = op[0]
-
-        if opcode == 'pushConst':
-            self.push_stack(op[1])
-            self.ar.ip += 1
-
-        elif opcode == 'pushFrom':
-            self.push_stack(self.get_binding(op[1]))
-            self.ar.ip += 1
-    
-        elif opcode == 'delVar':
-            assert op[1] in self.ar.bindings
-            self.ar.unset_binding(op[1])
-            if self.ar.is_immutable(op[1]):
-                self.ar.unset_immutable(op[1])
-            self.ar.ip += 1
-    
-        elif opcode == 'setImmutable':
-            assert op[1] in self.ar.bindings
-            self.ar.set_immutable(op[1])
-            self.ar.ip += 1
-    
-        elif opcode == 'unsetImmutable':
-            assert op[1] in self.ar.bindings and self.ar.is_immutable(op[1])
-            self.ar.unset_immutable(op[1])
+        """Executes a single instruction. The time spent in each step
+        counts towards the running time, as in run."""
+        running_since = time.time()
+        if not self.limits.unlimited():
+            self._check_limits(running_since)
+        self.steps += 1
+        ar = self.ar
+        op = ar.code[ar.ip]
+        try:
+            res = self._handlers[op[0]](op)
+        finally:
+            self._running_time += time.time() - running_since
+        ## DEBUG
+        #print(op)
+        #print(self.show_state())
+        if res is None:
+            return CONTINUE
+        else:
+            return res
+
+    #### Instruction handlers.
+    ####
+    #### Each handler receives a decoded op and returns None to continue
+    #### execution, or an ('END', retvals, board) tuple when the program
+    #### finishes.
+
+    def _op_pushConst(self, op):
+        self.stack.append(op[1])
+        self.ar.ip += 1
+
+    def _op_pushFrom(self, op):
+        self.stack.append(self.get_binding(op[1]))
+        self.ar.ip += 1
+
+    def _op_delVar(self, op):
+        ar = self.ar
+        assert ar.is_binded(op[1])
+        ar.unset_binding(op[1])
+        ar.unset_immutable(op[1])
+        ar.ip += 1
+
+    def _op_setImmutable(self, op):
+        assert self.ar.is_binded(op[1])
+        self.ar.set_immutable(op[1])
+        self.ar.ip += 1
+
+    def _op_unsetImmutable(self, op):
+        assert self.ar.is_binded(op[1]) and self.ar.is_immutable_slot(op[1])
+        self.ar.unset_immutable(op[1])
+        self.ar.ip += 1
+
+    def _op_popTo(self, op):
+        assert len(self.stack) > 0
+        ar = self.ar
+        val = self.stack.pop()
+        slot = op[1]
+        old = ar.locals[slot]
+        if old is not None:
+            typecheck_vals(self.global_state, old, val)
+        ar.set_binding(slot, clone_value(val))
+        ar.ip += 1
+
+    def _op_iterInit(self, op):
+        kind = op[2]
+        values = []
+        for _ in range(ITER_KINDS[kind]):
+            values.insert(0, unwrap_value(self.stack.pop()))
+        if kind == 'list':
+            cursor = gbs_builtins.list_operation(self.global_state, values[0],
+                                                 lambda global_state, lst: iter(lst))
+        elif kind == 'repeat':
+            # fails as the comparison of the count with 0 would
+            gbs_builtins.poly_cmp(self.global_state, values[0], 0, lambda a, b: a > b)
+            cursor = iter(xrange(values[0]))
+        elif kind == 'range':
+            cursor = gbs_builtins.poly_range_iter(values[0], values[1], 'NoSecondElementForRange')
+        else:
+            cursor = gbs_builtins.poly_range_iter(values[0], values[1], values[2])
+        self.ar.locals[op[1]] = cursor
+        self.ar.ip += 1
+
+    def _op_iterNext(self, op):
+        ar = self.ar
+        try:
+            val = next(ar.locals[op[1]])
+        except StopIteration:
+            ar.ip = op[2]
+            return
+        if len(op) > 3:
+            slot = op[3]
+            old = ar.locals[slot]
+            if old is not None:
+                typecheck_vals(self.global_state, old, val)
+            ar.set_binding(slot, clone_value(val))
+        ar.ip += 1
+
+    def _op_iterEnd(self, op):
+        ar = self.ar
+        ar.unset_binding(op[1])
+        if len(op) > 2:
+            ar.unset_binding(op[2])
+            ar.unset_immutable(op[2])
+        ar.ip += 1
+
+    def _op_call(self, op):
+        funcName = op[1]
+        nargs = op[2]
+        assert len(self.stack) >= nargs
+        if funcName in self.program.builtins:
+            builtin = self.program.builtins[funcName]
+            self.arity_check(builtin, nargs)
+            res = builtin_caller(builtin, nargs)(self.global_state, self.stack)
+            # [TODO] Remove : if builtin.type() == 'function':
+            if not res is None: # [TODO] Remove hack for _SetRefValue
+                self.push_stack(res) # push result
             self.ar.ip += 1
-    
-        elif opcode == 'popTo':
-            assert len(self.stack) > 0
-            val = self.pop_stack()
-            varname = op[1]
-            if self.ar.is_binded(varname):
-                typecheck_vals(self.global_state, self.ar.get_binding(varname), val)
-            self.ar.set_binding(varname, clone_value(val))
+        elif funcName in self.program.routines:
+            self._check_call_depth()
+            self.callstack.append(self.ar)
+            rtn = self.program.routines[funcName]
+            self.arity_check(rtn.construct(), nargs)
+            self.ar = ActivationRecord(self.program, rtn)
+            self._read_arguments(self.ar.routine.params)
+        elif funcName in self.program.external_routines:
+            self._check_call_depth()
+            self.callstack.append(self.ar)
+            module, rtn = self.program.external_routines[funcName]
+            self.arity_check(rtn.construct(), nargs)
+            self.ar = ActivationRecord(module, rtn)
+            self._read_arguments(self.ar.routine.params)
+            self.program = module
+        else:
+            raise GbsVmException(i18n.i18n('function "%s" is not defined') % (
+                                 funcName,), self.current_area())
+
+    def _op_callBuiltin(self, op):
+        res = op[3](self.global_state, self.stack)
+        if res is not None:
+            self.stack.append(res)
+        self.ar.ip += 1
+
+    def _op_THROW_ERROR(self, op):
+        msg = i18n.i18n('Self destruction:')
+        msg = '\n'.join([msg, show_string(op[1])])
+        msg = self.backtrace(msg)
+        area = self.current_area()
+        raise GbsVmException(msg, area)
+
+    def _op_label(self, op):
+        self.ar.ip += 1
+
+    def _op_jump(self, op):
+        self.ar.ip = op[1]
+
+    def _op_jumpIfFalse(self, op):
+        assert len(self.stack) > 0
+        val = unwrap_value(self.stack.pop())
+        if poly_typeof(val) != 'Bool':
+            raise GbsVmException(i18n.i18n('Condition should be a boolean'), self.current_area())
+        if not val:
+            self.ar.ip = op[1]
+        else:
             self.ar.ip += 1
-    
-        elif opcode == 'call':
-            funcName = op[1]
-            nargs = op[2]
-            assert len(self.stack) >= nargs
-            if funcName in self.program.builtins:
-                builtin = self.program.builtins[funcName]
-                self.arity_check(builtin, nargs)
-                args = []
-                for _ in range(nargs):
-                    args.insert(0, self.pop_stack())
-        
-                #unwrap args
-                if isinstance(builtin, gbs_constructs.BuiltinProcedure) and len(args) > 1:
-                    args = [args[0]] + unwrap_values(args[1:])
-                elif isinstance(builtin, gbs_constructs.BuiltinFunction):
-                    args = unwrap_values(args)
-        
-                res = builtin.primitive()(self.global_state, *args)
-                # [TODO] Remove : if builtin.type() == 'function':
-                if not res is None: # [TODO] Remove hack for _SetRefValue
-                    self.push_stack(res) # push result
-                self.ar.ip += 1
-            elif funcName in self.program.routines:
-                self.callstack.append(self.ar)
-                rtn = self.program.routines[funcName]
-                self.arity_check(rtn.construct(), nargs)
-                self.ar = ActivationRecord(self.program, rtn)
-                self._read_arguments(self.ar.routine.params)
-            elif funcName in self.program.external_routines:
-                self.callstack.append(self.ar)
-                module, rtn = self.program.external_routines[funcName]
-                self.arity_check(rtn.construct(), nargs)
-                self.ar = ActivationRecord(module, rtn)
-                self._read_arguments(self.ar.routine.params)
-                self.program = module
-            else:
-                raise GbsVmException(i18n.i18n('function "%s" is not defined') % (
-                                     funcName,), self.current_area())
-    
-        elif opcode == 'THROW_ERROR':
-            msg = i18n.i18n('Self destruction:')
-            msg = '\n'.join([msg, show_string(op[1])])
-            msg = self.backtrace(msg)
-            area = self.current_area()
-            raise GbsVmException(msg, area)
-    
-        elif opcode == 'label':
+
+    def _op_jumpIfNotIn(self, op):
+        assert len(self.stack) > 0
+        val = unwrap_value(self.stack.pop())
+        if val not in op[1]:
+            self.ar.ip = op[2]
+        else:
             self.ar.ip += 1
-    
-        elif opcode == 'jump':
-            dest = id(op[1])
-            assert dest in self.ar.routine.label_table
-            self.ar.ip = self.ar.routine.label_table[dest]
-    
-        elif opcode == 'jumpIfFalse':
-            dest = id(op[1])
-            assert dest in self.ar.routine.label_table
-            assert len(self.stack) > 0
-            val = self.pop_stack()
-            val = unwrap_value(val)
-    
-            if poly_typeof(val) != 'Bool':
-                raise GbsVmException(i18n.i18n('Condition should be a boolean'), self.current_area())
-            if not val:
-                self.ar.ip = self.ar.routine.label_table[dest]
-            else:
-                self.ar.ip += 1
-    
-        elif opcode == 'jumpIfNotIn':
-            dest = id(op[2])
-            assert dest in self.ar.routine.label_table
-            assert len(self.stack) > 0
-            val = self.pop_stack()
-            val = unwrap_value(val)
-            if val not in op[1]:
-                self.ar.ip = self.ar.routine.label_table[dest]
+
+    def _op_enter(self, op):
+        self.global_state.push()
+        self.ar.ip += 1
+
+    def _op_leave(self, op):
+        self.global_state.pop()
+        self.ar.ip += 1
+
+    def _op_return(self, op):
+        assert len(self.callstack) > 0
+        nvals = op[1]
+        assert len(self.stack) >= nvals
+        self.ar = self.callstack.pop()
+        self.ar.ip += 1
+        self.program = self.ar.program
+
+    def _op_returnVars(self, op):
+        nvals = op[1]
+        if len(self.callstack) == 0:
+            assert self.ar.routine.name == 'program' and self.ar.routine.prfn == 'entrypoint'
+            return_vars = [polyname_name(x) for x in op[2]]
+            assert len(return_vars) == nvals
+            #else:
+            #  return_vars = [x.children[1].value
+            #                    for x in self.ar.routine.tree.children[3].children[-1].children[1].children]
+
+            # TODO: Result to str mapping should be done in a later stage, not here.
+            return_vals = map(repr, self.stack[-len(return_vars):])
+
+            if self.explicit_board:
+                return 'END', list(zip(return_vars, return_vals)), self.get_binding(0)
             else:
-                self.ar.ip += 1
-    
-        elif opcode == 'enter':
-            self.global_state.push()
-            self.ar.ip += 1
-    
-        elif opcode == 'leave':
-            self.global_state.pop()
-            self.ar.ip += 1
-    
-        elif opcode == 'return':
-            assert len(self.callstack) > 0
-            nvals = op[1]
-            assert len(self.stack) >= nvals
+                return 'END', list(zip(return_vars, return_vals)), GbsObject(self.global_state.board, 'Board')
+        else:
+            # pop the return results in case of having a recursive Main
+            # (Main is a procedure, so the values it returns are not used)
+            for _ in range(nvals):
+                self.pop_stack()
             self.ar = self.callstack.pop()
             self.ar.ip += 1
             self.program = self.ar.program
-    
-        elif opcode == 'returnVars':
-            nvals = op[1]
-            if len(self.callstack) == 0:
-                assert self.ar.routine.name == 'program' and self.ar.routine.prfn == 'entrypoint'
-                return_vars = [polyname_name(x) for x in op[2]]
-                assert len(return_vars) == nvals
-                #else:
-                #  return_vars = [x.children[1].value
-                #                    for x in self.ar.routine.tree.children[3].children[-1].children[1].children]
-        
-                # TODO: Result to str mapping should be done in a later stage, not here.
-                return_vals = map(repr, self.stack[-len(return_vars):])
-    
-                if self.explicit_board:
-                    return 'END', list(zip(return_vars, return_vals)), self.get_binding(self.ar.routine.params[0])
-                else:
-                    return 'END', list(zip(return_vars, return_vals)), GbsObject(self.global_state.board, 'Board')
-            else:
-                # pop the return results in case of having a recursive Main
-                # (Main is a procedure, so the values it returns are not used)
-                for _ in range(nvals):
-                    self.pop_stack()
-                self.ar = self.callstack.pop()
-                self.ar.ip += 1
-                self.program = self.ar.program
-    
-        ## DEBUG
-        #print(op)
-        #print(self.show_state())
-        return 'CONTINUE', None
 
 
-def interp(compiled_program, board, interactive_api=None):
-    vm = GbsVmInterpreter()
+def interp(compiled_program, board, interactive_api=None, limits=NO_LIMITS):
+    vm = GbsVmInterpreter(limits=limits)
 
     if interactive_api is None:
         interactive_api = NullInteractiveAPI()
 
     vm.init_program(compiled_program, board, gbs_io.CrossPlatformApiAdapter(interactive_api))
 
-    while True:
-        r = vm.step()
-        if r[0] == 'END':
-            return r[1:]
+    return vm.run()[1:]
 
 
 class VmCompiledRunnable(gbs_runnable.GbsRunnable):
     
-    def __init__(self, compiled_program):
+    def __init__(self, compiled_program, limits=NO_LIMITS):
         self._prog = compiled_program
+        self._limits = limits
 
     def run(self, board, interactive_api = None):
-        return interp(self._prog, board, interactive_api)
+        return interp(self._prog, board, interactive_api, self._limits)
 
 
 class NullInteractiveAPI(gbs_io.InteractiveApi):
@@ -68,9 +68,6 @@ class Mangler(object):
   def mangle_var(self, compiled_program, rtn_name, varname):
     return varname
 
-  def mangle_label(self, label_name):
-    return label_name
-
   def mangle_opcode(self, opcode):
     return opcode
 
@@ -82,6 +79,7 @@ Opcode_to_compact = {
  'pushFrom':      'v',
  'popTo':       'a',
  'call':         'c',
+ 'callBuiltin':  'C',
  'THROW_ERROR':         'b',
  'label':        'l',
  'jump':         'j',
@@ -92,6 +90,11 @@ Opcode_to_compact = {
  'enter':        'e',
  'leave':        'z',
  'delVar':       'd',
+ 'setImmutable': 's',
+ 'unsetImmutable': 'u',
+ 'iterInit':     'i',
+ 'iterNext':     'k',
+ 'iterEnd':      'o',
 #
  'procedure':    'P',
  'function':     'F',
@@ -107,10 +110,8 @@ class CompactMangler(object):
     self._rtns = {}
     self._rtn_cache = {}
     self._var_cache = {}
-    self._lab_cache = {}
     self._last_rtn_id = 0
     self._last_var_id = 0
-    self._last_lab_id = 0
 
   def mangle_routines(self, compiled_program):
     for eprog in external_programs(compiled_program):
@@ -132,11 +133,6 @@ class CompactMangler(object):
     self._last_var_id += 1
     return res
 
-  def next_lab_id(self):
-    res = 'L%s' % (base_alpha(self._last_lab_id),)
-    self._last_lab_id += 1
-    return res
-
   def mangle(self, compiled_program, rtn_name):
     prf = compiled_program.module_prefix
     if rtn_name in compiled_program.builtins:
@@ -159,11 +155,6 @@ class CompactMangler(object):
       self._var_cache[varname] = self.next_var_id()
     return self._var_cache[varname]
 
-  def mangle_label(self, label_name):
-    if label_name not in self._lab_cache:
-      self._lab_cache[label_name] = self.next_lab_id()
-    return self._lab_cache[label_name]
-
   def mangle_opcode(self, opcode):
     return Opcode_to_compact[opcode]
 
@@ -180,7 +171,7 @@ class GbsVmWriter(object):
       assert False
     self._f = f
   def dump_program(self, compiled_program):
-    self._f.write('GBO/1.0\n')
+    self._f.write('GBO/1.2\n')
     rtns = self._mangler.mangle_routines(compiled_program)
     rtns = utils.seq_sorted(rtns.items())
     for mangled_name, (prog, rtn) in rtns:
@@ -189,12 +180,14 @@ class GbsVmWriter(object):
   def dump_routine(self, prog, rtn):
     def showop(op):
       # preprocess (mangle)
-      if op[0] in ['pushFrom', 'popTo', 'delVar']:
-        op = op[0], self._mangler.mangle_var(prog, rtn, op[1])
-      elif op[0] in ['label', 'jump', 'jumpIfFalse']:
-        op = op[0], self._mangler.mangle_label(op[1])
-      elif op[0] in ['jumpIfNotIn']:
-        op = op[0], op[1], self._mangler.mangle_label(op[2])
+      # variables are written by name, not by slot
+      if op[0] in gbs_vm.VAR_OPCODES:
+        op = op[0], self._mangler.mangle_var(prog, rtn, rtn.varnames[op[1]])
+      elif op[0] in gbs_vm.ITER_OPCODES:
+        op = list(op)
+        for i in gbs_vm.ITER_OPCODES[op[0]]:
+          if i < len(op):
+            op[i] = self._mangler.mangle_var(prog, rtn, rtn.varnames[op[i]])
       #
       T = self._mangler.tabulation()
 
@@ -206,7 +199,7 @@ class GbsVmWriter(object):
         opname, nvrs, vrs = op
         return T + '%s %s %s' % (
           self._mangler.mangle_opcode(opname), nvrs, ' '.join([str(x) for x in vrs]))
-      elif op[0] == 'call':
+      elif op[0] in gbs_vm.CALL_OPCODES:
         opname, rtn_name, nargs = op
         return T + '%s %s %u' % (
           self._mangler.mangle_opcode(opname), self._mangler.mangle(prog, rtn_name), nargs)
@@ -223,6 +216,8 @@ class GbsVmWriter(object):
 
     params = ' '.join(mangled_params)
     self._f.write('%s %s %s\n' % (self._mangler.mangle_opcode(rtn.prfn), mname, params))
+    # Only linked code is written: jump targets are instruction indexes
+    assert rtn.linked
     for op in rtn.ops:
       self._f.write('%s\n' % (showop(op),))
     self._f.write(self._mangler.mangle_opcode('end') +'\n\n')
@@ -269,15 +264,28 @@ class GbsVmReader(object):
     return Compact_to_opcode.get(opcode, opcode)
 
   def load_program(self):
-    code = gbs_vm.GbsCompiledProgram(None)
     hdr = self.line()
-    if hdr != 'GBO/1.0':
-      self.fail('Expected header line "GBO/1.0"')
+    # GBO/1.0 objects use labels, GBO/1.1 objects are linked, and
+    # GBO/1.2 objects are linked and call builtins with callBuiltin
+    if hdr == 'GBO/1.0':
+      self._linked = False
+    elif hdr in ['GBO/1.1', 'GBO/1.2']:
+      self._linked = True
+    else:
+      self.fail('Expected header line "GBO/1.2"')
+    routines = {}
     while True:
       rtn = self.load_routine()
       if rtn is None:
         break
-      code.routines[rtn.name] = rtn
+      routines[rtn.name] = rtn
+    # Objects are not linted, which is where the builtins for programs
+    # with an implicit or explicit board are chosen
+    for rtn in routines.values():
+      if rtn.prfn == 'entrypoint':
+        gbs_builtins.explicit_builtins = len(rtn.params) > 0
+    code = gbs_vm.GbsCompiledProgram(None)
+    code.routines = routines
     code.tree = FakeAST(filename=self._filename)
     return code
 
@@ -299,24 +307,56 @@ class GbsVmReader(object):
       op = l.split(' ')
       op[0] = self.unmangle_opcode(op[0])
       if op[0] == 'pushConst':
-        op[1] = self._parse_constant(op[1])
+        op = [op[0], self._parse_literal(l.split(' ', 1)[1])]
       elif op[0] in ['jump', 'jumpIfFalse']:
-        op[1] = intern(op[1])
+        op[1] = self._parse_jump_target(op[1])
       elif op[0] == 'jumpIfNotIn':
-        op = op[0], [self._parse_constant(x) for x in op[2:]], intern(op[1])
+        op = op[0], [self._parse_constant(x) for x in op[2:]], self._parse_jump_target(op[1])
       elif op[0] == 'returnVars':
         op = op[0], int(op[1]), op[2:]
-      elif op[0] == 'call':
+      elif op[0] in gbs_vm.VAR_OPCODES:
+        op[1] = code.slot(op[1])
+      elif op[0] in gbs_vm.ITER_OPCODES:
+        for i in gbs_vm.ITER_OPCODES[op[0]]:
+          if i < len(op):
+            op[i] = code.slot(op[i])
+        if op[0] == 'iterInit' and op[2] not in gbs_vm.ITER_KINDS:
+          self.fail('Unknown iteration kind %s' % (op[2],))
+        elif op[0] == 'iterNext':
+          op[2] = self._parse_jump_target(op[2])
+      elif op[0] in gbs_vm.CALL_OPCODES:
         op[1] = self.unmangle(op[1])
         op[2] = int(op[2])
       elif op[0] == 'return':
         op[1] = int(op[1])
       elif op[0] == 'label':
-        op[1] = intern(op[1])
-      code.push(op)
-    code.build_label_table()
+        if self._linked:
+          self.fail('Unexpected label in linked object')
+        op[1] = intern(str(op[1]))
+      code.push(tuple(op))
+    if self._linked:
+      code.linked = True
+    else:
+      code.build_label_table()
+      code.link()
     return code
 
+  def _parse_jump_target(self, target):
+    if not self._linked:
+      return intern(str(target))
+    elif not utils.is_int(str(target)):
+      self.fail('Jump target should be an instruction index')
+    return int(target)
+
+  def _parse_literal(self, name):
+    # Symbols and strings are kept as they are (see gbs_compiler.parse_literal)
+    val = gbs_builtins.parse_constant(name)
+    if val is None:
+      if isinstance(name, unicode):
+        name = name.encode('utf8')
+      return name
+    return val
+
   def _parse_constant(self, name):
     val = gbs_builtins.parse_constant(name)
     if val is None:
@@ -15,8 +15,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
-import common.i18n as i18n
-import lang.gbs_builtins
+import pygobstoneslang.common.i18n as i18n
+from pygobstoneslang.lang import gbs_builtins
 
 def maxint(nbytes):
   res = 0
@@ -37,6 +37,8 @@ def numtol(n, nbytes=4):
 
 Max_err_len = 512
 def boom_code_for(msg):
+  if isinstance(msg, unicode):
+    msg = msg.encode('utf8')
   msg = msg[:Max_err_len - 1] + '\0'
   res = []
 
@@ -64,6 +66,18 @@ def boom_code_for(msg):
   ])
   return ''.join(res)
 
+def jump_on_overflow():
+  """Native integers have 64 bits, while the VM uses arbitrary precision
+  integers. If an arithmetic operation overflows, fail with a runtime
+  error so that the program is run again by the VM."""
+  boom_code = boom_code_for(i18n.i18n('Integer overflow'))
+  return ''.join([
+    # jno .end
+    '\x0f\x81' + numtol(len(boom_code), 4),
+    boom_code,
+    # .end:
+  ])
+
 def relop(setx_al):
   return ''.join([
       '\x58',             # pop rax
@@ -83,6 +97,7 @@ def _primitive_PutStone():
       '\x48\xc1\xe0\x04',     # shl rax, 4    ; rax = 16 * width * y + 16 * x
       '\x48\x01\xd8',         # add rax, rbx  ; rax = rbx[16 * width * y + 16 * x]
       '\x42\xff\x04\x88',     # inc dword [rax + 4 * r9]
+      jump_on_overflow(),
   ])
 
 def _primitive_TakeStone():
@@ -94,8 +109,8 @@ def _primitive_TakeStone():
       '\x4c\x01\xd8',     # add rax, r11  ; rax = width * y + x
       '\x48\xc1\xe0\x04', # shl rax, 4    ; rax = 16 * width * y + 16 * x
       '\x48\x01\xd8',     # add rax, rbx  ; rax = rbx[16 * width * y + 16 * x]
-      '\x4a\x8b\x14\x88', # mov rdx, [rax + 4 * r9]
-      '\x48\x85\xd2',     # test rdx, rdx
+      '\x42\x8b\x14\x88', # mov edx, dword [rax + 4 * r9]
+      '\x85\xd2',         # test edx, edx
       # jnz .end
       '\x0f\x85' + numtol(len(boom_code), 4),
       boom_code,
@@ -119,7 +134,7 @@ def _switch(indices, code):
   return res
 
 def P(name, *types):
-  return lang.gbs_builtins.polyname(name, types)
+  return gbs_builtins.polyname(name, types)
 
 def _primitive_Move():
   code = {}
@@ -205,6 +220,41 @@ def _primitive_canMove():
   ])
   return _switch('ANESWXR', code)
 
+def _primitive_GoToBoundary():
+  code = {}
+  code['A'] = ''.join([
+     '\x41\x59',          # pop r9 ; pop a direction
+     '\x49\x83\xf9\x00',  # cmp r9, 0
+     '\x0f\x84' + '__N_', # je <code_n>
+     '\x49\x83\xf9\x01',  # cmp r9, 1
+     '\x0f\x84' + '__E_', # je <code_e>
+     '\x49\x83\xf9\x02',  # cmp r9, 2
+     '\x0f\x84' + '__S_', # je <code_s>
+     '\x49\x83\xf9\x03',  # cmp r9, 3
+     '\x0f\x84' + '__W_', # je <code_w>
+     '\xe9' + '__X_',     # jmp <error>
+  ])
+  code['N'] = ''.join([
+     '\x4d\x89\xf4',      # mov r12, r14
+     '\x49\xff\xcc',      # dec r12
+     '\xe9' + '__Z_',     # jmp <end>
+  ])
+  code['E'] = ''.join([
+     '\x4d\x89\xeb',      # mov r11, r13
+     '\x49\xff\xcb',      # dec r11
+     '\xe9' + '__Z_',     # jmp <end>
+  ])
+  code['S'] = ''.join([
+     '\x4d\x31\xe4',      # xor r12, r12
+     '\xe9' + '__Z_',     # jmp <end>
+  ])
+  code['W'] = ''.join([
+     '\x4d\x31\xdb',      # xor r11, r11
+     '\xe9' + '__Z_',     # jmp <end>
+  ])
+  code['X'] = boom_code_for(i18n.i18n('Invalid direction'))
+  return _switch('ANESWX', code)
+
 def _primitive_ClearBoard():
   code = {}
   code['A'] = ''.join([
@@ -237,6 +287,13 @@ def _primitive_divmod(div_mod):
     '\x58',              # pop rax ; dividend
     '\x4d\x85\xd2',      # test r10, r10 ; check for zero divisor
     '\x0f\x84' + '__X_', # jz <error>
+    '\x49\x83\xfa\xff',  # cmp r10, -1   ; check for overflow when the divisor is -1
+    '\x0f\x85' + '__S_', # jne <S>
+    '\x48\x89\xc2',      # mov rdx, rax
+    '\x48\xf7\xda',      # neg rdx
+    '\x0f\x80' + '__O_', # jo <overflow>
+  ])
+  code['S'] = ''.join([
     '\x49\x89\xc1',      # mov r9, rax   ; check if (dividend is negative) XOR (divisor is negative)
     '\x4c\x89\xd2',      # mov rdx, r10  ;   .
     '\x49\xc1\xe9\x3f',  # shr r9, 63    ;   .
@@ -252,13 +309,15 @@ def _primitive_divmod(div_mod):
   ])
   code['B'] = ''.join([
     '\x4c\x01\xc8',      # add rax, r9
+    '\x0f\x80' + '__O_', # jo <overflow>
     '\x48\x99',          # cqo ; sign extend rax to rdx:rax
     '\x49\xf7\xfa',      # idiv r10
     push_result,
     '\xe9' + '__Z_',     # jmp .end
   ])
   code['X'] = boom_code_for(i18n.i18n('Division by zero'))
-  return _switch('ABX', code)
+  code['O'] = boom_code_for(i18n.i18n('Integer overflow'))
+  return _switch('ASBXO', code)
 
 def _primitive_pow():
   code = {}
@@ -278,11 +337,14 @@ def _primitive_pow():
     '\x49\x83\xf9\x00',     # cmp r9, 0
     '\x0f\x84' + '__C_',    # jz .cont
     '\x49\x0f\xaf\xc2',     # imul rax, r10
+    '\x0f\x80' + '__O_',    # jo <overflow>
   ])
   #.cont:
   code['C'] = ''.join([
-    '\x4d\x0f\xaf\xd2',     # imul r10, r10
     '\x48\xd1\xea',         # shr rdx, 1
+    '\x0f\x84' + '__D_',    # jz .end ; (the base is not squared past the last bit)
+    '\x4d\x0f\xaf\xd2',     # imul r10, r10
+    '\x0f\x80' + '__O_',    # jo <overflow>
     '\xe9' + '__B_',        # jmp .loop
   ])
   #.end:
@@ -291,7 +353,8 @@ def _primitive_pow():
     '\xe9' + '__Z_',        # jmp .end
   ])
   code['X'] = boom_code_for(i18n.i18n('Negative exponent'))
-  return _switch('ABCDX', code)
+  code['O'] = boom_code_for(i18n.i18n('Integer overflow'))
+  return _switch('ABCDXO', code)
 
 Inline = {
 
@@ -308,6 +371,8 @@ Inline = {
     '\x4d\x31\xe4', # xor r12, r12
   ]),
 
+  i18n.i18n('GoToBoundary'): _primitive_GoToBoundary(),
+
   i18n.i18n('ClearBoard'): _primitive_ClearBoard(),
 
   i18n.i18n('numStones'): ''.join([
@@ -381,18 +446,21 @@ Inline = {
       '\x58',         # pop rax
       '\x5a',         # pop rdx
       '\x48\x01\xd0', # add rax, rdx
+      jump_on_overflow(),
       '\x50',         # push rax
   ]),
   i18n.i18n('-'): ''.join([
       '\x5a',         # pop rdx
       '\x58',         # pop rax
       '\x48\x29\xd0', # sub rax, rdx
+      jump_on_overflow(),
       '\x50',         # push rax
   ]),
   i18n.i18n('*'): ''.join([
       '\x58',         # pop rax
       '\x5a',         # pop rdx
-      '\x48\xf7\xe2', # mul rdx
+      '\x48\xf7\xea', # imul rdx
+      jump_on_overflow(),
       '\x50',         # push rax
   ]),
 
@@ -418,6 +486,7 @@ Inline = {
   P(i18n.i18n('next'), 'Int'): ''.join([
       '\x58',             # pop rax
       '\x48\xff\xc0',     # inc rax
+      jump_on_overflow(),
       '\x50',             # push rax
   ]),
 
@@ -446,6 +515,7 @@ Inline = {
   P(i18n.i18n('prev'), 'Int'): ''.join([
       '\x58',             # pop rax
       '\x48\xff\xc8',     # dec rax
+      jump_on_overflow(),
       '\x50',             # push rax
   ]),
 
@@ -471,6 +541,7 @@ Inline = {
   P(i18n.i18n('opposite'), 'Int'): ''.join([
       '\x58',             # pop rax
       '\x48\xf7\xd8',     # neg rax
+      jump_on_overflow(),
       '\x50',             # push rax
   ]),
 
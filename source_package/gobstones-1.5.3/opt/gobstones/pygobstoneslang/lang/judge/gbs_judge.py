@@ -22,20 +22,22 @@ import zipfile
 import tempfile
 import shutil
 
-import common.utils
-import common.i18n as i18n
-
-import lang.judge
-import lang.board.formats
-import lang.gbs_board
-import lang.bnf_parser
-import lang.gbs_parser
-import lang.gbs_lint
-import lang.gbs_compiler
-import lang.gbs_vm
-import lang.gbs_vm_serializer
-import lang.gbs_builtins
-import lang.gbs_board
+import pygobstoneslang.common as common
+import pygobstoneslang.common.utils
+import pygobstoneslang.common.i18n as i18n
+
+import pygobstoneslang.lang as lang
+import pygobstoneslang.lang.judge
+import pygobstoneslang.lang.board.formats
+import pygobstoneslang.lang.gbs_board
+import pygobstoneslang.lang.gbs_parser
+import pygobstoneslang.lang.gbs_mexpl
+import pygobstoneslang.lang.gbs_lint
+import pygobstoneslang.lang.gbs_compiler
+import pygobstoneslang.lang.gbs_io
+import pygobstoneslang.lang.gbs_vm
+import pygobstoneslang.lang.gbs_vm_serializer
+import pygobstoneslang.lang.gbs_cache
 
 def read_problem_tree(f):
 
@@ -144,9 +146,23 @@ class ProblemBundle(object):
             res.append(tc.program_name())
         return common.utils.seq_no_repeats(res)
 
+    def load_board(self, problem, board_name):
+        """Returns a fresh copy of the given board. Each board is read
+           and parsed only the first time it is requested."""
+        if not hasattr(self, '_boards'):
+            self._boards = {}
+        board = self._boards.get(board_name)
+        if board is None:
+            board = self._boards[board_name] = self._read_board(problem, board_name)
+        return board.clone()
+
+    def close(self):
+        pass
+
 class SourceProblemBundle(ProblemBundle):
 
     def __init__(self, problem_set):
+        self._fn = problem_set
         self._path = os.path.dirname(problem_set)
         f = open(problem_set, 'r')
         self._problem_tree = read_problem_tree(f)
@@ -163,6 +179,9 @@ class SourceProblemBundle(ProblemBundle):
     def problems(self):
         return self._problem_list
 
+    def filename(self):
+        return self._fn
+
     def options(self, problem): 
         assert problem in self._problem_list
         f = open(os.path.join(self._path, problem, 'problem_type.txt'))
@@ -188,7 +207,7 @@ class SourceProblemBundle(ProblemBundle):
         f.close()
         return src
 
-    def load_board(self, problem, board_name):
+    def _read_board(self, problem, board_name):
         fn = os.path.join(self._path, board_name)
         fmt = lang.board.formats.format_for(fn)
         board = lang.gbs_board.Board((1, 1))
@@ -269,20 +288,40 @@ class GbzProblemBundle(ProblemBundle):
 
     def __init__(self, zipname):
         self._fn = zipname
+        self._zf = None
 
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, '__GBZ__')
+        f = self._open(None, '__GBZ__')
         self._problem_tree = read_problem_tree(f)
         f.close()
-        zf.close()
         self._problem_list = problem_tree_to_list(self._problem_tree)
 
+    def _open(self, problem, filename):
+        """Opens a file of the bundle. The zip file is opened once and
+           kept open until close() is called."""
+        if self._zf is None:
+            self._zf = zipfile.ZipFile(self._fn)
+        if problem is not None:
+            filename = zip_path_join(problem, filename)
+        return zipfile_stream(self._zf, filename)
+
+    def _read(self, problem, filename):
+        f = self._open(problem, filename)
+        contents = f.read()
+        f.close()
+        return contents
+
+    def close(self):
+        if self._zf is not None:
+            self._zf.close()
+            self._zf = None
+
+    def filename(self):
+        return self._fn
+
     def options(self, problem): 
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, 'problem_type.txt'))
+        f = self._open(problem, 'problem_type.txt')
         opts = read_dict_file(f)
         f.close()
-        zf.close()
         return opts
 
     def problems(self):
@@ -292,11 +331,7 @@ class GbzProblemBundle(ProblemBundle):
         return self._problem_tree
 
     def problem_statement(self, problem): 
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, 'problem.html'))
-        statement = f.read()
-        f.close()
-        zf.close()
+        statement = self._read(problem, 'problem.html')
         template = _statement_template
         replacements = {
             '$TITLE': problem,
@@ -308,60 +343,54 @@ class GbzProblemBundle(ProblemBundle):
         return template
 
     def test_cases_for(self, problem):
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, 'tests.txt'))
+        f = self._open(problem, 'tests.txt')
         res = read_run_file(problem, 'test', f)
         f.close()
-        zf.close()
         return res
 
     def load_source(self, problem, source_name):
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, source_name))
-        src = f.read()
-        f.close()
-        zf.close()
-        return src
+        return self._read(problem, source_name)
 
     def load_object(self, problem, source_name):
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, object_for(source_name)))
+        f = self._open(problem, object_for(source_name))
         compiled_code = lang.gbs_vm_serializer.load(f)
         f.close()
-        zf.close()
         return compiled_code
 
-    def load_board(self, problem, board_name):
-        zf = zipfile.ZipFile(self._fn)
+    def _read_board(self, problem, board_name):
         fmt = lang.board.formats.format_for(board_name)
         board = lang.gbs_board.Board((1, 1))
-        f = zipfile_stream(zf, board_name)
+        f = self._open(None, board_name)
         board.load(f, fmt)
         f.close()
-        zf.close()
         return board
 
     def global_fingerprint(self, problem):
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, 'fingerprint.txt'))
-        fgp = f.read()
-        f.close()
-        zf.close()
-        return fgp
+        return self._read(problem, 'fingerprint.txt')
 
     def fingerprint_for_test_case(self, problem, test_case):
-        zf = zipfile.ZipFile(self._fn)
-        f = zipfile_stream(zf, zip_path_join(problem, 'fingerprint_%s.txt' % (test_case.id(),)))
-        fgp = f.read()
-        f.close()
-        zf.close()
-        return fgp
+        return self._read(problem, 'fingerprint_%s.txt' % (test_case.id(),))
+
+def open_bundle(filename):
+    """Returns the problem bundle stored in the given file, which is
+       either a .gbz bundle or the problem set file of a source tree."""
+    if filename.lower().endswith('.gbz'):
+        return GbzProblemBundle(filename)
+    else:
+        return SourceProblemBundle(filename)
 
 def compile_source(contents, fn='...', toplevel_filename=None, log=None):
-    tree = lang.gbs_parser.parse_string_try_prelude(contents, filename=fn, toplevel_filename=toplevel_filename)
-    lang.gbs_lint.lint(tree, strictness='lax')
-    compiled_code = lang.gbs_compiler.compile_program(tree)
-    return compiled_code
+    def compile_program():
+        tree = lang.gbs_parser.parse_string_try_prelude(contents, filename=fn, toplevel_filename=toplevel_filename)
+        lang.gbs_mexpl.mexpl(tree)
+        types = lang.gbs_lint.lint(tree, strictness='lax')
+        compiled_code = lang.gbs_compiler.compile_program(tree)
+        return lang.gbs_cache.CompiledProgram(tree, compiled_code, types)
+    compiled = lang.gbs_cache.compile_cached(compile_program, fn, contents,
+                                             lang.gbs_parser.XGbsGrammarFile,
+                                             ('lax', True, False),
+                                             toplevel_filename=toplevel_filename)
+    return compiled.compiled_program
 
 class CodeDictionary(object):
     def compiled_code_for(self, source_name):
@@ -424,8 +453,9 @@ class CodeDictionaryFromObject(CodeDictionary):
         self.code_dict = code_dict
 
 class TestDriver(object):
-    def __init__(self, bundle, problem, code_dict, fn='...', log=None):
+    def __init__(self, bundle, problem, code_dict, fn='...', log=None, limits=lang.gbs_vm.NO_LIMITS):
         self._bundle = bundle
+        self._limits = limits
         self._problem = problem
         self._code_dict = code_dict
 
@@ -476,8 +506,9 @@ class TestDriver(object):
         self._test_board = self._bundle.load_board(self._problem, self._test_cases[i].board_name())
 
         try:
-            self._vm = lang.gbs_vm.GbsVmInterpreter(toplevel_filename=self._code_dict._solution_filename)
-            self._vm.init_program(compiled_code, self._test_board)
+            self._vm = lang.gbs_vm.GbsVmInterpreter(toplevel_filename=self._code_dict._solution_filename,
+                                                    limits=self._limits)
+            self._vm.init_program(compiled_code, self._test_board, null_interactive_api())
         except common.utils.SourceException as exception:
             self._error_exception = exception
             self._state = 'failed'
@@ -506,6 +537,9 @@ class TestDriver(object):
     def current_test_case(self):
         return self._test_cases[self._current_test_case]
 
+def null_interactive_api():
+    return lang.gbs_io.CrossPlatformApiAdapter(lang.gbs_vm.NullInteractiveAPI())
+
 def solutions_equal(options, sol1, sol2):
     board1, keyval1 = sol1
     board2, keyval2 = sol2